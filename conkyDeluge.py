@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/python3
 # -*- coding: utf-8 -*-
 ###############################################################################
 # conkyDeluge.py is a simple python script to gather
@@ -39,19 +39,144 @@
 #                  Also note that a torrent's state supersedes anything else for sorting,
 #                  in the order, from top to bottom: downloading, seeding, queued, paused, unknown
 #    18/10/2009    Updated to handle new DelugeRPC async methods used in 1.2.0 onwards (will mean this script breaks for previous deluge version users)
-
+#    16/10/2026    Only request the status keys needed by the templates, sort and active filter from the daemon, [nofiles] now uses num_files
+#    16/10/2026    Added --daemon, --interval and --socket options, a long running process keeps one connection open and serves pre-rendered output over a unix socket
+#    16/10/2026    Added --cachefile and --cachettl options, exec calls within the ttl share one snapshot of the torrent status instead of each querying the daemon
+#    16/10/2026    --daemon now polls for status diffs and only re-formats and re-sorts torrents that changed, falling back to a full resync when a diff can't be applied
+#    16/10/2026    Templates are now compiled once into a format string and cached by filepath and modification time, rather than replacing each placeholder per torrent
+#    16/10/2026    Torrents are now ordered on a sort key taken from the raw status and --limit picks the top torrents with a heap, only torrents being output are formatted
+#    16/10/2026    --sortby now takes a comma separated list of sort fields, each optionally suffixed with + or - for ascending or descending, e.g. "state,download-,eta"
+#    16/10/2026    Torrent templates now format only the fields they show straight from the status, without an object per torrent, the summary is totalled column-wise from a flat array
+#    16/10/2026    DelugeInfo takes an optional rpc client so conkyDelugeBench.py can run it against a fake deluge core
+#    16/10/2026    Added --profile and --profiledump options, timings for each stage are output as a single line or appended to the --infologfile, with an optional cProfile dump
+#    16/10/2026    deluge and twisted are now only imported once the deluge core has to be queried, sizes, speeds and times are formatted locally the same way deluge.common does
+#    16/10/2026    Added --host and --timeout options, several deluge cores are queried concurrently and merged into one sorted list and summary, [host] tags each torrent with its core
+#    16/10/2026    Added --connecttimeout, --backoff, --maxbackoff and --offlinetext options, connecting and status requests now have deadlines and a core that is down is backed off from exponentially
+#    16/10/2026    Output is now written to stdout as it is rendered, summary first, rather than built up as one string
+#    16/10/2026    [totalratio] is now the total uploaded over the total done, added [nodownloading], [noseeding], [noqueued], [nopaused], [nochecking] and [noerror] to the summary,
+#                  a summary of only session wide values is taken from the deluge session status and state filter counts without fetching any torrent status
+#    16/10/2026    Added --state option, torrents are filtered by state in the deluge core rather than locally, --activeonly also only requests downloading and seeding torrents
+#    16/10/2026    --daemon keeps rendered torrent output in an LRU cache checked against the status values the template uses, so only torrents that changed are re-rendered
+#    16/10/2026    Log files are now kept open and written through a buffer, flushed on exit or every second by a thread with --daemon, added --logmaxsize for rotating them
+#    16/10/2026    Added [dlavg], [ulavg], [etaavg], [dlgraph] and [ulgraph] to the torrent and summary templates, taken from a ring buffer of rate samples kept by --daemon or in a --historyfile,
+#                  added --history and --historyfile options
+#    16/10/2026    Added --events and --refreshinterval options, --daemon listens for deluge core events and only requests the torrents they name, refreshing rates and the like less often
+#    16/10/2026    Added --section and --sectiondir options, several named sections each with their own options are rendered from one fetch and written to their own files
+#    16/10/2026    Ported to python 3, added --rpc and --rpcprotocol options, a single run now queries the deluge core with a built-in asyncio client rather than
+#                  importing twisted and deluge's client, which --daemon still uses
+#    16/10/2026    Added --workers and --workerthreshold options, long listings are formatted and rendered in chunks by a pool of processes and written in sort order
+#    16/10/2026    Added --format option, json, jsonl and msgpack write the raw numeric status of each torrent and the summary totals for other programs instead of the templates
+#    16/10/2026    Added --metricsport and --metricsaddress options, --daemon serves the totals, state counts and status request time and size histograms to Prometheus over HTTP
+
+import time
+clock = time.monotonic
+IMPORTSTART = clock()
+
+from array import array
+from collections import OrderedDict
 from datetime import datetime
+from itertools import chain
 import gettext
-from deluge.common import ftime, fsize, fspeed
-from deluge.ui.client import client
-from twisted.internet import reactor
+import heapq
+from operator import attrgetter, itemgetter
 from optparse import OptionParser
+import atexit
+import bisect
 import codecs
+import copy
+import fcntl
 import logging
+import marshal
 import os
+import re
+import shlex
+import socket
+import struct
 import sys
+import threading
+import zlib
+IMPORTTIME = clock() - IMPORTSTART
 logging.disable(logging.FATAL) #disable logging within Deluge functions, only output info from this script
 
+VERSION = "2.14.1"
+
+# deluge and twisted are slow to import, so they are only imported by importRPC once the
+# deluge core has to be queried, output served from a cache or socket never needs them,
+# nor does the built-in client
+client = None
+reactor = None
+rencode = None
+
+def importRPC():
+    global client, reactor
+    if reactor == None:
+        from deluge.ui.client import client
+        from twisted.internet import reactor
+
+# the same formatting as deluge.common, kept here so rendering doesn't need deluge imported,
+# dividing once by a power of two gives the same value as dividing by 1024 in steps
+def fsize(fsize_b):
+    if fsize_b < 1048576:
+        return "%.1f KiB" % (fsize_b / 1024.0)
+    if fsize_b < 1073741824:
+        return "%.1f MiB" % (fsize_b / 1048576.0)
+    return "%.1f GiB" % (fsize_b / 1073741824.0)
+
+def fspeed(bps):
+    # most torrents of a large library are idle
+    if bps == 0:
+        return "0.0 KiB/s"
+    if bps < 1048576:
+        return "%.1f KiB/s" % (bps / 1024.0)
+    if bps < 1073741824:
+        return "%.1f MiB/s" % (bps / 1048576.0)
+    return "%.1f GiB/s" % (bps / 1073741824.0)
+
+def ftime(seconds):
+    if seconds == 0:
+        return "Infinity"
+    seconds = int(seconds)
+    if seconds < 60:
+        return "%ds" % seconds
+    minutes = seconds // 60
+    if minutes < 60:
+        return "%dm %ds" % (minutes, seconds % 60)
+    hours = minutes // 60
+    if hours < 24:
+        return "%dh %dm" % (hours, minutes % 60)
+    days = hours // 24
+    if days < 7:
+        return "%dd %dh" % (days, hours % 24)
+    weeks = days // 7
+    if weeks < 52:
+        return "%dw %dd" % (weeks, days % 7)
+    years = weeks // 52
+    return "%dy %dw" % (years, weeks % 52)
+
+def fprogress(progress):
+    # as are the finished ones
+    if progress == 100.0:
+        return "100.0%"
+    # the same text as str(round(progress,2)), without rounding to a float first
+    text = ("%.2f" % progress).rstrip("0")
+    if text[-1] == ".":
+        return text + "0%"
+    return text + "%"
+
+def fratio(ratio):
+    return str(round(ratio,3)).ljust(5,"0")
+
+# counts and graphs may be None as well as missing
+def fcount(count):
+    if count == None:
+        return "?"
+    return str(count)
+
+def fgraph(graph):
+    if graph == None:
+        return ""
+    return graph
+
 class CommandLineParser:
 
     parser = None
@@ -59,99 +184,2205 @@ class CommandLineParser:
     def __init__(self):
 
         self.parser = OptionParser()
-        self.parser.add_option("-s","--server", dest="server", type="string", default="127.0.0.1", metavar="SERVER", help=u"[default: %default] The server to connect to where the deluge core is running")
-        self.parser.add_option("-p","--port", dest="port", type="int", default=58846, metavar="PORT", help=u"[default: %default] The port to connect to where the deluge core is running")
-        self.parser.add_option("-U","--username", dest="username", type="string", metavar="USERNAME", help=u"The username to use when connecting, can be left unset if none is required")
-        self.parser.add_option("-P","--password", dest="password", type="string", metavar="PASSWORD", help=u"The password to use when connecting, can be left unset if none is required")
-        self.parser.add_option("-S","--showsummary",dest="showsummary", default=False, action="store_true", help=u"Display summary output. This is affected by the --activeonly option.")
-        self.parser.add_option("-H","--hidetorrentdetail",dest="hidetorrentdetail", default=False, action="store_true", help=u"Hide torrent detail output, if used no torrent details are output.")
-        self.parser.add_option("-t","--torrenttemplate",dest="torrenttemplate", type="string", metavar="FILE", help=u"Template file determining the format for each torrent. Use the following placeholders: [name], [state], [totaldone], [totalsize], [progress], [nofiles], [downloadrate], [uploadrate], [eta], [currentpeers], [currentseeds], [totalpeers], [totalseeds], [ratio].")
-        self.parser.add_option("-T","--summarytemplate",dest="summarytemplate", type="string", metavar="FILE", help=u"Template file determining the format for summary output. Use the following placeholders: [notorrents], [totalprogress], [totaldone], [totalsize], [totaldownloadrate], [totaluploadrate], [totaleta], [currentpeers], [currentseeds], [totalpeers], [totalseeds], [totalratio].")
-        self.parser.add_option("-a", "--activeonly", dest="activeonly", default=False, action="store_true", help=u"If set only info for torrents in an active state will be displayed.")
-        self.parser.add_option("-l","--limit",dest="limit", default=0, type="int", metavar="NUMBER", help=u"[default: %default] Define the maximum number of torrents to display, zero means no limit.")
-        self.parser.add_option("-b","--sortby",dest="sortby", default="eta", type="string", metavar="SORTTYPE", help=u"Define the sort method for output, can be \"progress\", \"queue\", \"eta\", \"download\", \"upload\" and \"ratio\". Also note that a torrent's state supersedes anything else for sorting, in the order, from top to bottom: downloading, seeding, queued, paused, unknown)")
-        self.parser.add_option("-v","--verbose",dest="verbose", default=False, action="store_true", help=u"Request verbose output, no a good idea when running through conky!")
-        self.parser.add_option("-V", "--version", dest="version", default=False, action="store_true", help=u"Displays the version of the script.")
-        self.parser.add_option("--errorlogfile", dest="errorlogfile", type="string", metavar="FILE", help=u"If a filepath is set, the script appends errors to the filepath.")
-        self.parser.add_option("--infologfile", dest="infologfile", type="string", metavar="FILE", help=u"If a filepath is set, the script appends info to the filepath.")
+        self.parser.add_option("-s","--server", dest="server", type="string", default="127.0.0.1", metavar="SERVER", help="[default: %default] The server to connect to where the deluge core is running")
+        self.parser.add_option("-p","--port", dest="port", type="int", default=58846, metavar="PORT", help="[default: %default] The port to connect to where the deluge core is running")
+        self.parser.add_option("-U","--username", dest="username", type="string", metavar="USERNAME", help="The username to use when connecting, can be left unset if none is required")
+        self.parser.add_option("-P","--password", dest="password", type="string", metavar="PASSWORD", help="The password to use when connecting, can be left unset if none is required")
+        self.parser.add_option("--host", dest="hosts", type="string", action="append", metavar="[USER[:PASS]@]SERVER[:PORT]", help="A deluge core to query instead of --server, can be given several times to merge the torrents of each core into one output. The --port, --username and --password options are used where not given.")
+        self.parser.add_option("--connecttimeout", dest="connecttimeout", default=5, type="float", metavar="SECONDS", help="[default: %default] How long connecting and logging in to the deluge core may take before giving up.")
+        self.parser.add_option("--timeout", dest="timeout", default=10, type="float", metavar="SECONDS", help="[default: %default] How long the deluge core has to answer the status request once connected. With several --host options the output of a slower core is left out rather than holding up the others.")
+        self.parser.add_option("--backoff", dest="backoff", default=0, type="float", metavar="SECONDS", help="[default: %default] If set, a deluge core that can't be reached isn't tried again for this many seconds, doubling with each further failure, and the --offlinetext is output instead. Zero disables backing off.")
+        self.parser.add_option("--maxbackoff", dest="maxbackoff", default=300, type="float", metavar="SECONDS", help="[default: %default] The longest wait between attempts to reach a deluge core when using --backoff.")
+        self.parser.add_option("--offlinetext", dest="offlinetext", default="Deluge offline", type="string", metavar="TEXT", help="[default: %default] The text output when using --backoff and no deluge core can be reached.")
+        self.parser.add_option("--rpc", dest="rpc", default="asyncio", type="choice", choices=["asyncio", "deluge"], metavar="CLIENT", help="[default: %default] The client used to query the deluge core, \"asyncio\" for the one built in, which needs neither deluge nor twisted installed, or \"deluge\" for deluge's own client. --daemon always uses deluge's own client.")
+        self.parser.add_option("--rpcprotocol", dest="rpcprotocol", default=2, type="int", metavar="VERSION", help="[default: %default] The rpc protocol the built-in client speaks, 2 for a deluge 2 core or 1 for a deluge 1.3 core.")
+        self.parser.add_option("-S","--showsummary",dest="showsummary", default=False, action="store_true", help="Display summary output. This is affected by the --activeonly option.")
+        self.parser.add_option("-H","--hidetorrentdetail",dest="hidetorrentdetail", default=False, action="store_true", help="Hide torrent detail output, if used no torrent details are output.")
+        self.parser.add_option("-t","--torrenttemplate",dest="torrenttemplate", type="string", metavar="FILE", help="Template file determining the format for each torrent. Use the following placeholders: [name], [host], [state], [totaldone], [totalsize], [progress], [nofiles], [downloadrate], [uploadrate], [eta], [currentpeers], [currentseeds], [totalpeers], [totalseeds], [ratio], [dlavg], [ulavg], [etaavg], [dlgraph], [ulgraph].")
+        self.parser.add_option("-T","--summarytemplate",dest="summarytemplate", type="string", metavar="FILE", help="Template file determining the format for summary output. Use the following placeholders: [notorrents], [totalprogress], [totaldone], [totalsize], [totaldownloadrate], [totaluploadrate], [totaleta], [currentpeers], [currentseeds], [totalpeers], [totalseeds], [totalratio], [nodownloading], [noseeding], [noqueued], [nopaused], [nochecking], [noerror], [dlavg], [ulavg], [dlgraph], [ulgraph].")
+        self.parser.add_option("-a", "--activeonly", dest="activeonly", default=False, action="store_true", help="If set only info for torrents in an active state will be displayed.")
+        self.parser.add_option("--state", dest="states", type="string", metavar="STATES", help="A comma separated list of torrent states to display, e.g. \"Downloading,Seeding\". The deluge core does the filtering so other torrents aren't sent at all. This affects the summary like the --activeonly option.")
+        self.parser.add_option("-l","--limit",dest="limit", default=0, type="int", metavar="NUMBER", help="[default: %default] Define the maximum number of torrents to display, zero means no limit.")
+        self.parser.add_option("-b","--sortby",dest="sortby", default="eta", type="string", metavar="SORTTYPE", help="[default: %default] Define the sort method for output, a comma separated list of \"state\", \"progress\", \"queue\", \"eta\", \"download\", \"upload\" and \"ratio\", each optionally followed by + for ascending or - for descending order, e.g. \"state,download-,eta\". Without a suffix progress, download, upload and ratio are highest first, queue and eta lowest first. Unless placed elsewhere in the list a torrent's state supersedes anything else for sorting, in the order, from top to bottom: downloading, seeding, queued, paused, unknown")
+        self.parser.add_option("--workers", dest="workers", default=0, type="int", metavar="NUMBER", help="[default: %default] If set above 1, the torrents being output are formatted and rendered by a pool of this many processes, for very long listings e.g. exported with --limit=0.")
+        self.parser.add_option("--workerthreshold", dest="workerthreshold", default=2000, type="int", metavar="NUMBER", help="[default: %default] With --workers, fewer torrents than this to render are rendered in process, as starting and feeding the pool would take longer.")
+        self.parser.add_option("--format", dest="format", type="choice", choices=["text", "json", "jsonl", "msgpack"], default="text", metavar="FORMAT", help="[default: %default] Either text, the templates rendered for conky, or json, jsonl or msgpack for other programs. These write the raw values of each torrent rather than the templates: sizes in bytes, rates in bytes per second, eta in seconds, ratio and a numeric state_code, with the same sort, --limit and filtering. json writes one document, jsonl a JSON object per line and msgpack one object after another, the summary first with --showsummary.")
+        self.parser.add_option("-v","--verbose",dest="verbose", default=False, action="store_true", help="Request verbose output, no a good idea when running through conky!")
+        self.parser.add_option("-V", "--version", dest="version", default=False, action="store_true", help="Displays the version of the script.")
+        self.parser.add_option("--errorlogfile", dest="errorlogfile", type="string", metavar="FILE", help="If a filepath is set, the script appends errors to the filepath.")
+        self.parser.add_option("--infologfile", dest="infologfile", type="string", metavar="FILE", help="If a filepath is set, the script appends info to the filepath.")
+        self.parser.add_option("--logmaxsize", dest="logmaxsize", default=1024, type="int", metavar="KIB", help="[default: %default] When a log file grows past this size it is moved aside to the filepath with .1 appended and a new one is started, zero means no limit.")
+        self.parser.add_option("-D", "--daemon", dest="daemon", default=False, action="store_true", help="Keep running, polling the deluge core every --interval seconds and serving the rendered output on the --socket filepath.")
+        self.parser.add_option("--events", dest="events", default=False, action="store_true", help="With --daemon, listen for torrents being added, removed, finished or changing state and only request those torrents on the next poll, rather than every torrent on every poll. Rates, eta and other values deluge doesn't send events for are refreshed every --refreshinterval seconds. Not used with --host.")
+        self.parser.add_option("--refreshinterval", dest="refreshinterval", default=30, type="float", metavar="SECONDS", help="[default: %default] How often the values that change without an event are refreshed when using --events.")
+        self.parser.add_option("--interval", dest="interval", default=5, type="float", metavar="SECONDS", help="[default: %default] How often the deluge core is polled when running with --daemon.")
+        self.parser.add_option("--cachefile", dest="cachefile", type="string", metavar="FILE", help="If a filepath is set, the torrent status fetched from the deluge core is stored there and reused by other calls within --cachettl seconds. A bare filename is kept in $XDG_RUNTIME_DIR, or ~/.cache/conkydeluge without it. A file owned by another user is never loaded.")
+        self.parser.add_option("--cachettl", dest="cachettl", default=4, type="float", metavar="SECONDS", help="[default: %default] How long a --cachefile snapshot is reused before the deluge core is queried again.")
+        self.parser.add_option("--history", dest="history", default=12, type="int", metavar="NUMBER", help="[default: %default] How many download and upload rate samples [dlavg], [ulavg], [etaavg], [dlgraph] and [ulgraph] are taken over. A sample is taken on each --daemon poll, or each time the deluge core is queried when using --historyfile.")
+        self.parser.add_option("--historyfile", dest="historyfile", type="string", metavar="FILE", help="If a filepath is set, the rate history is kept there between calls, best shared with the same --cachefile so a sample is only taken once for each refresh. A bare filename is kept where --cachefile keeps one. Without it, or --daemon, only the current rates are known.")
+        self.parser.add_option("--socket", dest="socket", type="string", metavar="FILE", help="Unix socket filepath used to serve output when running with --daemon. Without --daemon the output is read from the socket if a daemon is listening, otherwise the deluge core is queried directly.")
+        self.parser.add_option("--metricsport", dest="metricsport", type="int", metavar="PORT", help="If set, --daemon serves metrics for Prometheus over HTTP on this port at /metrics: the summary totals, the torrents in each state and histograms of the time taken and size of the status requests. They are worked out on each poll, so a scrape never queries the deluge core.")
+        self.parser.add_option("--metricsaddress", dest="metricsaddress", default="127.0.0.1", type="string", metavar="ADDRESS", help="[default: %default] The address --metricsport listens on, 0.0.0.0 for any.")
+        self.parser.add_option("--section", dest="sections", type="string", action="append", metavar="NAME:OPTIONS", help="Render a named section of output, written to a file of that name in the --sectiondir, with its own options, e.g. \"downloading:--state=Downloading --limit=5 --sortby=download\". Can be given several times, the torrent status is fetched once for them all. Options not given are those of the command line. With --section nothing is written to stdout.")
+        self.parser.add_option("--sectiondir", dest="sectiondir", type="string", metavar="DIR", help="The directory each --section is written to, each file being replaced as a whole so it can be read at any time.")
+        self.parser.add_option("--profile", dest="profile", default=False, action="store_true", help="Output the time taken by each stage as a single line to stderr, or append it to the --infologfile if set. With --daemon a line is output for each poll.")
+        self.parser.add_option("--profiledump", dest="profiledump", type="string", metavar="FILE", help="If a filepath is set, the whole run is profiled with cProfile and the stats are written to the filepath, for use with the pstats module.")
 
     def parse_args(self):
         (options, args) = self.parser.parse_args()
         return (options, args)
 
+    def parse_section(self, spec, options):
+
+        # returns (name, options) for a --section, its options starting from the command line's
+        name, separator, args = spec.partition(":")
+        name = name.strip()
+        if re.match(r"^[\w.-]+$", name) == None or name in (".", ".."):
+            raise ValueError("invalid section name: %s"%name)
+
+        sectionoptions = copy.copy(options)
+        sectionoptions.hosts = options.hosts and list(options.hosts)
+        (sectionoptions, sectionargs) = self.parser.parse_args(shlex.split(args), sectionoptions)
+        sectionoptions.sections = None
+        return (name, sectionoptions)
+
     def print_help(self):
         return self.parser.print_help()
 
-class TorrentData:
-
-    def __init__(self, name, state, statecode, totaldone, totalsize, progress, nofiles, downloadrate, downloadtext, uploadrate, uploadtext, eta, etatext, currentpeers, currentseeds, totalpeers, totalseeds, ratio, queueorder, sortby):
-        self.name = name
-        self.state = state
-        self.statecode = statecode
-        self.totaldone = totaldone
-        self.totalsize = totalsize
-        self.progress = progress
-        self.nofiles = nofiles
-        self.downloadrate = downloadrate
-        self.downloadtext = downloadtext
-        self.uploadrate = uploadrate
-        self.uploadtext = uploadtext
-        self.eta = eta
-        self.etatext = etatext
-        self.currentpeers = currentpeers
-        self.currentseeds = currentseeds
-        self.totalpeers = totalpeers
-        self.totalseeds = totalseeds
-        self.ratio = ratio
-        self.queueorder = queueorder
-        self.sortby = sortby
-
-    def __cmp__(self, other):
-        if self.sortby == "progress":
-            return cmp(self.getProgressOrder(self.statecode,self.progress) , self.getProgressOrder(other.statecode,other.progress))
-        elif self.sortby == "queue":
-            return cmp(self.getQueueOrder(self.statecode,self.queueorder) , self.getQueueOrder(other.statecode,other.queueorder))
-        elif self.sortby == "eta":
-            return cmp(self.getETAOrder(self.statecode,self.eta) , self.getETAOrder(other.statecode,other.eta))
-        elif self.sortby == "download":
-            return cmp(self.getRateOrder(self.statecode,self.downloadrate) , self.getRateOrder(other.statecode,other.downloadrate))
-        elif self.sortby == "upload":
-            return cmp(self.getRateOrder(self.statecode,self.uploadrate) , self.getRateOrder(other.statecode,other.uploadrate))
-        elif self.sortby == "ratio":
-            return cmp(self.getRatioOrder(self.statecode,self.ratio) , self.getRatioOrder(other.statecode,other.ratio))
+class TorrentData(object):
+
+    # the status key, the function formatting its value and the text for a missing value, for each
+    # torrent template placeholder, values are formatted straight from the status dict
+    FIELDS = {
+        "name": ("name", None, "Unknown"),
+        "host": ("host", None, ""),
+        "state": ("state", None, "Unknown"),
+        "totaldone": ("total_done", fsize, "??.? KiB"),
+        "totalsize": ("total_wanted", fsize, "??.? KiB"),
+        "progress": ("progress", fprogress, "?.?%"),
+        "nofiles": ("num_files", fcount, "?"),
+        "downloadrate": ("download_payload_rate", fspeed, "?.? KiB/s"),
+        "uploadrate": ("upload_payload_rate", fspeed, "?.? KiB/s"),
+        "eta": ("eta", ftime, "Unknown"),
+        "currentpeers": ("num_peers", fcount, "?"),
+        "currentseeds": ("num_seeds", fcount, "?"),
+        "totalpeers": ("total_peers", fcount, "?"),
+        "totalseeds": ("total_seeds", fcount, "?"),
+        "ratio": ("ratio", fratio, "?.???"),
+        # added to the status from the rate history, rather than sent by deluge
+        "dlavg": ("download_average", fspeed, "?.? KiB/s"),
+        "ulavg": ("upload_average", fspeed, "?.? KiB/s"),
+        "etaavg": ("eta_average", ftime, "Unknown"),
+        "dlgraph": ("download_graph", fgraph, ""),
+        "ulgraph": ("upload_graph", fgraph, "")
+    }
+
+    @staticmethod
+    def getTexts(torrent_status, fieldnames):
+        # the slow way round, for a status missing a value or holding None
+        texts = []
+        for fieldname in fieldnames:
+            (key, formatter, missing) = TorrentData.FIELDS[fieldname]
+            value = torrent_status.get(key)
+            if value == None:
+                texts.append(missing)
+            elif formatter == None:
+                texts.append(value)
+            else:
+                texts.append(formatter(value))
+        return tuple(texts)
+
+def getTorrentGetter(fieldnames):
+
+    # compiles the function giving the text of each template field from a torrent status, as
+    # namedtuple does, so a field costs one lookup and one call rather than a loop over them all
+    namespace = {"getTexts": TorrentData.getTexts, "fieldnames": tuple(fieldnames)}
+    expressions = []
+    for (index, fieldname) in enumerate(fieldnames):
+        (key, formatter, missing) = TorrentData.FIELDS[fieldname]
+        if formatter == None:
+            expressions.append("torrent_status[%r]" % key)
+        else:
+            namespace["format%d" % index] = formatter
+            expressions.append("format%d(torrent_status[%r])" % (index, key))
+
+    source = "def getter(torrent_status):\n    try:\n        return (%s,)\n    except (KeyError, TypeError):\n        return getTexts(torrent_status, fieldnames)\n" % ", ".join(expressions)
+    exec(source, namespace)
+    return namespace["getter"]
+
+class SummaryData(object):
+
+    __slots__ = ("notorrents", "totaldone", "totalsize", "totaluploaded", "downloadrate", "uploadrate", "highesteta", "currentpeers", "currentseeds", "totalpeers", "totalseeds", "statecounts", "torrent_status_list", "downloadaverage", "uploadaverage", "downloadgraph", "uploadgraph")
+
+    # attribute holding the text for each summary template placeholder
+    ATTRIBUTES = {
+        "notorrents": "notorrentstext",
+        "totalprogress": "totalprogresstext",
+        "totaldone": "totaldonetext",
+        "totalsize": "totalsizetext",
+        "totaldownloadrate": "downloadtext",
+        "totaluploadrate": "uploadtext",
+        "totaleta": "etatext",
+        "currentpeers": "currentpeerstext",
+        "currentseeds": "currentseedstext",
+        "totalpeers": "totalpeerstext",
+        "totalseeds": "totalseedstext",
+        "totalratio": "totalratiotext",
+        "nodownloading": "nodownloadingtext",
+        "noseeding": "noseedingtext",
+        "noqueued": "noqueuedtext",
+        "nopaused": "nopausedtext",
+        "nochecking": "nocheckingtext",
+        "noerror": "noerrortext",
+        "dlavg": "downloadaveragetext",
+        "ulavg": "uploadaveragetext",
+        "dlgraph": "downloadgraphtext",
+        "ulgraph": "uploadgraphtext"
+    }
+
+    # summary attribute totalled from each status key
+    TOTALS = (
+        ("totaldone", "total_done"),
+        ("totalsize", "total_wanted"),
+        ("totaluploaded", "total_uploaded"),
+        ("downloadrate", "download_payload_rate"),
+        ("uploadrate", "upload_payload_rate"),
+        ("currentpeers", "num_peers"),
+        ("currentseeds", "num_seeds"),
+        ("totalpeers", "total_peers"),
+        ("totalseeds", "total_seeds")
+    )
+
+    def __init__(self, torrent_status_list, keys):
+
+        self.notorrents = len(torrent_status_list)
+        for (attribute, key) in self.TOTALS:
+            setattr(self, attribute, 0)
+        self.highesteta = 0
+
+        # set from the rate history when the template asks for them
+        self.downloadaverage = None
+        self.uploadaverage = None
+        self.downloadgraph = None
+        self.uploadgraph = None
+
+        # torrents in each state are only counted if the template asks for them
+        self.statecounts = None
+        self.torrent_status_list = torrent_status_list
+
+        # gather every requested column into one flat array and total each column with a slice
+        columns = [(attribute, key) for (attribute, key) in self.TOTALS if key in keys]
+        if "eta" in keys:
+            columns.append(("highesteta", "eta"))
+
+        if len(columns) == 0 or self.notorrents == 0:
+            return
+
+        getter = itemgetter(*[key for (attribute, key) in columns])
+        try:
+            if len(columns) == 1:
+                values = array("d", map(getter, torrent_status_list))
+            else:
+                values = array("d", chain.from_iterable(map(getter, torrent_status_list)))
+        except KeyError:
+            # a status is missing a key, total each column the slow way instead
+            values = array("d")
+            for torrent_status in torrent_status_list:
+                values.extend([torrent_status.get(key, 0) for (attribute, key) in columns])
+
+        count = len(columns)
+        for (index, (attribute, key)) in enumerate(columns):
+            column = values[index::count]
+            if attribute == "highesteta":
+                self.highesteta = max(0, int(max(column)))
+            elif attribute in ("totaldone", "totalsize", "totaluploaded", "currentpeers", "currentseeds", "totalpeers", "totalseeds"):
+                setattr(self, attribute, int(sum(column)))
+            else:
+                setattr(self, attribute, sum(column))
+
+    @property
+    def notorrentstext(self):
+        return str(self.notorrents)
+
+    @property
+    def totalprogresstext(self):
+        if self.totalsize > 0:
+            return str(round((float(self.totaldone) / float(self.totalsize)) *100,2))+"%"
+        return "?.?%"
+
+    @property
+    def totaldonetext(self):
+        return fsize(self.totaldone)
+
+    @property
+    def totalsizetext(self):
+        return fsize(self.totalsize)
+
+    @property
+    def downloadtext(self):
+        return fspeed(self.downloadrate)
+
+    @property
+    def uploadtext(self):
+        return fspeed(self.uploadrate)
+
+    @property
+    def etatext(self):
+        return ftime(self.highesteta)
+
+    @property
+    def currentpeerstext(self):
+        return str(self.currentpeers)
+
+    @property
+    def currentseedstext(self):
+        return str(self.currentseeds)
+
+    @property
+    def totalpeerstext(self):
+        return str(self.totalpeers)
+
+    @property
+    def totalseedstext(self):
+        return str(self.totalseeds)
+
+    @property
+    def totalratiotext(self):
+        if self.totaldone > 0:
+            return str(round(float(self.totaluploaded) / self.totaldone,3)).ljust(5,"0")
+        return "?.???"
+
+    def getRecord(self):
+
+        # the raw summary values for --format, named like the status keys they total
+        record = {"torrents": self.notorrents}
+        for (attribute, key) in self.TOTALS:
+            record[key] = getattr(self, attribute)
+        record["eta"] = self.highesteta
+        self.getStateCount(None)
+        record["states"] = self.statecounts
+
+        if self.downloadaverage != None:
+            record["download_average"] = self.downloadaverage
+            record["upload_average"] = self.uploadaverage
+
+        return record
+
+    def getStateCount(self, state):
+        if self.statecounts == None:
+            self.statecounts = {}
+            for torrentstate in map(itemgetter("state"), self.torrent_status_list):
+                self.statecounts[torrentstate] = self.statecounts.get(torrentstate, 0) + 1
+        return self.statecounts.get(state, 0)
+
+    @property
+    def downloadaveragetext(self):
+        if self.downloadaverage == None:
+            return "?.? KiB/s"
+        return fspeed(self.downloadaverage)
+
+    @property
+    def uploadaveragetext(self):
+        if self.uploadaverage == None:
+            return "?.? KiB/s"
+        return fspeed(self.uploadaverage)
+
+    @property
+    def downloadgraphtext(self):
+        if self.downloadgraph == None:
+            return ""
+        return self.downloadgraph
+
+    @property
+    def uploadgraphtext(self):
+        if self.uploadgraph == None:
+            return ""
+        return self.uploadgraph
+
+    @property
+    def nodownloadingtext(self):
+        return str(self.getStateCount("Downloading"))
+
+    @property
+    def noseedingtext(self):
+        return str(self.getStateCount("Seeding"))
+
+    @property
+    def noqueuedtext(self):
+        return str(self.getStateCount("Queued"))
+
+    @property
+    def nopausedtext(self):
+        return str(self.getStateCount("Paused"))
+
+    @property
+    def nocheckingtext(self):
+        return str(self.getStateCount("Checking"))
+
+    @property
+    def noerrortext(self):
+        return str(self.getStateCount("Error"))
+
+class Template:
+
+    PLACEHOLDER = re.compile(r"\[(\w+)\]")
+
+    def __init__(self, text, attributes, getGetter=None):
+
+        self.text = text
+        self.attributes = attributes
+        # makes the getter for the placeholders found, otherwise each is an attribute of the data
+        self.getGetter = getGetter
+
+        # compile the template into a format string with a slot per known placeholder, unknown
+        # placeholders are left in the output as they are
+        formatparts = []
+        fieldnames = []
+        position = 0
+
+        for match in self.PLACEHOLDER.finditer(text):
+            if match.group(1) in attributes:
+                formatparts.append(text[position:match.start()].replace("%", "%%"))
+                formatparts.append("%s")
+                fieldnames.append(match.group(1))
+                position = match.end()
+
+        # get rid of any excess crlf's and add just one, the value of a trailing placeholder
+        # may also need stripping when rendering
+        tail = text[position:].rstrip(" \n")
+        self.striptail = len(fieldnames) > 0 and len(tail) == 0
+        formatparts.append(tail.replace("%", "%%"))
+        formatparts.append("\n")
+
+        self.format = "".join(formatparts)
+        self.fields = set(fieldnames)
+
+        if len(fieldnames) == 0:
+            self.getter = None
+        elif getGetter != None:
+            self.getter = getGetter(fieldnames)
+        elif len(fieldnames) == 1:
+            getter = attrgetter(attributes[fieldnames[0]])
+            self.getter = lambda data: (getter(data),)
         else:
-            return 0
+            self.getter = attrgetter(*[attributes[fieldname] for fieldname in fieldnames])
+
+    def render(self, data):
+
+        if self.getter == None:
+            return self.format
+
+        output = self.format % self.getter(data)
+        if self.striptail == True and output[-2:-1] in " \n":
+            output = output.rstrip(" \n") + "\n"
+
+        return output
+
+    def __reduce__(self):
+        # the getter can't be pickled, a --workers process compiles the template again instead
+        return (Template, (self.text, self.attributes, self.getGetter))
+
+class TemplateLoader:
+
+    def __init__(self):
+        self.templates = {}
+
+    def load(self, path, attributes, getGetter=None):
+
+        # reuse the compiled template until the file is modified
+        path = os.path.expanduser(path)
+        mtime = os.stat(path).st_mtime
+
+        cached = self.templates.get(path)
+        if cached != None and cached[0] == mtime:
+            return cached[1]
+
+        fileinput = codecs.open(path, encoding='utf-8')
+        try:
+            template = Template(fileinput.read(), attributes, getGetter)
+        finally:
+            fileinput.close()
+
+        self.templates[path] = (mtime, template)
+        return template
+
+class FieldProjection:
+
+    # status keys required to fill in each torrent template placeholder
+    TORRENT_FIELDS = {
+        "name": ["name"],
+        "host": [],
+        "state": ["state"],
+        "totaldone": ["total_done"],
+        "totalsize": ["total_wanted"],
+        "progress": ["progress"],
+        "nofiles": ["num_files"],
+        "downloadrate": ["download_payload_rate"],
+        "uploadrate": ["upload_payload_rate"],
+        "eta": ["eta"],
+        "currentpeers": ["num_peers"],
+        "currentseeds": ["num_seeds"],
+        "totalpeers": ["total_peers"],
+        "totalseeds": ["total_seeds"],
+        "ratio": ["ratio"],
+        "dlavg": [],
+        "ulavg": [],
+        "etaavg": ["total_done", "total_wanted"],
+        "dlgraph": [],
+        "ulgraph": []
+    }
+
+    # status keys added locally for each torrent template placeholder, rather than requested
+    LOCAL_FIELDS = {
+        "host": ["host"],
+        "dlavg": ["download_average"],
+        "ulavg": ["upload_average"],
+        "etaavg": ["eta_average"],
+        "dlgraph": ["download_graph"],
+        "ulgraph": ["upload_graph"]
+    }
+
+    # status keys required to fill in each summary template placeholder
+    SUMMARY_FIELDS = {
+        "notorrents": [],
+        "totalprogress": ["total_done", "total_wanted"],
+        "totaldone": ["total_done"],
+        "totalsize": ["total_wanted"],
+        "totaldownloadrate": ["download_payload_rate"],
+        "totaluploadrate": ["upload_payload_rate"],
+        "totaleta": ["eta"],
+        "currentpeers": ["num_peers"],
+        "currentseeds": ["num_seeds"],
+        "totalpeers": ["total_peers"],
+        "totalseeds": ["total_seeds"],
+        "totalratio": ["total_uploaded", "total_done"],
+        "nodownloading": [],
+        "noseeding": [],
+        "noqueued": [],
+        "nopaused": [],
+        "nochecking": [],
+        "noerror": [],
+        "dlavg": [],
+        "ulavg": [],
+        "dlgraph": [],
+        "ulgraph": []
+    }
+
+    # placeholders filled in from the rate history
+    HISTORY_FIELDS = set(["dlavg", "ulavg", "etaavg", "dlgraph", "ulgraph"])
+
+    # status keys the rate history records, the state totalling the rates for the summary
+    HISTORY_KEYS = ["state", "download_payload_rate", "upload_payload_rate"]
+
+    # summary placeholders deluge can answer from its session status and state filter counts alone
+    SESSION_FIELDS = set(["notorrents", "totaldownloadrate", "totaluploadrate", "nodownloading", "noseeding", "noqueued", "nopaused", "nochecking", "noerror"])
+
+    # status keys required by the --activeonly filter
+    ACTIVE_FIELDS = ["num_peers", "num_seeds"]
+
+    # status keys totalled for --metricsport
+    METRICS_FIELDS = ["state"] + [key for (attribute, key) in SummaryData.TOTALS]
+
+    # status keys written for each torrent by --format, in order
+    RECORD_FIELDS = ["name", "state", "total_done", "total_wanted", "progress", "num_files", "download_payload_rate", "upload_payload_rate", "eta", "num_peers", "num_seeds", "total_peers", "total_seeds", "ratio"]
+
+    def __init__(self, options, torrenttemplate, summarytemplate, sortspec):
+        self.options = options
+        self.torrenttemplate = torrenttemplate
+        self.summarytemplate = summarytemplate
+        self.sortspec = sortspec
+
+    def getKeys(self):
+
+        # state is always needed, a torrent can't be described without it
+        keys = set(["state"])
+
+        if self.options.hidetorrentdetail == False:
+            if self.usesRecords() == True:
+                keys.update(self.RECORD_FIELDS)
+            else:
+                for placeholder in self.torrenttemplate.fields:
+                    keys.update(self.TORRENT_FIELDS.get(placeholder, []))
+            keys.update(self.sortspec.getKeys())
+
+        if self.options.showsummary == True:
+            if self.usesRecords() == True:
+                keys.update([key for (attribute, key) in SummaryData.TOTALS] + ["eta"])
+            else:
+                for placeholder in self.summarytemplate.fields:
+                    keys.update(self.SUMMARY_FIELDS.get(placeholder, []))
+
+        if self.options.activeonly == True:
+            keys.update(self.ACTIVE_FIELDS)
+
+        if self.usesHistory() == True:
+            keys.update(self.HISTORY_KEYS)
+
+        if self.options.metricsport != None:
+            keys.update(self.METRICS_FIELDS)
+
+        return sorted(keys)
+
+    def usesRecords(self):
+        return self.options.format != "text"
+
+    def usesRecordHistory(self):
+        # averages are only worth writing with samples kept between calls
+        return self.usesRecords() == True and (self.options.daemon == True or self.options.historyfile != None)
+
+    def usesTorrentHistory(self):
+        if self.usesRecords() == True:
+            return self.options.hidetorrentdetail == False and self.usesRecordHistory() == True
+        return self.options.hidetorrentdetail == False and len(self.torrenttemplate.fields.intersection(self.HISTORY_FIELDS)) > 0
+
+    def usesSummaryHistory(self):
+        if self.usesRecords() == True:
+            return self.options.showsummary == True and self.usesRecordHistory() == True
+        return self.options.showsummary == True and len(self.summarytemplate.fields.intersection(self.HISTORY_FIELDS)) > 0
+
+    def usesHistory(self):
+        # a --historyfile is kept up to date for other calls sharing it, whatever the templates show
+        return self.options.historyfile != None or self.usesTorrentHistory() == True or self.usesSummaryHistory() == True
+
+    def getRecordKeys(self, hosts):
+        # the status keys written for each torrent by --format, the host only when there's more than one
+        keys = list(self.RECORD_FIELDS)
+        if hosts == True:
+            keys.append("host")
+        if self.usesTorrentHistory() == True:
+            keys.extend(["download_average", "upload_average", "eta_average"])
+        return keys
+
+    def getTorrentTemplateKeys(self):
+
+        # the status keys a rendered torrent depends on, including those added to the status locally
+        keys = set()
+        for placeholder in self.torrenttemplate.fields:
+            keys.update(self.TORRENT_FIELDS.get(placeholder, []))
+            keys.update(self.LOCAL_FIELDS.get(placeholder, []))
+        return sorted(keys)
+
+    def isSessionSummary(self):
+        # a summary on its own of all torrents, that needs no torrent status at all
+        # the records of --format always hold the full totals
+        return self.options.showsummary == True and self.options.hidetorrentdetail == True and self.options.activeonly == False and self.options.states == None and self.usesRecords() == False and self.summarytemplate.fields.issubset(self.SESSION_FIELDS)
+
+class SortSpec:
+
+    # method returning the value to sort on, the status key it needs and whether the highest
+    # value comes first by default, for each sort field
+    FIELDS = {
+        "state": ("getState", "state", True),
+        "progress": ("getProgress", "progress", True),
+        "queue": ("getQueue", "queue", False),
+        "eta": ("getETA", "eta", False),
+        "download": ("getDownload", "download_payload_rate", True),
+        "upload": ("getUpload", "upload_payload_rate", True),
+        "ratio": ("getRatio", "ratio", True)
+    }
+
+    INFINITY = float("inf")
+
+    def __init__(self, spec):
+
+        self.fields = []
+        self.unknown = []
+
+        for sortfield in spec.split(","):
+            sortfield = sortfield.strip().lower()
+            if sortfield == "":
+                continue
+
+            descending = None
+            if sortfield[-1] in "+-":
+                descending = sortfield[-1] == "-"
+                sortfield = sortfield[:-1]
+
+            if sortfield not in self.FIELDS:
+                self.unknown.append(sortfield)
+                continue
+
+            if descending == None:
+                descending = self.FIELDS[sortfield][2]
+
+            self.fields.append((sortfield, descending))
+
+        # a torrent's state supersedes anything else for sorting unless it's placed elsewhere
+        if "state" not in [sortfield for (sortfield, descending) in self.fields]:
+            self.fields.insert(0, ("state", True))
+
+        self.getters = [(getattr(self, self.FIELDS[sortfield][0]), descending) for (sortfield, descending) in self.fields]
 
     def __str__(self):
-        return str(self.name + " - " + self.eta)
+        return ",".join([sortfield + (descending and "-" or "+") for (sortfield, descending) in self.fields])
+
+    def getKeys(self):
+        return [self.FIELDS[sortfield][1] for (sortfield, descending) in self.fields]
+
+    def getSortKey(self, torrent_status):
+        # values are negated for descending fields so every key sorts lowest first
+        return tuple([-getter(torrent_status) if descending else getter(torrent_status) for (getter, descending) in self.getters])
+
+    def getState(self, torrent_status):
+        return DelugeInfo.STATECODES.get(torrent_status.get("state"), DelugeInfo.STATE_UNKNOWN)
+
+    def getProgress(self, torrent_status):
+        return torrent_status.get("progress", -1.0)
+
+    def getQueue(self, torrent_status):
+        # torrents that aren't queued go after those that are
+        queue = torrent_status.get("queue", -1)
+        if queue == -1:
+            return self.INFINITY
+        return queue
+
+    def getETA(self, torrent_status):
+        # an unknown eta is treated as never finishing
+        eta = torrent_status.get("eta", -1)
+        if eta == -1:
+            return self.INFINITY
+        return eta
+
+    def getDownload(self, torrent_status):
+        return torrent_status.get("download_payload_rate", 0)
+
+    def getUpload(self, torrent_status):
+        return torrent_status.get("upload_payload_rate", 0)
+
+    def getRatio(self, torrent_status):
+        return torrent_status.get("ratio", -1.0)
+
+class MsgPack:
+
+    # a packer for the few types a record holds, used when the msgpack package isn't installed
+    INTS = (
+        (0, 0x7f, None, None),
+        (-0x20, -1, None, None),
+        (0, 0xff, b"\xcc", ">B"),
+        (0, 0xffff, b"\xcd", ">H"),
+        (0, 0xffffffff, b"\xce", ">I"),
+        (0, 0xffffffffffffffff, b"\xcf", ">Q"),
+        (-0x80, 0x7f, b"\xd0", ">b"),
+        (-0x8000, 0x7fff, b"\xd1", ">h"),
+        (-0x80000000, 0x7fffffff, b"\xd2", ">i"),
+        (-0x8000000000000000, 0x7fffffffffffffff, b"\xd3", ">q")
+    )
+
+    def packb(self, value):
+        parts = []
+        self.pack(value, parts.append)
+        return b"".join(parts)
+
+    def pack(self, value, append):
+
+        if value == None:
+            append(b"\xc0")
+        elif value is True:
+            append(b"\xc3")
+        elif value is False:
+            append(b"\xc2")
+        elif isinstance(value, int):
+            append(self.packInt(value))
+        elif isinstance(value, float):
+            append(b"\xcb" + struct.pack(">d", value))
+        elif isinstance(value, str):
+            data = value.encode("utf-8")
+            append(self.packHeader(len(data), 0xa0, 32, b"\xd9", b"\xda", b"\xdb") + data)
+        elif isinstance(value, bytes):
+            append(self.packHeader(len(value), None, 0, b"\xc4", b"\xc5", b"\xc6") + value)
+        elif isinstance(value, (list, tuple)):
+            append(self.packHeader(len(value), 0x90, 16, None, b"\xdc", b"\xdd"))
+            for item in value:
+                self.pack(item, append)
+        elif isinstance(value, dict):
+            append(self.packHeader(len(value), 0x80, 16, None, b"\xde", b"\xdf"))
+            for key, item in value.items():
+                self.pack(key, append)
+                self.pack(item, append)
+        else:
+            raise TypeError("Can't pack %r"%value)
+
+    def packInt(self, value):
+        for (lowest, highest, code, packformat) in self.INTS:
+            if lowest <= value <= highest:
+                if code == None:
+                    return struct.pack(">b", value)
+                return code + struct.pack(packformat, value)
+        raise ValueError("Integer out of range: %d"%value)
+
+    def packHeader(self, length, fixcode, fixlimit, code8, code16, code32):
+        # the smallest of the fixed, 8, 16 and 32 bit length headers that fits
+        if fixcode != None and length < fixlimit:
+            return struct.pack(">B", fixcode | length)
+        if code8 != None and length <= 0xff:
+            return code8 + struct.pack(">B", length)
+        if length <= 0xffff:
+            return code16 + struct.pack(">H", length)
+        return code32 + struct.pack(">I", length)
+
+def importMsgpack():
+
+    # the msgpack package is faster than the packer here when installed
+    try:
+        import msgpack
+        return msgpack
+    except ImportError:
+        return MsgPack()
+
+class RecordWriter:
+
+    def __init__(self, format, write):
+
+        # writes the records of --format as bytes, each as soon as it is encoded
+        self.format = format
+        self.write = write
+        self.started = False
+        self.records = 0
+
+        if format == "msgpack":
+            self.encode = importMsgpack().packb
+        else:
+            import json
+            encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+            self.encode = lambda record: encoder.encode(record).encode("utf-8")
+
+    def start(self, summary=None):
+
+        # a json document always has both members, the other formats only write a summary there is
+        if self.started == True:
+            return
+        self.started = True
+
+        if self.format == "json":
+            self.write(b'{"summary":' + self.encode(summary) + b',"torrents":[')
+        elif summary != None:
+            self.add({"summary": summary})
+
+    def add(self, record):
+
+        data = self.encode(record)
+        if self.format == "json":
+            if self.records > 0:
+                data = b"," + data
+        elif self.format == "jsonl":
+            data = data + b"\n"
+
+        self.write(data)
+        self.records = self.records + 1
+
+    def finish(self):
+        self.start()
+        if self.format == "json":
+            self.write(b"]}\n")
+
+class FileLock:
+
+    def __init__(self, path):
+        # an flock held on its own file, shared by every process using the same path
+        self.path = path
+        self.lockfile = None
+
+    def acquire(self):
+
+        # another user's lock file could be held forever, so it is refused rather than waited on
+        self.lockfile = os.fdopen(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_NOFOLLOW, 0o600), "a")
+        if isOwnFile(self.lockfile) == False:
+            self.lockfile.close()
+            self.lockfile = None
+            raise IOError("%s belongs to another user"%self.path)
+        fcntl.flock(self.lockfile.fileno(), fcntl.LOCK_EX)
+
+    def release(self):
+        if self.lockfile != None:
+            fcntl.flock(self.lockfile.fileno(), fcntl.LOCK_UN)
+            self.lockfile.close()
+            self.lockfile = None
+
+class SnapshotCache:
+
+    MAGIC = b"CDSC3"
+
+    # keys and states wanted by other calls sharing the cache are kept while the snapshot is this many ttls old
+    KEYS_KEPT_FOR_TTLS = 10
+
+    def __init__(self, path, ttl):
+        self.path = getUserPath(path)
+        self.ttl = ttl
+        self.filelock = FileLock(self.path + ".lock")
+
+    def lock(self):
+        # serialise fetching so concurrent exec calls don't all query the daemon at once
+        self.filelock.acquire()
+
+    def unlock(self):
+        self.filelock.release()
+
+    def read(self):
+
+        # returns (age, keys, states, torrents_status) for the current snapshot, or None if there isn't a usable one
+        try:
+            fileinput = open(self.path, "rb")
+        except IOError:
+            return None
+
+        try:
+            try:
+                # marshal data isn't safe to load from a file anyone else could have written
+                if isOwnFile(fileinput) == False:
+                    return None
+                age = time.time() - os.fstat(fileinput.fileno()).st_mtime
+                if fileinput.read(len(self.MAGIC)) != self.MAGIC:
+                    return None
+                (keys, states, torrents_status) = marshal.load(fileinput)
+            except (EnvironmentError, ValueError, EOFError, TypeError):
+                return None
+        finally:
+            fileinput.close()
+
+        return (age, keys, states, torrents_status)
+
+    def load(self, keys, states):
+
+        # returns (states, torrents_status) when the snapshot is fresh, holds every key needed and
+        # covers the states wanted, None standing for every state
+        snapshot = self.read()
+        if snapshot == None:
+            return None
+
+        (age, cachedkeys, cachedstates, torrents_status) = snapshot
+        if age > self.ttl or not set(keys).issubset(cachedkeys):
+            return None
+
+        if cachedstates != None and (states == None or not set(states).issubset(cachedstates)):
+            return None
+
+        return (cachedstates, torrents_status)
+
+    def getShared(self):
+
+        # (keys, states) requested by other recent calls, so refreshing for one call doesn't starve the others
+        snapshot = self.read()
+        if snapshot == None or snapshot[0] > self.ttl * self.KEYS_KEPT_FOR_TTLS:
+            return None
+
+        return (snapshot[1], snapshot[2])
+
+    def save(self, keys, states, torrents_status):
+
+        writeFile(self.path, self.MAGIC + marshal.dumps((sorted(keys), states, torrents_status)), 0o600)
+
+class RenderCache:
+
+    # at least this many rendered torrents are kept, more if more are output at once
+    SIZE = 1000
+
+    def __init__(self, keys):
+        self.size = self.SIZE
+        self.entries = OrderedDict()
+        self.template = None
+        self.setKeys(keys)
+
+    def setKeys(self, keys):
+
+        # the fingerprint of a torrent is the tuple of the status values its rendered output depends on
+        self.keys = keys
+        if len(keys) > 1:
+            self.getter = itemgetter(*keys)
+        elif len(keys) == 1:
+            key = keys[0]
+            self.getter = lambda torrent_status: (torrent_status[key],)
+        else:
+            self.getter = lambda torrent_status: ()
+
+    def getFingerprint(self, torrent_status):
+        try:
+            return self.getter(torrent_status)
+        except KeyError:
+            return tuple([torrent_status.get(key) for key in self.keys])
+
+    def setTemplate(self, template):
+        # output rendered with another template is no use
+        if template is not self.template:
+            self.template = template
+            self.entries.clear()
+
+    def reserve(self, count):
+        self.size = max(self.size, count)
+
+    def get(self, torrentid, fingerprint):
+
+        entry = self.entries.pop(torrentid, None)
+        if entry == None or entry[0] != fingerprint:
+            return None
+
+        # reinserting marks the entry as the most recently used
+        self.entries[torrentid] = entry
+        return entry[1]
+
+    def put(self, torrentid, fingerprint, output):
+        self.entries[torrentid] = (fingerprint, output)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def discard(self, torrentid):
+        self.entries.pop(torrentid, None)
+
+class TorrentStore:
+
+    def __init__(self, keys):
+        self.keys = set(keys)
+        # counts each new set of changes, so a TorrentOrder can tell if it missed one
+        self.version = 0
+        self.reset()
+
+    def reset(self):
+        # the next status request has to be a full one
+        self.version += 1
+        self.torrents_status = {}
+        self.changed = set()
+        self.removed = set()
+        self.synced = False
+
+    def apply(self, torrents_status, diff):
+
+        # merges a get_torrents_status result, returns False if a full resync is needed instead
+        self.version += 1
+        if diff == False:
+            self.removed = set(self.torrents_status).difference(torrents_status)
+            self.changed = set(torrents_status)
+            self.torrents_status = torrents_status
+            self.synced = True
+            return True
+
+        changed = set()
+
+        # torrents missing from a diff have been removed from the daemon
+        removed = set(self.torrents_status).difference(torrents_status)
+        for torrentid in removed:
+            del self.torrents_status[torrentid]
+
+        for torrentid, delta in torrents_status.items():
+            current = self.torrents_status.get(torrentid)
+
+            if current == None:
+                # a torrent we haven't seen has to arrive complete
+                if delta == None or not self.keys.issubset(delta):
+                    self.reset()
+                    return False
+                self.torrents_status[torrentid] = delta
+                changed.add(torrentid)
+
+            elif delta:
+                current.update(delta)
+                changed.add(torrentid)
+
+        self.changed = changed
+        self.removed = removed
+        return True
+
+    def clearChanges(self):
+        # the following updates are gathered up until the output is next rendered
+        self.version += 1
+        self.changed = set()
+        self.removed = set()
+
+    def update(self, torrents_status, torrentids):
+
+        # merges the full status of the torrents asked for, those missing from the reply are gone
+        for torrentid in torrentids:
+            torrent_status = torrents_status.get(torrentid)
+            if torrent_status == None:
+                if torrentid in self.torrents_status:
+                    del self.torrents_status[torrentid]
+                    self.removed.add(torrentid)
+                    self.changed.discard(torrentid)
+            else:
+                self.torrents_status[torrentid] = torrent_status
+                self.changed.add(torrentid)
+                self.removed.discard(torrentid)
+
+    def applyPartial(self, torrents_status):
+
+        # merges a diff of only some of the keys, returns the torrents we haven't seen so they
+        # can be asked for in full
+        removed = set(self.torrents_status).difference(torrents_status)
+        for torrentid in removed:
+            del self.torrents_status[torrentid]
+        self.removed.update(removed)
+        self.changed.difference_update(removed)
+
+        unknown = []
+        for torrentid, delta in torrents_status.items():
+            current = self.torrents_status.get(torrentid)
+            if current == None:
+                unknown.append(torrentid)
+            elif delta:
+                current.update(delta)
+                self.changed.add(torrentid)
+
+        return unknown
+
+class TorrentOrder:
+
+    def __init__(self, getSortKey, isListed):
+        # the torrents of a TorrentStore kept sorted from one poll to the next, only those
+        # that changed or went have their sort key worked out again and are moved
+        self.getSortKey = getSortKey
+        self.isListed = isListed
+        self.version = None
+        self.entries = []
+        self.sortkeys = {}
+        # torrents with the same sort key stay in the order the store has them, as with a full sort
+        self.positions = {}
+        self.nextposition = 0
+
+    def update(self, store):
+
+        # sorting from scratch is quicker than moving a large share of the torrents one by one,
+        # and it's the only way if a set of changes was missed
+        if self.version == None or store.version - self.version > 1 or len(store.changed) + len(store.removed) > len(self.sortkeys) // 4:
+            self.rebuild(store.torrents_status)
+        else:
+            for torrentid in store.removed:
+                self.discard(torrentid)
+                self.positions.pop(torrentid, None)
+            getSortKey = self.getSortKey
+            isListed = self.isListed
+            for torrentid in store.changed:
+                self.discard(torrentid)
+                torrent_status = store.torrents_status.get(torrentid)
+                if torrent_status == None:
+                    continue
+                position = self.positions.get(torrentid)
+                if position == None:
+                    position = self.nextposition
+                    self.positions[torrentid] = position
+                    self.nextposition += 1
+                if isListed(torrent_status):
+                    entry = (getSortKey(torrent_status), position, torrentid)
+                    self.sortkeys[torrentid] = entry
+                    bisect.insort(self.entries, entry)
+
+        self.version = store.version
+
+    def rebuild(self, torrents_status):
+        getSortKey = self.getSortKey
+        isListed = self.isListed
+        self.sortkeys = {}
+        self.positions = {}
+        position = 0
+        for torrentid, torrent_status in torrents_status.items():
+            self.positions[torrentid] = position
+            if torrent_status != None and isListed(torrent_status):
+                self.sortkeys[torrentid] = (getSortKey(torrent_status), position, torrentid)
+            position += 1
+        self.nextposition = position
+        self.entries = sorted(self.sortkeys.values())
+
+    def discard(self, torrentid):
+        # the old sort key finds the torrent's place in the list
+        entry = self.sortkeys.pop(torrentid, None)
+        if entry != None:
+            index = bisect.bisect_left(self.entries, entry)
+            if index < len(self.entries) and self.entries[index] == entry:
+                del self.entries[index]
+
+    def getTorrentIds(self, torrents_status, limit):
+
+        # the first limit torrents in order, or all of them for 0, any torrent that has gone from
+        # the store without being noted as removed is left out
+        torrentids = []
+        if limit < 0:
+            return torrentids
+        for (sortkey, position, torrentid) in self.entries:
+            if torrentid in torrents_status:
+                torrentids.append(torrentid)
+                if len(torrentids) == limit:
+                    break
+        return torrentids
+
+class RateHistory:
+
+    MAGIC = b"CDRH2"
+
+    # bars of the [dlgraph] and [ulgraph] sparklines, lowest to highest
+    SPARKS = "▁▂▃▄▅▆▇█"
+
+    def __init__(self, size):
+
+        # every sample is written at the same position of each ring, so one count serves them all,
+        # each entry being the count when it was first sampled and its interleaved download and
+        # upload rates
+        self.size = max(size, 1)
+        self.count = 0
+        self.torrents = {}
+        self.states = {}
+
+    def newEntry(self):
+        return [self.count, array("f", [0.0]) * (2 * self.size)]
+
+    def record(self, torrents_status):
+
+        index = (self.count % self.size) * 2
+        torrents = {}
+        totals = {}
+
+        for torrentid, torrent_status in torrents_status.items():
+            if torrent_status == None:
+                continue
+
+            entry = self.torrents.get(torrentid)
+            if entry == None:
+                entry = self.newEntry()
+
+            downloadrate = torrent_status.get("download_payload_rate", 0)
+            uploadrate = torrent_status.get("upload_payload_rate", 0)
+            samples = entry[1]
+            samples[index] = downloadrate
+            samples[index + 1] = uploadrate
+            torrents[torrentid] = entry
+
+            # the summary rates are totalled by state, so they can be filtered like the torrents
+            state = torrent_status.get("state", "Unknown")
+            total = totals.get(state)
+            if total == None:
+                totals[state] = [downloadrate, uploadrate]
+            else:
+                total[0] = total[0] + downloadrate
+                total[1] = total[1] + uploadrate
+
+        # torrents that are gone are forgotten, states are kept with nothing in them
+        self.torrents = torrents
+
+        for state in totals:
+            if state not in self.states:
+                self.states[state] = self.newEntry()
+
+        for state, (first, samples) in self.states.items():
+            (samples[index], samples[index + 1]) = totals.get(state, (0.0, 0.0))
+
+        self.count = self.count + 1
+
+    def getSamples(self, entry, offset):
+
+        # the download (offset 0) or upload (offset 1) samples of an entry, oldest first
+        (first, samples) = entry
+        count = min(self.count - first, self.size)
+        return [samples[((position % self.size) * 2) + offset] for position in range(self.count - count, self.count)]
+
+    def getAverage(self, samples):
+        if len(samples) == 0:
+            return None
+        return sum(samples) / len(samples)
+
+    def getGraph(self, samples):
+
+        if len(samples) == 0:
+            return None
+
+        # scaled to the highest sample shown, padded so the graph keeps its width while filling up
+        highest = max(samples)
+        top = len(self.SPARKS) - 1
+        if highest > 0:
+            bars = [self.SPARKS[int(round(sample / highest * top))] for sample in samples]
+        else:
+            bars = [self.SPARKS[0]] * len(samples)
 
-    def getProgressOrder(self,statecode,progress):
-        return (statecode*10000.0)+float(progress.rstrip("%"))
+        return " " * (self.size - len(samples)) + "".join(bars)
 
-    def getQueueOrder(self,statecode,queueorder):
-        if queueorder <> -1:
-            queueorder = 1000 - queueorder
-        return (statecode*10000.0)+float(queueorder)
+    def annotate(self, torrentid, torrent_status):
+
+        # add the averages and graphs of a torrent to its status for the template
+        entry = self.torrents.get(torrentid)
+        if entry == None:
+            downloads = []
+            uploads = []
+        else:
+            downloads = self.getSamples(entry, 0)
+            uploads = self.getSamples(entry, 1)
+
+        downloadaverage = self.getAverage(downloads)
+        torrent_status["download_average"] = downloadaverage
+        torrent_status["upload_average"] = self.getAverage(uploads)
+        torrent_status["download_graph"] = self.getGraph(downloads)
+        torrent_status["upload_graph"] = self.getGraph(uploads)
+
+        # the time left at the average download rate, zero as with deluge's eta when it won't finish
+        remaining = torrent_status.get("total_wanted", 0) - torrent_status.get("total_done", 0)
+        if downloadaverage == None:
+            torrent_status["eta_average"] = None
+        elif downloadaverage > 0 and remaining > 0:
+            torrent_status["eta_average"] = int(remaining / downloadaverage)
+        else:
+            torrent_status["eta_average"] = 0
+
+    def annotateSummary(self, summaryData, states):
+
+        # total the samples of the states wanted, None standing for every state, lined up on the latest
+        downloads = []
+        uploads = []
+        for state, entry in self.states.items():
+            if states != None and state not in states:
+                continue
+            for (totals, samples) in ((downloads, self.getSamples(entry, 0)), (uploads, self.getSamples(entry, 1))):
+                if len(samples) > len(totals):
+                    totals[0:0] = [0.0] * (len(samples) - len(totals))
+                offset = len(totals) - len(samples)
+                for (index, sample) in enumerate(samples):
+                    totals[offset + index] = totals[offset + index] + sample
+
+        summaryData.downloadaverage = self.getAverage(downloads)
+        summaryData.uploadaverage = self.getAverage(uploads)
+        summaryData.downloadgraph = self.getGraph(downloads)
+        summaryData.uploadgraph = self.getGraph(uploads)
+
+    def load(self, path):
+
+        # returns False if there is no usable history, it is then started afresh
+        try:
+            fileinput = open(getUserPath(path), "rb")
+        except IOError:
+            return False
+
+        try:
+            try:
+                # as with the snapshot cache, only a history the user wrote is loaded
+                if isOwnFile(fileinput) == False:
+                    return False
+                if fileinput.read(len(self.MAGIC)) != self.MAGIC:
+                    return False
+                (size, count, torrents, states) = marshal.load(fileinput)
+            except (EnvironmentError, ValueError, EOFError, TypeError):
+                return False
+        finally:
+            fileinput.close()
+
+        # a history of another size can't be carried over
+        if size != self.size:
+            return False
+
+        self.count = count
+        self.torrents = dict([(key, [first, array("f", samples)]) for key, (first, samples) in torrents.items()])
+        self.states = dict([(key, [first, array("f", samples)]) for key, (first, samples) in states.items()])
+        return True
+
+    def save(self, path):
+
+        torrents = dict([(key, (first, samples.tobytes())) for key, (first, samples) in self.torrents.items()])
+        states = dict([(key, (first, samples.tobytes())) for key, (first, samples) in self.states.items()])
+        writeFile(getUserPath(path), self.MAGIC + marshal.dumps((self.size, self.count, torrents, states)), 0o600)
+
+class Profiler:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # timings and counts in the order they were taken, for a single output line
+        self.entries = []
+        self.started = {}
+        # the last time taken for each stage, in seconds
+        self.timings = {}
+
+    def start(self, stage):
+        self.started[stage] = clock()
+
+    def stop(self, stage):
+        if stage in self.started:
+            self.add(stage, clock() - self.started.pop(stage))
+
+    def add(self, stage, seconds):
+        self.timings[stage] = seconds
+        self.entries.append((stage, "%.3fms"%(seconds * 1000)))
+
+    def set(self, name, value):
+        if value != None:
+            self.entries.append((name, str(value)))
+
+    def getText(self):
+        return " ".join(["%s=%s"%entry for entry in self.entries])
+
+class Histogram:
+
+    def __init__(self, buckets):
+        # a count for each upper bound and one for anything above them all
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum = self.sum + value
+        self.count = self.count + 1
+
+    def getLines(self, name, format):
+
+        # the bucket counts are cumulative in the exposition format
+        lines = []
+        cumulative = 0
+        for (bound, count) in zip(self.buckets, self.counts):
+            cumulative = cumulative + count
+            lines.append('%s_bucket{le="%s"} %d'%(name, format(bound), cumulative))
+        lines.append('%s_bucket{le="+Inf"} %d'%(name, self.count))
+        lines.append("%s_sum %s"%(name, format(self.sum)))
+        lines.append("%s_count %d"%(name, self.count))
+        return lines
+
+class Metrics:
+
+    CONTENTTYPE = b"text/plain; version=0.0.4; charset=utf-8"
+
+    # upper bounds of the status request time in seconds and of the reply size in bytes
+    FETCH_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+    PAYLOAD_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864]
+
+    # gauge name, help text and summary attribute for each total
+    TOTALS = (
+        ("conkydeluge_download_rate_bytes_per_second", "Payload download rate of the torrents.", "downloadrate"),
+        ("conkydeluge_upload_rate_bytes_per_second", "Payload upload rate of the torrents.", "uploadrate"),
+        ("conkydeluge_done_bytes", "Bytes downloaded of the wanted files.", "totaldone"),
+        ("conkydeluge_wanted_bytes", "Size of the wanted files.", "totalsize"),
+        ("conkydeluge_uploaded_bytes", "Bytes uploaded.", "totaluploaded"),
+        ("conkydeluge_connected_peers", "Peers connected to.", "currentpeers"),
+        ("conkydeluge_connected_seeds", "Seeds connected to.", "currentseeds"),
+        ("conkydeluge_swarm_peers", "Peers in the swarms.", "totalpeers"),
+        ("conkydeluge_swarm_seeds", "Seeds in the swarms.", "totalseeds")
+    )
+
+    def __init__(self):
+        self.fetchDuration = Histogram(self.FETCH_BUCKETS)
+        self.payloadSize = Histogram(self.PAYLOAD_BUCKETS)
+        self.failures = 0
+        self.up = 0
+        self.updated = None
+        self.summaries = {}
+        self.text = self.getText().encode("utf-8")
+
+    def observeFetch(self, timings):
+        # the status requests of a poll, to the deluge core or to each --host
+        for stage, seconds in timings.items():
+            if stage in ("fetch", "refresh") or stage.startswith("fetch@"):
+                self.fetchDuration.observe(seconds)
+
+    def observePayload(self, payloadbytes):
+        if payloadbytes != None:
+            self.payloadSize.observe(payloadbytes)
+
+    def update(self, torrents_status, byhost, up):
+
+        # the totals are worked out once a poll, a scrape only sends the text made here
+        groups = {}
+        for torrent_status in torrents_status.values():
+            if torrent_status != None:
+                host = None
+                if byhost == True:
+                    host = torrent_status.get("host")
+                groups.setdefault(host, []).append(torrent_status)
+
+        self.summaries = {}
+        for host, torrent_status_list in groups.items():
+            summaryData = SummaryData(torrent_status_list, FieldProjection.METRICS_FIELDS)
+            summaryData.getStateCount(None)
+            self.summaries[host] = summaryData
+
+        self.up = up and 1 or 0
+        if up == True:
+            self.updated = time.time()
+        self.text = self.getText().encode("utf-8")
+
+    def getText(self):
+
+        lines = []
+        hosts = sorted(self.summaries, key=lambda host: host or "")
+
+        self.addMetric(lines, "conkydeluge_up", "gauge", "Whether the deluge core answered the last poll.", [("", self.up)])
+        if self.updated != None:
+            self.addMetric(lines, "conkydeluge_last_update_timestamp_seconds", "gauge", "When the deluge core last answered a poll.", [("", self.updated)])
+
+        samples = []
+        for host in hosts:
+            statecounts = self.summaries[host].statecounts
+            for state in sorted(statecounts):
+                samples.append((self.getLabels(host=host, state=state), statecounts[state]))
+        self.addMetric(lines, "conkydeluge_torrents", "gauge", "Torrents in each state.", samples)
+
+        for (name, helptext, attribute) in self.TOTALS:
+            self.addMetric(lines, name, "gauge", helptext, [(self.getLabels(host=host), getattr(self.summaries[host], attribute)) for host in hosts])
+
+        self.addMetric(lines, "conkydeluge_fetch_failures_total", "counter", "Connections and status requests to the deluge core that failed.", [("", self.failures)])
+
+        lines.append("# HELP conkydeluge_fetch_duration_seconds Time taken by each torrent status request.")
+        lines.append("# TYPE conkydeluge_fetch_duration_seconds histogram")
+        lines.extend(self.fetchDuration.getLines("conkydeluge_fetch_duration_seconds", self.formatValue))
+
+        lines.append("# HELP conkydeluge_payload_bytes Size of each torrent status reply as sent by the deluge core.")
+        lines.append("# TYPE conkydeluge_payload_bytes histogram")
+        lines.extend(self.payloadSize.getLines("conkydeluge_payload_bytes", self.formatValue))
+
+        return "\n".join(lines) + "\n"
+
+    def addMetric(self, lines, name, metrictype, helptext, samples):
+        lines.append("# HELP %s %s"%(name, helptext))
+        lines.append("# TYPE %s %s"%(name, metrictype))
+        for (labels, value) in samples:
+            lines.append("%s%s %s"%(name, labels, self.formatValue(value)))
+
+    def getLabels(self, **labels):
+        # the host label is only there with several --host options
+        pairs = []
+        for name in sorted(labels):
+            if labels[name] != None:
+                value = str(labels[name]).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+                pairs.append('%s="%s"'%(name, value))
+        if len(pairs) == 0:
+            return ""
+        return "{" + ",".join(pairs) + "}"
+
+    def formatValue(self, value):
+        if isinstance(value, float):
+            return repr(value)
+        return str(value)
+
+class LogFile:
+
+    # lines are held back until this many bytes are waiting, or the log is flushed
+    BUFFERSIZE = 65536
+
+    def __init__(self, path, maxsize):
+        self.path = os.path.expanduser(path)
+        self.maxsize = maxsize
+        self.fileoutput = None
+        self.lines = []
+        self.buffered = 0
+        self.lock = threading.Lock()
+
+    def write(self, line):
+
+        line = line.encode("utf-8")
+
+        self.lock.acquire()
+        try:
+            self.lines.append(line)
+            self.buffered = self.buffered + len(line)
+            if self.buffered >= self.BUFFERSIZE:
+                self.flushLines()
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            self.flushLines()
+        finally:
+            self.lock.release()
+
+    def flushLines(self):
+
+        # only called with the lock held
+        if len(self.lines) == 0:
+            return
+
+        # the file is opened on the first flush and kept open from then on
+        if self.fileoutput == None:
+            self.fileoutput = open(self.path, "ab")
+
+        self.fileoutput.write(b"".join(self.lines))
+        self.fileoutput.flush()
+        self.lines = []
+        self.buffered = 0
+
+        if self.maxsize > 0 and self.fileoutput.tell() >= self.maxsize:
+            self.rotate()
+
+    def rotate(self):
+        # the current log becomes the one backup kept, the next flush starts a new file
+        self.fileoutput.close()
+        self.fileoutput = None
+        os.rename(self.path, self.path + ".1")
+
+    def close(self):
+        self.flush()
+        if self.fileoutput != None:
+            self.fileoutput.close()
+            self.fileoutput = None
+
+class Log:
+
+    INFO = 1
+    ERROR = 2
+
+    # how often a --daemon flushes its log files from the background
+    FLUSHINTERVAL = 1.0
+
+    def __init__(self, options):
+
+        self.verbose = options.verbose
+        self.infofile = None
+        self.errorfile = None
+        maxsize = max(options.logmaxsize, 0) * 1024
+
+        # both options may name the same filepath, it is then written through the one buffer
+        files = {}
+        for (attribute, path) in (("infofile", options.infologfile), ("errorfile", options.errorlogfile)):
+            if path != None:
+                path = os.path.expanduser(path)
+                if path not in files:
+                    files[path] = LogFile(path, maxsize)
+                setattr(self, attribute, files[path])
+        self.files = list(files.values())
+
+        # info is only formatted when something would see it, errors always go to stderr
+        if self.verbose == True or self.infofile != None:
+            self.level = self.INFO
+        else:
+            self.level = self.ERROR
+
+        self.flusher = None
+        atexit.register(self.close)
+
+    def isEnabledFor(self, level):
+        return level >= self.level
+
+    def write(self, logfile, label, text):
+        datetimestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        logfile.write(datetimestamp+" "+label+": "+text+"\n")
+
+    def info(self, text):
+
+        if self.level > self.INFO:
+            return
+
+        if self.verbose == True:
+            print("INFO: " + text, file=sys.stdout)
+
+        if self.infofile != None:
+            self.write(self.infofile, "INFO", text)
+
+    def error(self, text):
+        print("ERROR: " + text, file=sys.stderr)
+
+        if self.errorfile != None:
+            self.write(self.errorfile, "ERROR", text)
+
+    def profile(self, text):
+        # stderr keeps the profile line out of the conky output
+        if self.infofile != None:
+            self.write(self.infofile, "PROFILE", text)
+        else:
+            print("PROFILE: " + text, file=sys.stderr)
+
+    def flush(self):
+        for logfile in self.files:
+            logfile.flush()
+
+    def startFlushing(self):
+
+        # a long running process flushes from a thread, so lines reach the file without a write on each
+        if self.flusher != None or len(self.files) == 0:
+            return
+
+        self.stopping = threading.Event()
+        self.flusher = threading.Thread(target=self.runFlushing, name="conkyDeluge log flusher")
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def runFlushing(self):
+        while not self.stopping.is_set():
+            self.stopping.wait(self.FLUSHINTERVAL)
+            try:
+                self.flush()
+            except EnvironmentError as e:
+                print("ERROR: Log flush failed:" + e.__str__(), file=sys.stderr)
+
+    def close(self):
+
+        if self.flusher != None:
+            self.stopping.set()
+            self.flusher.join()
+            self.flusher = None
+
+        for logfile in self.files:
+            try:
+                logfile.close()
+            except EnvironmentError as e:
+                print("ERROR: Log close failed:" + e.__str__(), file=sys.stderr)
+
+# one log for each set of logging options, shared by everything logging with them
+logs = {}
+
+def getLog(options):
+    logkey = (options.verbose, options.infologfile, options.errorlogfile, options.logmaxsize)
+    if logkey not in logs:
+        logs[logkey] = Log(options)
+    return logs[logkey]
+
+# one pool for each number of --workers, shared by the sections and kept for the life of a --daemon
+renderPools = {}
+
+def getRenderPool(workers):
+    if workers not in renderPools:
+        import multiprocessing
+        renderPools[workers] = multiprocessing.Pool(workers)
+        atexit.register(renderPools[workers].terminate)
+    return renderPools[workers]
+
+def renderChunk(chunk):
+
+    # run by a --workers process, returns the output of each torrent in order and any errors
+    (template, torrent_status_list) = chunk
+    outputs = []
+    errors = []
+
+    for torrent_status in torrent_status_list:
+        try:
+            outputs.append(template.render(torrent_status))
+        except Exception as e:
+            errors.append(e.__str__())
+            outputs.append("")
+
+    return (outputs, errors)
+
+class DelugeHost:
+
+    DEFAULTPORT = 58846
+
+    def __init__(self, spec, options):
+
+        # parse [user[:pass]@]server[:port], falling back on the connection options
+        credentials, separator, address = spec.rpartition("@")
+        username, separator, password = credentials.partition(":")
+        server, separator, port = address.rpartition(":")
+
+        if separator == "":
+            server = port
+            port = options.port
+        else:
+            port = int(port)
+
+        self.server = server.replace("localhost", "127.0.0.1")
+        self.port = port
+        self.username = username or options.username
+        self.password = password or options.password
+
+        if self.port == self.DEFAULTPORT:
+            self.name = server
+        else:
+            self.name = "%s:%d"%(server, self.port)
+
+        self.address = "%s:%d"%(self.server, self.port)
+
+def withDeadline(d, timeout, description, client=None):
+
+    # a deferred with the result of d, or failing once timeout seconds pass without one,
+    # d is then cancelled and the client's connection dropped so no late result turns up on it
+    from twisted.internet import defer
+    from twisted.python.failure import Failure
+
+    deadline = defer.Deferred()
+
+    def on_timeout():
+        deadline.errback(Failure(defer.TimeoutError("%s got no answer within %s seconds"%(description, timeout))))
+        d.cancel()
+        if client != None:
+            client.disconnect()
+
+    def on_result(result):
+        if timer.active():
+            timer.cancel()
+            if isinstance(result, Failure):
+                deadline.errback(result)
+            else:
+                deadline.callback(result)
+
+    timer = reactor.callLater(timeout, on_timeout)
+    d.addBoth(on_result)
+
+    return deadline
+
+class Backoff:
+
+    def __init__(self, address, base, maximum):
+
+        # kept in a file of the user's so consecutive exec calls share it, one for each deluge core
+        self.path = getUserPath("conkydeluge-%s.backoff"%re.sub(r"[^\w.-]", "_", address))
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+        self.retryat = 0
 
-    def getETAOrder(self,statecode,eta):
         try:
-            if eta <> -1:
-                eta = (100000000 - eta)/100
-            return (statecode*10000000.0)+float(eta)
-        except:
-            return 0
+            fileinput = open(self.path, "rb")
+            try:
+                if isOwnFile(fileinput) == True:
+                    (self.failures, self.retryat) = marshal.load(fileinput)
+            finally:
+                fileinput.close()
+        except Exception:
+            pass
+
+    def getWait(self):
+        # seconds left before the deluge core should be tried again
+        return max(self.retryat - time.time(), 0)
+
+    def failed(self):
+
+        self.failures = self.failures + 1
+        delay = min(self.base * 2 ** (self.failures - 1), self.maximum)
+        self.retryat = time.time() + delay
+
+        writeFile(self.path, marshal.dumps((self.failures, self.retryat)), 0o600)
+
+        return delay
+
+    def succeeded(self):
+        if self.failures > 0:
+            self.failures = 0
+            self.retryat = 0
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+class HostRequest:
+
+    def __init__(self, host, keys, filter_dict, options):
+        self.host = host
+        self.keys = keys
+        self.filter_dict = filter_dict
+        self.options = options
+        self.elapsed = None
+
+    def start(self):
+
+        # each core gets its own client so their connections run side by side
+        from deluge.ui.client import Client
+        from twisted.internet import defer
+
+        self.client = Client()
+        self.deferred = defer.Deferred()
+        self.started = clock()
+
+        d = withDeadline(self.client.connect(self.host.server, self.host.port, self.host.username, self.host.password), self.options.connecttimeout, "Connection", self.client)
+        d.addCallbacks(self.on_connect_success, self.on_fail)
+
+        return self.deferred
+
+    def on_connect_success(self, result):
+        d = withDeadline(self.client.core.get_torrents_status(self.filter_dict, self.keys), self.options.timeout, "Torrent status request", self.client)
+        d.addCallbacks(self.on_get_torrents_status, self.on_fail)
+
+    def on_get_torrents_status(self, torrents_status):
+        self.finish(torrents_status, None)
+
+    def on_fail(self, result):
+        self.finish(None, result.getErrorMessage())
+
+    def finish(self, torrents_status, error):
+
+        self.elapsed = clock() - self.started
+        if self.client.connected():
+            self.client.disconnect()
+
+        self.deferred.callback((self.host, torrents_status, error))
+
+    async def fetch(self):
+
+        # the same request made with the built-in client, returns (host, torrents_status, error)
+        self.started = clock()
+        rpcclient = DelugeRPCClient(self.host.server, self.host.port, self.host.username, self.host.password, self.options.rpcprotocol)
 
-    def getRateOrder(self,statecode,rate):
         try:
-            return (statecode*1000000.0)+float(rate)
-        except:
-            return 0
+            await waitFor(rpcclient.connect(), self.options.connecttimeout, "Connection")
+            torrents_status = await waitFor(rpcclient.call("core.get_torrents_status", self.filter_dict, self.keys), self.options.timeout, "Torrent status request")
+            result = (self.host, torrents_status, None)
+        except Exception as e:
+            result = (self.host, None, getErrorMessage(e))
+
+        self.elapsed = clock() - self.started
+        await rpcclient.close()
+        return result
+
+class Rencode:
+
+    # the serialisation of the deluge rpc protocol, used when neither deluge nor rencode is installed
+
+    CHR_LIST = 59
+    CHR_DICT = 60
+    CHR_INT = 61
+    CHR_INT1 = 62
+    CHR_INT2 = 63
+    CHR_INT4 = 64
+    CHR_INT8 = 65
+    CHR_FLOAT32 = 66
+    CHR_FLOAT64 = 44
+    CHR_TRUE = 67
+    CHR_FALSE = 68
+    CHR_NONE = 69
+    CHR_TERM = 127
+
+    # small values and short strings, lists and dicts have their value or length in the typecode
+    INT_POS_FIXED_START = 0
+    INT_POS_FIXED_COUNT = 44
+    INT_NEG_FIXED_START = 70
+    INT_NEG_FIXED_COUNT = 32
+    DICT_FIXED_START = 102
+    DICT_FIXED_COUNT = 25
+    STR_FIXED_START = 128
+    STR_FIXED_COUNT = 64
+    LIST_FIXED_START = 192
+    LIST_FIXED_COUNT = 64
+
+    # (format, typecode) for each size of integer, smallest first
+    INTS = [
+        (struct.Struct("!b"), CHR_INT1),
+        (struct.Struct("!h"), CHR_INT2),
+        (struct.Struct("!i"), CHR_INT4),
+        (struct.Struct("!q"), CHR_INT8)
+    ]
+
+    FLOAT32 = struct.Struct("!f")
+    FLOAT64 = struct.Struct("!d")
+
+    def dumps(self, data):
+        parts = []
+        self.encode(data, parts.append)
+        return b"".join(parts)
+
+    def encode(self, data, write):
+
+        # deluge sends floats in 32 bits, so that is done here too
+        if data is None:
+            write(bytes((self.CHR_NONE,)))
+        elif data is True:
+            write(bytes((self.CHR_TRUE,)))
+        elif data is False:
+            write(bytes((self.CHR_FALSE,)))
+        elif isinstance(data, int):
+            self.encodeInt(data, write)
+        elif isinstance(data, float):
+            write(bytes((self.CHR_FLOAT32,)) + self.FLOAT32.pack(data))
+        elif isinstance(data, str):
+            self.encodeBytes(data.encode("utf-8"), write)
+        elif isinstance(data, bytes):
+            self.encodeBytes(data, write)
+        elif isinstance(data, (list, tuple)):
+            if len(data) < self.LIST_FIXED_COUNT:
+                write(bytes((self.LIST_FIXED_START + len(data),)))
+                for item in data:
+                    self.encode(item, write)
+            else:
+                write(bytes((self.CHR_LIST,)))
+                for item in data:
+                    self.encode(item, write)
+                write(bytes((self.CHR_TERM,)))
+        elif isinstance(data, dict):
+            if len(data) < self.DICT_FIXED_COUNT:
+                write(bytes((self.DICT_FIXED_START + len(data),)))
+            else:
+                write(bytes((self.CHR_DICT,)))
+            for key, value in data.items():
+                self.encode(key, write)
+                self.encode(value, write)
+            if len(data) >= self.DICT_FIXED_COUNT:
+                write(bytes((self.CHR_TERM,)))
+        else:
+            raise TypeError("can't rencode %s"%type(data).__name__)
+
+    def encodeInt(self, data, write):
+
+        if 0 <= data < self.INT_POS_FIXED_COUNT:
+            write(bytes((self.INT_POS_FIXED_START + data,)))
+            return
+        if -self.INT_NEG_FIXED_COUNT <= data < 0:
+            write(bytes((self.INT_NEG_FIXED_START - 1 - data,)))
+            return
+
+        for (intformat, typecode) in self.INTS:
+            bits = intformat.size * 8 - 1
+            if -(1 << bits) <= data < (1 << bits):
+                write(bytes((typecode,)) + intformat.pack(data))
+                return
 
-    def getRatioOrder(self,statecode,ratio):
+        # anything bigger is sent as its digits
+        write(bytes((self.CHR_INT,)) + str(data).encode("ascii") + bytes((self.CHR_TERM,)))
+
+    def encodeBytes(self, data, write):
+        if len(data) < self.STR_FIXED_COUNT:
+            write(bytes((self.STR_FIXED_START + len(data),)) + data)
+        else:
+            write(str(len(data)).encode("ascii") + b":" + data)
+
+    def loads(self, data, decode_utf8=False):
+        (value, position) = self.decode(data, 0, decode_utf8)
+        if position != len(data):
+            raise ValueError("invalid rencoded data")
+        return value
+
+    def decode(self, data, position, decode_utf8):
+
+        # returns (value, position after it), lists are decoded to tuples as rencode does
+        typecode = data[position]
+
+        if typecode < self.INT_POS_FIXED_START + self.INT_POS_FIXED_COUNT:
+            return (typecode - self.INT_POS_FIXED_START, position + 1)
+
+        if self.STR_FIXED_START <= typecode < self.STR_FIXED_START + self.STR_FIXED_COUNT:
+            end = position + 1 + typecode - self.STR_FIXED_START
+            return (self.decodeBytes(data[position + 1:end], decode_utf8), end)
+
+        if 48 <= typecode <= 57:
+            colon = data.index(b":", position)
+            end = colon + 1 + int(data[position:colon])
+            return (self.decodeBytes(data[colon + 1:end], decode_utf8), end)
+
+        if self.LIST_FIXED_START <= typecode < self.LIST_FIXED_START + self.LIST_FIXED_COUNT:
+            items = []
+            position = position + 1
+            for index in range(typecode - self.LIST_FIXED_START):
+                (item, position) = self.decode(data, position, decode_utf8)
+                items.append(item)
+            return (tuple(items), position)
+
+        if self.DICT_FIXED_START <= typecode < self.DICT_FIXED_START + self.DICT_FIXED_COUNT:
+            items = {}
+            position = position + 1
+            for index in range(typecode - self.DICT_FIXED_START):
+                (key, position) = self.decode(data, position, decode_utf8)
+                (items[key], position) = self.decode(data, position, decode_utf8)
+            return (items, position)
+
+        if self.INT_NEG_FIXED_START <= typecode < self.INT_NEG_FIXED_START + self.INT_NEG_FIXED_COUNT:
+            return (self.INT_NEG_FIXED_START - 1 - typecode, position + 1)
+
+        if typecode == self.CHR_LIST:
+            items = []
+            position = position + 1
+            while data[position] != self.CHR_TERM:
+                (item, position) = self.decode(data, position, decode_utf8)
+                items.append(item)
+            return (tuple(items), position + 1)
+
+        if typecode == self.CHR_DICT:
+            items = {}
+            position = position + 1
+            while data[position] != self.CHR_TERM:
+                (key, position) = self.decode(data, position, decode_utf8)
+                (items[key], position) = self.decode(data, position, decode_utf8)
+            return (items, position + 1)
+
+        for (intformat, inttypecode) in self.INTS:
+            if typecode == inttypecode:
+                return (intformat.unpack_from(data, position + 1)[0], position + 1 + intformat.size)
+
+        if typecode == self.CHR_INT:
+            end = data.index(bytes((self.CHR_TERM,)), position)
+            return (int(data[position + 1:end]), end + 1)
+        if typecode == self.CHR_FLOAT32:
+            return (self.FLOAT32.unpack_from(data, position + 1)[0], position + 1 + self.FLOAT32.size)
+        if typecode == self.CHR_FLOAT64:
+            return (self.FLOAT64.unpack_from(data, position + 1)[0], position + 1 + self.FLOAT64.size)
+        if typecode == self.CHR_TRUE:
+            return (True, position + 1)
+        if typecode == self.CHR_FALSE:
+            return (False, position + 1)
+        if typecode == self.CHR_NONE:
+            return (None, position + 1)
+
+        raise ValueError("invalid rencode typecode %d"%typecode)
+
+    def decodeBytes(self, data, decode_utf8):
+        if decode_utf8 == True:
+            try:
+                return data.decode("utf-8")
+            except UnicodeDecodeError:
+                pass
+        return data
+
+def importRencode():
+
+    # deluge's own rencode, or the rencode package, is faster than the one here when installed
+    global rencode
+    if rencode == None:
+        try:
+            from deluge import rencode
+        except ImportError:
+            try:
+                import rencode
+            except ImportError:
+                rencode = Rencode()
+    return rencode
+
+def getPayloadSize(torrents_status):
+
+    # the size of the status reply as the deluge rpc protocol sends it, None if that can't be worked out
+    try:
+        return len(zlib.compress(importRencode().dumps(torrents_status)))
+    except Exception:
+        return None
+
+def getErrorMessage(error):
+    return str(error) or error.__class__.__name__
+
+async def waitFor(awaitable, timeout, description):
+
+    # the result of awaitable, failing with the same message as withDeadline once timeout seconds pass
+    import asyncio
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise DelugeRPCError("%s got no answer within %s seconds"%(description, timeout))
+
+def getLocalhostAuth():
+
+    # the localclient account deluge sets up for connections from the same machine, as its own client uses
+    configdir = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    try:
+        fileinput = open(os.path.join(configdir, "deluge", "auth"))
         try:
-            return (statecode*10000.0)+(100.0*float(ratio))
-        except:
-            return 0
+            lines = fileinput.read().splitlines()
+        finally:
+            fileinput.close()
+    except EnvironmentError:
+        return ("", "")
+
+    for line in lines:
+        fields = line.strip().split(":")
+        if len(fields) >= 2 and fields[0] == "localclient":
+            return (fields[0], fields[1])
+
+    return ("", "")
+
+class DelugeRPCError(Exception):
+    pass
+
+class DelugeRPCClient:
+
+    # message types sent by the deluge core
+    RPC_RESPONSE = 1
+    RPC_ERROR = 2
+    RPC_EVENT = 3
+
+    # deluge 2 puts the protocol version and length before each message, deluge 1.3 sends bare zlib streams
+    PROTOCOL_VERSION = 1
+    HEADER = struct.Struct("!BI")
+
+    def __init__(self, server, port, username, password, protocol=2):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.protocol = protocol
+        self.requestid = 0
+        self.reader = None
+        self.writer = None
+        # data received after the end of the last deluge 1.3 message
+        self.unused = b""
+        self.rencode = importRencode()
+
+    async def connect(self):
+        await self.open()
+        await self.login()
+
+    async def open(self):
+
+        import asyncio
+        import ssl
+
+        # deluge cores use a self signed certificate, so it can't be verified
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+        (self.reader, self.writer) = await asyncio.open_connection(self.server, self.port, ssl=context)
+
+    async def login(self):
+
+        username = self.username
+        password = self.password
+        if not username and self.server in ("127.0.0.1", "localhost"):
+            (username, password) = getLocalhostAuth()
+
+        # deluge 2 refuses a login without a client version, deluge 1.3 one with it
+        if self.protocol == 1:
+            await self.call("daemon.login", username or "", password or "")
+        else:
+            await self.call("daemon.login", username or "", password or "", client_version=VERSION)
+
+    async def call(self, method, *args, **kwargs):
+
+        self.requestid = self.requestid + 1
+        requestid = self.requestid
+        self.send(((requestid, method, args, kwargs),))
+
+        # no events are asked for, but anything that isn't the answer is skipped all the same
+        while True:
+            message = await self.receive()
+            if message[0] == self.RPC_EVENT or message[1] != requestid:
+                continue
+            if message[0] == self.RPC_RESPONSE:
+                return message[2]
+            raise DelugeRPCError(self.getErrorText(message))
+
+    def getErrorText(self, message):
+
+        # deluge 1.3 sends the exception type, message and traceback as one item, deluge 2 as separate ones
+        details = message[2:]
+        if len(details) == 1 and isinstance(details[0], (list, tuple)):
+            details = details[0]
+        if len(details) >= 2:
+            # deluge 2 sends the exception's args rather than its message
+            message = details[1]
+            if isinstance(message, (list, tuple)):
+                message = ", ".join([str(arg) for arg in message])
+            return "%s: %s"%(details[0], message)
+        return str(details)
+
+    def send(self, data):
+        body = zlib.compress(self.rencode.dumps(data))
+        if self.protocol == 1:
+            self.writer.write(body)
+        else:
+            self.writer.write(self.HEADER.pack(self.PROTOCOL_VERSION, len(body)) + body)
+
+    async def receive(self):
+
+        if self.protocol == 1:
+            return await self.receiveStream()
+
+        (version, length) = self.HEADER.unpack(await self.reader.readexactly(self.HEADER.size))
+        if version != self.PROTOCOL_VERSION:
+            raise DelugeRPCError("Unsupported deluge rpc protocol version %d"%version)
+
+        return self.rencode.loads(zlib.decompress(await self.reader.readexactly(length)), decode_utf8=True)
+
+    async def receiveStream(self):
+
+        # a deluge 1.3 message ends where its zlib stream does, anything after that is the next one
+        decompressor = zlib.decompressobj()
+        parts = []
+        data = self.unused
+
+        while True:
+            if len(data) > 0:
+                parts.append(decompressor.decompress(data))
+            if decompressor.eof:
+                self.unused = decompressor.unused_data
+                return self.rencode.loads(b"".join(parts), decode_utf8=True)
+
+            data = await self.reader.read(65536)
+            if len(data) == 0:
+                raise DelugeRPCError("Connection closed by the deluge core")
+
+    async def close(self):
+
+        import asyncio
+
+        if self.writer != None:
+            self.writer.close()
+            try:
+                await asyncio.wait_for(self.writer.wait_closed(), 1)
+            except Exception:
+                pass
+            self.writer = None
 
 class DelugeInfo:
 
@@ -159,6 +2390,8 @@ class DelugeInfo:
     options = None
     sessionstate = None
     sessionstatefound = False
+    torrenttemplate = None
+    summarytemplate = None
 
     STATE_DOWNLOADING = 4
     STATE_SEEDING = 3
@@ -166,380 +2399,1414 @@ class DelugeInfo:
     STATE_PAUSED = 1
     STATE_UNKNOWN = 0
 
-    def __init__(self, options):
+    STATECODES = {
+        "Downloading": STATE_DOWNLOADING,
+        "Seeding": STATE_SEEDING,
+        "Queued": STATE_QUEUED,
+        "Paused": STATE_PAUSED
+    }
+
+    # the only states with connected peers or seeds, deluge disconnects them while checking
+    ACTIVE_STATES = ["Downloading", "Seeding"]
+
+    def __init__(self, options, rpcclient=None):
 
         try:
 
             #disable all logging within Deluge functions, only output info from this script
             logging.disable(logging.FATAL)
 
+            # the deluge client can be swapped out, e.g. for benchmarking against a fake core,
+            # otherwise it is imported on first connect
+            self.client = rpcclient
+
             self.options = options
+            self.log = getLog(options)
+            self.profiler = Profiler()
+            self.profiler.add("import", IMPORTTIME)
+            self.profiler.start("init")
             self.torrents_status = []
+            self.fetched = False
+            # the status came from a fresh --cachefile snapshot rather than the deluge core
+            self.cached = False
+            self.cache = None
+            self.store = None
+            self.renderCache = None
+            self.history = None
+            # the daemon keeps its torrents in sort order between polls
+            self.ordering = None
+            # the status keys written for each torrent with --format
+            self.recordKeys = None
+            self.backoffs = {}
             # sort out the server option
             self.options.server = self.options.server.replace("localhost", "127.0.0.1")
+            self.address = "%s:%d"%(self.options.server, self.options.port)
+
+            # several cores are queried side by side, rather than through the single deluge client
+            self.hosts = None
+            if self.options.hosts != None:
+                self.hosts = []
+                for spec in self.options.hosts:
+                    try:
+                        self.hosts.append(DelugeHost(spec, self.options))
+                    except ValueError:
+                        self.logError("Invalid --host: %s"%spec)
+                        sys.exit(2)
+
+            # the states the deluge core filters on, None for every state, and any left to check locally
+            self.states = self.getStates()
+            self.localStates = None
+
+            self.sortspec = SortSpec(self.options.sortby)
+            for sortfield in self.sortspec.unknown:
+                self.logError("Unknown sort field ignored: %s"%sortfield)
+
+            # the templates decide which status keys need to be requested
+            self.templateLoader = TemplateLoader()
+            self.loadTemplates()
+            self.projection = FieldProjection(self.options, self.torrenttemplate, self.summarytemplate, self.sortspec)
+            self.keys = self.projection.getKeys()
+
+            # a summary of session wide values is answered by deluge without sending any torrent status
+            self.sessionSummary = None
+            self.sessionOnly = self.hosts == None and self.options.cachefile == None and self.options.historyfile == None and self.projection.isSessionSummary()
+
+            # each --section renders its own output from the one torrent status fetched for them all
+            self.name = None
+            self.sections = []
+            if self.options.sections != None:
+                self.loadSections()
+            self.profiler.stop("init")
+
+        except Exception as e:
+            self.logError("DelugeInfo Init:Unexpected error:" + e.__str__())
 
-            # create the rpc and client objects
-            self.d = client.connect(self.options.server, self.options.port, self.options.username, self.options.password)
+    def run(self):
 
-            # We add the callback to the Deferred object we got from connect()
-            self.d.addCallback(self.on_connect_success)
+        try:
 
-            # We add the callback (in this case it's an errback, for error)
-            self.d.addErrback(self.on_connect_fail)
+            if self.options.cachefile != None:
+                self.runCached()
+            elif self.request() == True:
+                reactor.run()
 
-            reactor.run()
+            if self.usesHistory() == True:
+                self.updateHistory()
 
-        except Exception,e:
-            self.logError("DelugeInfo Init:Unexpected error:" + e.__str__())
+        except Exception as e:
+            self.logError("DelugeInfo Run:Unexpected error:" + e.__str__())
 
-    def on_get_torrents_status(self,torrents_status):
+    def loadSections(self):
+
+        parser = CommandLineParser()
+        for spec in self.options.sections:
+            try:
+                (name, sectionoptions) = parser.parse_section(spec, self.options)
+            except ValueError:
+                self.logError("Invalid --section: %s"%spec)
+                sys.exit(2)
+
+            section = DelugeInfo(sectionoptions, self.client)
+            section.name = name
+            self.sections.append(section)
+
+        # the summaries of the sections are totalled from the torrent status rather than the session
+        self.sessionOnly = False
+        (self.keys, self.states) = self.getRequest()
+
+        # the daemon's own output on its socket may want fewer states than the sections together
+        wanted = self.getStates()
+        if self.states != wanted:
+            self.localStates = wanted
+
+    def getRequest(self):
+
+        # the status keys and states to request, covering every --section, None standing for every state
+        if len(self.sections) == 0:
+            return (self.projection.getKeys(), self.getStates())
+
+        requests = [(section.keys, section.states) for section in self.sections]
+        if self.options.daemon == True:
+            # the daemon serves its own output on the socket as well
+            requests.append((self.projection.getKeys(), self.getStates()))
+
+        keys = set()
+        states = set()
+        for (requestkeys, requeststates) in requests:
+            keys.update(requestkeys)
+            if requeststates == None:
+                states = None
+            elif states != None:
+                states.update(requeststates)
+
+        if states == None:
+            return (sorted(keys), None)
+        return (sorted(keys), sorted(states))
+
+    def usesHistory(self):
+        if self.projection.usesHistory() == True:
+            return True
+        return len([section for section in self.sections if section.projection.usesHistory() == True]) > 0
+
+    def updateHistory(self):
+
+        self.history = RateHistory(self.options.history)
+
+        if self.options.historyfile == None:
+            # only the rates just fetched are known
+            if len(self.torrents_status) > 0:
+                self.history.record(self.torrents_status)
+            return
+
+        self.profiler.start("history")
+
+        # a status read from a --cachefile snapshot has already been sampled by the call that fetched it,
+        # calls that do sample add to the history in turn so none overwrites another's sample
+        historylock = None
+        if self.fetched == True and len(self.torrents_status) > 0:
+            historylock = FileLock(getUserPath(self.options.historyfile) + ".lock")
+            historylock.acquire()
+
+        try:
+            if self.history.load(self.options.historyfile) == False:
+                self.logInfo("Starting a new rate history in %s"%self.options.historyfile)
+            if historylock != None:
+                self.history.record(self.torrents_status)
+                self.history.save(self.options.historyfile)
+        finally:
+            if historylock != None:
+                historylock.release()
+
+        self.profiler.stop("history")
+
+    def runCached(self):
+
+        self.cache = SnapshotCache(self.options.cachefile, self.options.cachettl)
+
+        # a fresh snapshot needs no locking as it is only ever replaced by a rename
+        self.profiler.start("cache")
+        snapshot = self.cache.load(self.keys, self.states)
+        self.profiler.stop("cache")
+
+        if snapshot == None:
+            try:
+                self.cache.lock()
+            except EnvironmentError as e:
+                self.logError("Cache file can't be locked, querying without it! : " + e.__str__())
+                if self.request() == True:
+                    reactor.run()
+                return
+
+            try:
+                # another call may have refreshed the snapshot while we waited for the lock
+                snapshot = self.cache.load(self.keys, self.states)
+
+                if snapshot == None:
+                    shared = self.cache.getShared()
+                    if shared != None:
+                        (sharedkeys, sharedstates) = shared
+                        self.keys = sorted(set(self.keys).union(sharedkeys))
+                        self.setRequestStates(sharedstates)
+
+                    if self.request() == True:
+                        reactor.run()
+
+                    if self.fetched == True:
+                        self.cache.save(self.keys, self.states, self.torrents_status)
+                    return
+            finally:
+                self.cache.unlock()
+
+        self.logInfo("Using cached torrent status from %s"%self.options.cachefile)
+        (cachedstates, self.torrents_status) = snapshot
+        self.cached = True
+        if cachedstates != self.states:
+            self.localStates = self.states
+
+    def getStates(self):
+
+        states = None
+        if self.options.states != None:
+            states = set([state.strip().capitalize() for state in self.options.states.split(",") if state.strip() != ""])
+
+        if self.options.activeonly == True:
+            # only these states can be active, the peers and seeds are still checked locally
+            if states == None:
+                states = set(self.ACTIVE_STATES)
+            else:
+                states = states.intersection(self.ACTIVE_STATES)
+
+        if states == None:
+            return None
+        return sorted(states)
+
+    def setRequestStates(self, sharedstates):
+
+        # widen the states requested to those shared with other calls, filtering locally what this call wants
+        if self.states == None:
+            return
+
+        wanted = self.states
+        if sharedstates == None:
+            self.states = None
+        else:
+            self.states = sorted(set(self.states).union(sharedstates))
+
+        if self.states != wanted:
+            self.localStates = wanted
+
+    def getFilter(self):
+        if self.states == None:
+            return {}
+        return {"state": self.states}
+
+    def request(self):
+
+        # returns False if there is nothing to wait for on the reactor, when every deluge core is being
+        # backed off from or the built-in client has already fetched the status
+        if self.usesBuiltinClient() == True:
+            self.fetchBuiltin()
+            return False
+
+        if self.hosts != None:
+            return self.requestHosts()
+
+        if self.isBackingOff(self.address):
+            return False
+
+        self.connect()
+        return True
+
+    def requestHosts(self):
+
+        from twisted.internet import defer
+        self.loadRPC()
+
+        hosts = [host for host in self.hosts if not self.isBackingOff(host.address)]
+        if len(hosts) == 0:
+            return False
+
+        self.logInfo("Requesting status keys from %s: %s"%(", ".join([host.name for host in hosts]), ", ".join(self.keys)))
+        self.hostRequests = [HostRequest(host, self.keys, self.getFilter(), self.options) for host in hosts]
+
+        d = defer.DeferredList([hostRequest.start() for hostRequest in self.hostRequests])
+        d.addCallback(self.on_get_hosts_status)
+        return True
+
+    def loadRPC(self):
+        # twisted and deluge's client are imported on first use, which is timed as a stage of its own
+        if reactor == None:
+            self.profiler.start("rpcimport")
+            importRPC()
+            self.profiler.stop("rpcimport")
+
+    def usesBuiltinClient(self):
+        # a client passed in, e.g. the benchmark's fake core, is one of deluge's own running on twisted
+        return self.client == None and self.options.rpc == "asyncio"
+
+    def fetchBuiltin(self):
+
+        import asyncio
+
+        if self.hosts == None:
+            if self.isBackingOff(self.address) == False:
+                asyncio.run(self.fetchCore())
+            return
+
+        hosts = [host for host in self.hosts if not self.isBackingOff(host.address)]
+        if len(hosts) == 0:
+            return
+
+        self.logInfo("Requesting status keys from %s: %s"%(", ".join([host.name for host in hosts]), ", ".join(self.keys)))
+        self.hostRequests = [HostRequest(host, self.keys, self.getFilter(), self.options) for host in hosts]
+        results = asyncio.run(self.fetchHosts())
+        (self.fetched, self.torrents_status) = self.mergeHostsStatus(results)
+
+    async def fetchHosts(self):
+        # each core is queried side by side, the results as a DeferredList would give them
+        import asyncio
+        results = await asyncio.gather(*[hostRequest.fetch() for hostRequest in self.hostRequests])
+        return [(True, result) for result in results]
+
+    async def connectBuiltin(self, rpcclient):
+        # the TLS connection and the login are timed as stages of their own, within the one deadline
+        await rpcclient.open()
+        self.profiler.stop("connect")
+        self.profiler.start("auth")
+        await rpcclient.login()
+        self.profiler.stop("auth")
+
+    async def fetchCore(self):
+
+        rpcclient = DelugeRPCClient(self.options.server, self.options.port, self.options.username, self.options.password, self.options.rpcprotocol)
+
+        self.profiler.start("connect")
+        try:
+            await waitFor(self.connectBuiltin(rpcclient), self.options.connecttimeout, "Connection")
+        except Exception as e:
+            self.profiler.stop("connect")
+            self.profiler.stop("auth")
+            self.logError("Connection failed! : %s" % getErrorMessage(e))
+            self.recordResult(self.address, False)
+            await rpcclient.close()
+            return
+
+        self.logInfo("Connection successful")
+
+        try:
+            if self.sessionOnly == True:
+                self.logInfo("Requesting session status and state counts")
+                self.profiler.start("fetch")
+                session_status = await waitFor(rpcclient.call("core.get_session_status", ["payload_download_rate", "payload_upload_rate"]), self.options.timeout, "Session status request")
+                filter_tree = await waitFor(rpcclient.call("core.get_filter_tree", True, ["tracker_host", "label", "owner"]), self.options.timeout, "State count request")
+                self.setSessionSummary(session_status, filter_tree)
+            else:
+                self.logRequest()
+                self.profiler.start("fetch")
+                torrents_status = await waitFor(rpcclient.call("core.get_torrents_status", self.getFilter(), self.keys), self.options.timeout, "Torrent status request")
+                self.setTorrentsStatus(torrents_status)
+        except Exception as e:
+            self.logError("Torrent status request failed! : %s" % getErrorMessage(e))
+            self.recordResult(self.address, False)
+
+        await rpcclient.close()
+
+    def getBackoff(self, address):
+        if self.options.backoff <= 0:
+            return None
+        if address not in self.backoffs:
+            self.backoffs[address] = Backoff(address, self.options.backoff, self.options.maxbackoff)
+        return self.backoffs[address]
+
+    def isBackingOff(self, address):
+        backoff = self.getBackoff(address)
+        if backoff != None and backoff.getWait() > 0:
+            self.logInfo("Not trying %s for another %.1f seconds after %d failure(s)"%(address, backoff.getWait(), backoff.failures))
+            return True
+        return False
+
+    def recordResult(self, address, success):
+        backoff = self.getBackoff(address)
+        if backoff != None:
+            if success == True:
+                backoff.succeeded()
+            else:
+                self.logInfo("Backing off from %s for %s seconds"%(address, backoff.failed()))
+
+    def getOfflineOutput(self):
+        # when backing off, a failed core shows as offline rather than as no output at all,
+        # other programs reading --format records get no output instead
+        if self.options.backoff > 0 and self.options.format == "text":
+            return self.options.offlinetext
+        return None
+
+    def mergeHostsStatus(self, results):
+
+        # torrent ids are only unique per core, the same torrent may well be on more than one
+        merged = {}
+        answered = False
+
+        for (success, (host, torrents_status, error)) in results:
+
+            self.recordResult(host.address, torrents_status != None)
+
+            if torrents_status == None:
+                self.logError("Host %s failed! : %s"%(host.name, error))
+                continue
+
+            answered = True
+            for torrentid, torrent_status in torrents_status.items():
+                torrent_status["host"] = host.name
+                merged[torrentid + "@" + host.name] = torrent_status
+
+        for hostRequest in self.hostRequests:
+            self.profiler.add("fetch@" + hostRequest.host.name, hostRequest.elapsed)
+
+        return (answered, merged)
+
+    def on_get_hosts_status(self, results):
+        (self.fetched, self.torrents_status) = self.mergeHostsStatus(results)
+        reactor.stop()
+
+    def loadClient(self):
+        self.loadRPC()
+        if self.client == None:
+            self.client = client
+
+    def connect(self):
+
+        self.loadClient()
+
+        # create the rpc and client objects, the deluge client logs in as part of connecting
+        self.profiler.start("connect")
+        self.d = withDeadline(self.client.connect(self.options.server, self.options.port, self.options.username, self.options.password), self.options.connecttimeout, "Connection", self.client)
+
+        # We add the callback to the Deferred object we got from connect()
+        self.d.addCallback(self.on_connect_success)
+
+        # We add the callback (in this case it's an errback, for error)
+        self.d.addErrback(self.on_connect_fail)
+
+        return self.d
+
+    def requestTorrentsStatus(self):
+
+        if self.sessionOnly == True:
+            return self.requestSessionSummary()
+
+        self.logRequest()
+        self.profiler.start("fetch")
+        d = withDeadline(self.client.core.get_torrents_status(self.getFilter(), self.keys), self.options.timeout, "Torrent status request", self.client)
+        d.addCallback(self.on_get_torrents_status)
+        d.addErrback(self.on_get_torrents_status_fail)
+        return d
+
+    def logRequest(self):
+        self.logInfo("Requesting status keys: %s"%", ".join(self.keys))
+        if self.states != None:
+            self.logInfo("Requesting torrents in states: %s"%", ".join(self.states))
+
+    def setTorrentsStatus(self, torrents_status):
+
+        self.profiler.stop("fetch")
+        if self.options.profile == True:
+            self.profiler.set("payloadbytes", getPayloadSize(torrents_status))
 
         self.torrents_status = torrents_status
+        self.fetched = True
+        self.recordResult(self.address, True)
 
-        #for torrentid in torrents_status:
-            #print torrentid
-            #torrent_status =  torrents_status[torrentid]
+    def on_get_torrents_status(self,torrents_status):
+
+        self.setTorrentsStatus(torrents_status)
 
         # Disconnect from the daemon once we successfully connect
-        client.disconnect()
+        self.client.disconnect()
         # Stop the twisted main loop and exit
         reactor.stop()
 
+    def on_get_torrents_status_fail(self,result):
+        self.logError("Torrent status request failed! : %s" % result.getErrorMessage())
+        self.recordResult(self.address, False)
+        self.client.disconnect()
+        reactor.stop()
+
+    def requestSessionSummary(self):
+
+        from twisted.internet import defer
+
+        self.logInfo("Requesting session status and state counts")
+        self.profiler.start("fetch")
+        d = defer.DeferredList([
+            withDeadline(self.client.core.get_session_status(["payload_download_rate", "payload_upload_rate"]), self.options.timeout, "Session status request", self.client),
+            withDeadline(self.client.core.get_filter_tree(True, ["tracker_host", "label", "owner"]), self.options.timeout, "State count request", self.client)
+        ], fireOnOneErrback=True, consumeErrors=True)
+        d.addCallback(self.on_get_session_summary)
+        d.addErrback(self.on_get_session_summary_fail)
+        return d
+
+    def on_get_session_summary(self, results):
+
+        ((success, session_status), (success, filter_tree)) = results
+        self.setSessionSummary(session_status, filter_tree)
+        self.client.disconnect()
+        reactor.stop()
+
+    def setSessionSummary(self, session_status, filter_tree):
+
+        self.profiler.stop("fetch")
+
+        # the state filter counts include an "All" entry, the number of torrents
+        statecounts = dict(filter_tree["state"])
+        self.sessionSummary = SummaryData([], self.keys)
+        self.sessionSummary.notorrents = statecounts.pop("All", 0)
+        self.sessionSummary.downloadrate = session_status["payload_download_rate"]
+        self.sessionSummary.uploadrate = session_status["payload_upload_rate"]
+        self.sessionSummary.statecounts = statecounts
+
+        self.fetched = True
+        self.recordResult(self.address, True)
+
+    def on_get_session_summary_fail(self, result):
+        # the first request to fail is wrapped up by the DeferredList
+        return self.on_get_torrents_status_fail(result.value.subFailure)
+
     # We create a callback function to be called upon a successful connection
     def on_connect_success(self,result):
+        self.profiler.stop("connect")
         self.logInfo("Connection successful")
-        client.core.get_torrents_status("","").addCallback(self.on_get_torrents_status)
+        return self.requestTorrentsStatus()
 
     # We create another callback function to be called when an error is encountered
     def on_connect_fail(self,result):
+        self.profiler.stop("connect")
         self.logError("Connection failed! : %s" % result.getErrorMessage())
+        self.recordResult(self.address, False)
         reactor.stop()
 
-    def getTorrentTemplateOutput(self, template, name, state, totaldone, totalsize, progress, nofiles, downloadrate, uploadrate, eta, currentpeers, currentseeds, totalpeers, totalseeds, ratio):
+    def getTorrentTemplateOutput(self, template, torrent_status):
 
         try:
+            return template.render(torrent_status)
 
-            output = template
-
-            output = output.replace("[name]",name)
-            output = output.replace("[state]",state)
-            output = output.replace("[totaldone]",totaldone)
-            output = output.replace("[totalsize]",totalsize)
-            output = output.replace("[progress]",progress)
-            output = output.replace("[nofiles]",nofiles)
-            output = output.replace("[downloadrate]",downloadrate)
-            output = output.replace("[uploadrate]",uploadrate)
-            output = output.replace("[eta]",eta)
-            output = output.replace("[currentpeers]",currentpeers)
-            output = output.replace("[currentseeds]",currentseeds)
-            output = output.replace("[totalpeers]",totalpeers)
-            output = output.replace("[totalseeds]",totalseeds)
-            output = output.replace("[ratio]",ratio)
-
-            # get rid of any excess crlf's and add just one
-            output = output.rstrip(" \n")
-            output = output + "\n"
-
-            return output
-
-        except Exception,e:
+        except Exception as e:
             self.logError("getTorrentTemplateOutput:Unexpected error:" + e.__str__())
             return ""
 
-    def getSummaryTemplateOutput(self, template, notorrents, totalprogress, totaldone, totalsize, totaldownloadrate, totaluploadrate, totaleta, currentpeers, currentseeds, totalpeers, totalseeds, totalratio):
+    def getSummaryTemplateOutput(self, template, summaryData):
 
         try:
+            return template.render(summaryData)
 
-            output = template
-
-            output = output.replace("[notorrents]",notorrents)
-            output = output.replace("[totalprogress]",totalprogress)
-            output = output.replace("[totaldone]",totaldone)
-            output = output.replace("[totalsize]",totalsize)
-            output = output.replace("[totaldownloadrate]",totaldownloadrate)
-            output = output.replace("[totaluploadrate]",totaluploadrate)
-            output = output.replace("[totaleta]",totaleta)
-            output = output.replace("[currentpeers]",currentpeers)
-            output = output.replace("[currentseeds]",currentseeds)
-            output = output.replace("[totalpeers]",totalpeers)
-            output = output.replace("[totalseeds]",totalseeds)
-            output = output.replace("[totalratio]",totalratio)
+        except Exception as e:
+            self.logError("getSummaryTemplateOutput:Unexpected error:" + e.__str__())
+            return ""
 
-            # get rid of any excess crlf's and add just one
-            output = output.rstrip(" \n")
-            output = output + "\n"
+    def loadTemplates(self):
 
-            return output
+        self.logInfo("Preparing templates...")
 
-        except Exception,e:
-            self.logError("getSummaryTemplateOutput:Unexpected error:" + e.__str__())
-            return ""
+        if self.options.summarytemplate == None:
+            # create default summary template, only once so a reload keeps the same template
+            if self.summarytemplate == None:
+                self.summarytemplate = Template("Total Torrents Queued:[notorrents] \n[totaldone]/[totalsize] - [totalprogress]\n" + "DL: [totaldownloadrate] UL: [totaluploadrate]\n", SummaryData.ATTRIBUTES)
+        else:
+            # load the template file contents
+            try:
+                self.summarytemplate = self.templateLoader.load(self.options.summarytemplate, SummaryData.ATTRIBUTES)
+            except:
+                self.logError("Summary Template file no found!")
+                sys.exit(2)
+
+        if self.options.torrenttemplate == None:
+            # create default template, only once so a reload keeps the same template
+            if self.torrenttemplate == None:
+                self.torrenttemplate = Template("[name]\n[state]\n[totaldone]/[totalsize] - [progress]\n" + "DL: [downloadrate] UL: [uploadrate] ETA:[eta]\n", TorrentData.FIELDS, getTorrentGetter)
+        else:
+            # load the template file contents
+            try:
+                self.torrenttemplate = self.templateLoader.load(self.options.torrenttemplate, TorrentData.FIELDS, getTorrentGetter)
+            except:
+                self.logError("Torrent Template file no found!")
+                sys.exit(2)
 
     def writeOutput(self):
 
+        # each part is encoded and written as soon as it is rendered, whatever the locale's encoding
+        sys.stdout.flush()
+        if self.projection.usesRecords() == True:
+            # records are bytes already
+            self.renderOutput(sys.stdout.buffer.write)
+        else:
+            stream = codecs.getwriter("utf-8")(sys.stdout.buffer)
+            if self.renderOutput(stream.write) == True:
+                stream.write("\n")
+
+        self.profiler.start("write")
+        sys.stdout.buffer.flush()
+        self.profiler.stop("write")
+
+    def writeSections(self, offline=None):
+
+        # each section is rendered in turn from the status fetched for them all, or given the offline text
+        self.profiler.start("sections")
+        sectiondir = os.path.expanduser(self.options.sectiondir)
+        if not os.path.isdir(sectiondir):
+            os.makedirs(sectiondir)
+
+        for section in self.sections:
+
+            output = None
+            if offline == None:
+                section.torrents_status = self.torrents_status
+                section.store = self.store
+                section.history = self.history
+                # the status may cover more states than a section wants, so it filters them itself
+                section.localStates = section.states
+                output = section.getEncodedOutput()
+            elif offline and section.projection.usesRecords() == False:
+                output = offline.encode("utf-8") + b"\n"
+
+            if output == None:
+                output = b""
+
+            writeFile(os.path.join(sectiondir, section.name), output)
+
+        self.profiler.stop("sections")
+
+    def getTorrentOutput(self, torrentid, torrent_status):
+
+        if self.renderCache == None:
+            return self.getTorrentTemplateOutput(self.torrenttemplate, torrent_status)
+
+        # torrents whose templated values are unchanged since they were last output keep their rendered output
+        fingerprint = self.renderCache.getFingerprint(torrent_status)
+        output = self.renderCache.get(torrentid, fingerprint)
+
+        if output == None:
+            output = self.getTorrentTemplateOutput(self.torrenttemplate, torrent_status)
+            self.renderCache.put(torrentid, fingerprint, output)
+
+        return output
+
+    def renderTorrents(self, torrentids):
+
+        # yields the output of each torrent in turn, those not in the render cache are handed to
+        # the --workers pool when there are enough of them, otherwise rendered here
+        torrents_status = self.torrents_status
+        renderCache = self.renderCache
+        cached = {}
+        fingerprints = {}
+        missing = []
+
+        for torrentid in torrentids:
+            if renderCache != None:
+                fingerprint = renderCache.getFingerprint(torrents_status[torrentid])
+                output = renderCache.get(torrentid, fingerprint)
+                if output != None:
+                    cached[torrentid] = output
+                    continue
+                fingerprints[torrentid] = fingerprint
+            missing.append(torrentid)
+
+        rendered = None
+        if len(missing) >= max(self.options.workerthreshold, 1):
+            self.profiler.set("pooled", len(missing))
+            rendered = self.renderInPool(missing)
+
+        for torrentid in torrentids:
+            if torrentid in cached:
+                yield cached[torrentid]
+                continue
+
+            if rendered != None:
+                output = next(rendered)
+            else:
+                output = self.getTorrentTemplateOutput(self.torrenttemplate, torrents_status[torrentid])
+
+            if renderCache != None:
+                renderCache.put(torrentid, fingerprints[torrentid], output)
+            yield output
+
+    def renderInPool(self, torrentids):
+
+        # a few chunks per worker evens out the load, the pool hands back the chunks in the
+        # order they were given so the outputs keep the sort order
+        workers = self.options.workers
+        chunksize = -(-len(torrentids) // (workers * 4))
+        torrents_status = self.torrents_status
+        template = self.torrenttemplate
+
+        chunks = ((template, [torrents_status[torrentid] for torrentid in torrentids[start:start + chunksize]]) for start in range(0, len(torrentids), chunksize))
+
+        for (outputs, errors) in getRenderPool(workers).imap(renderChunk, chunks):
+            for error in errors:
+                self.logError("getTorrentTemplateOutput:Unexpected error:" + error)
+            for output in outputs:
+                yield output
+
+    def getOutput(self):
+
+        parts = []
+        if self.renderOutput(parts.append) == True:
+            return "".join(parts)
+        return None
+
+    def hasRecordsOutput(self):
+        # records are output whenever the status is known, even with no torrents, but not when the core couldn't be reached
+        return self.projection.usesRecords() == True and (self.fetched == True or self.cached == True)
+
+    def getEncodedOutput(self):
+
+        # the output as it would be written to stdout, None if there is none
+        if self.projection.usesRecords() == True:
+            parts = []
+            if self.renderOutput(parts.append) == True:
+                return b"".join(parts)
+            return None
+
+        output = self.getOutput()
+        if output != None:
+            return output.encode("utf-8") + b"\n"
+        return None
+
+    def getTorrentRecord(self, torrentid, torrent_status):
+
+        # the raw status values of a torrent for --format, torrent ids merged from several cores lose their host
+        if self.hosts != None:
+            torrentid = torrentid.rpartition("@")[0]
+
+        record = {"id": torrentid}
+        for key in self.recordKeys:
+            if key in torrent_status:
+                record[key] = torrent_status[key]
+        record["state_code"] = self.STATECODES.get(torrent_status.get("state"), self.STATE_UNKNOWN)
+
+        return record
+
+    def renderOutput(self, write):
+
+        # passes each part of the output to write in turn, returns True if there was output,
+        # with --format the parts are encoded records rather than text
         try:
 
             self.logInfo("Proceeding with torrent data interpretation...")
 
-            torrentDataList = []
-            torrentItemList = ["num_peers","num_seeds","name","state","total_done","total_size","total_wanted","progress","files","eta","download_payload_rate","upload_payload_rate","total_peers","total_seeds","ratio","queue"]
-            highesteta = 0
-
-            # summary variables
-            summary_notorrent = 0
-            summary_totaldone = 0
-            summary_totalsize = 0
-            summary_totaldownloadrate = 0.0
-            summary_totaluploadrate = 0.0
-            summary_totaleta = 0
-            summary_currentpeers = 0
-            summary_currentseeds = 0
-            summary_totalpeers = 0
-            summary_totalseeds = 0
-            summary_totalratio = 0.0
-
-            self.logInfo("Preparing templates...")
-
-            if self.options.summarytemplate == None:
-                # create default summary template
-                summarytemplate = "Total Torrents Queued:[notorrents] \n[totaldone]/[totalsize] - [totalprogress]\n" + "DL: [totaldownloadrate] UL: [totaluploadrate]\n"
-            else:
-                # load the template file contents
-                try:
-                    #fileinput = open(self.options.summarytemplate)
-                    fileinput = codecs.open(os.path.expanduser(self.options.summarytemplate), encoding='utf-8')
-                    summarytemplate = fileinput.read()
-                    fileinput.close()
-                except:
-                    self.logError("Summary Template file no found!")
-                    sys.exit(2)
-
-            if self.options.torrenttemplate == None:
-                # create default template
-                torrenttemplate = "[name]\n[state]\n[totaldone]/[totalsize] - [progress]\n" + "DL: [downloadrate] UL: [uploadrate] ETA:[eta]\n"
-            else:
-                # load the template file contents
-                try:
-                    #fileinput = open(self.options.torrenttemplate)
-                    fileinput = codecs.open(os.path.expanduser(self.options.torrenttemplate), encoding='utf-8')
-                    torrenttemplate = fileinput.read()
-                    fileinput.close()
-                except:
-                    self.logError("Torrent Template file no found!")
-                    sys.exit(2)
+            records = None
+            if self.projection.usesRecords() == True:
+                records = RecordWriter(self.options.format, write)
+                self.recordKeys = self.projection.getRecordKeys(self.hosts != None)
+
+            if self.sessionSummary != None:
+                if self.sessionSummary.notorrents == 0:
+                    self.logInfo("No torrents found")
+                    return False
+                write(self.getSummaryTemplateOutput(self.summarytemplate, self.sessionSummary))
+                return True
+
+            if self.renderCache != None:
+                self.renderCache.setTemplate(self.torrenttemplate)
+                if self.store != None:
+                    for torrentid in self.store.removed:
+                        self.renderCache.discard(torrentid)
 
             if len(self.torrents_status) > 0:
 
                 self.logInfo("Processing %s torrent(s)..."%str(len(self.torrents_status)))
+                self.profiler.set("torrents", len(self.torrents_status))
+                self.profiler.start("process")
 
-                for torrentid in self.torrents_status:
-                    torrent_status = self.torrents_status[torrentid]
-
-                    if torrent_status != None:
-
-                        if self.options.activeonly == True:
-
-                            active = False
-
-                            # check for activity
-                            if "num_peers" in torrent_status:
-                                if torrent_status["num_peers"] > 0:
-                                    active = True
-
-                            if "num_seeds" in torrent_status:
-                                if torrent_status["num_seeds"] > 0:
-                                    active = True
-
-                        # output details if all required or if active
-                        if self.options.activeonly == False or active == True:
-
-                            if "name" in torrent_status:
-                                name = torrent_status["name"]
-                            else:
-                                name = "Unknown"
-
-                            if "state" in torrent_status:
-                                state = torrent_status["state"]
-
-                                if state == "Downloading":
-                                    statecode = self.STATE_DOWNLOADING
-                                elif state == "Seeding":
-                                    statecode = self.STATE_SEEDING
-                                elif state == "Queued":
-                                    statecode = self.STATE_QUEUED
-                                elif state == "Paused":
-                                    statecode = self.STATE_PAUSED
-                                else:
-                                    statecode = self.STATE_UNKNOWN
-                            else:
-                                state = "Unknown"
-                                statecode = self.STATE_UNKNOWN
-
-                            if "total_done" in torrent_status:
-                                totaldone = fsize(torrent_status["total_done"])
-                                summary_totaldone = summary_totaldone + int(torrent_status["total_done"])
-                            else:
-                                totaldone = "??.? KiB"
-
-                            if "total_size" in torrent_status:
-                                totalsize = fsize(torrent_status["total_wanted"])
-                                summary_totalsize = summary_totalsize + int(torrent_status["total_wanted"])
-                            else:
-                                totalsize = "??.? KiB"
-
-                            if "progress" in torrent_status:
-                                progress = str(round(torrent_status["progress"],2))+"%"
-                            else:
-                                progress = "?.?%"
-
-                            if "files" in torrent_status:
-                                nofiles = str(len(torrent_status["files"]))
-                            else:
-                                nofiles = "?"
-
-                            if "eta" in torrent_status:
-                                eta = torrent_status["eta"]
-
-                                if eta > highesteta:
-                                    highesteta = eta
-
-                                etatext = ftime(eta)
-                            else:
-                                eta = None
-                                etatext = "Unknown"
-
-                            if "download_payload_rate" in torrent_status:
-                                downloadrate = float(torrent_status["download_payload_rate"])
-                                summary_totaldownloadrate = summary_totaldownloadrate + downloadrate
-                                downloadtext = fspeed(downloadrate)
-                            else:
-                                downloadrate = 0
-                                downloadtext = "?.? KiB/s"
-
-                            if "upload_payload_rate" in torrent_status:
-                                uploadrate = float(torrent_status["upload_payload_rate"])
-                                summary_totaluploadrate = summary_totaluploadrate + uploadrate
-                                uploadtext = fspeed(uploadrate)
-                            else:
-                                uploadrate = 0
-                                uploadtext = "?.? KiB/s"
-
-                            if "num_peers" in torrent_status:
-                                currentpeers = str(torrent_status["num_peers"])
-                                summary_currentpeers = summary_currentpeers + int(torrent_status["num_peers"])
-                            else:
-                                currentpeers = "?"
-
-                            if "num_seeds" in torrent_status:
-                                currentseeds = str(torrent_status["num_seeds"])
-                                summary_currentseeds = summary_currentseeds + int(torrent_status["num_seeds"])
-                            else:
-                                currentseeds = "?"
-
-                            if "total_peers" in torrent_status:
-                                totalpeers = str(torrent_status["total_peers"])
-                                summary_totalpeers = summary_totalpeers + int(torrent_status["total_peers"])
-                            else:
-                                totalpeers = "?"
-
-                            if "total_seeds" in torrent_status:
-                                totalseeds = str(torrent_status["total_seeds"])
-                                summary_totalseeds = summary_totalseeds + int(torrent_status["total_seeds"])
-                            else:
-                                totalseeds = "?"
-
-                            if "ratio" in torrent_status:
-                                ratio = str(round(torrent_status["ratio"],3)).ljust(5,"0")
-                            else:
-                                ratio = "?.???"
-
-                            # for sorting in the same way as progress, we need to order from high to low
-                            if "queue" in torrent_status:
-                                queueorder = torrent_status["queue"]
-                            else:
-                                queueorder = -1
-
-                            sortby = self.options.sortby
-
-                            summary_notorrent = summary_notorrent + 1
-
-                            # add torrent data to list
-                            torrentData = TorrentData(name, state, statecode, totaldone, totalsize, progress, nofiles, downloadrate, downloadtext, uploadrate, uploadtext, eta, etatext, currentpeers, currentseeds, totalpeers, totalseeds, ratio, queueorder, sortby)
-                            torrentDataList.append(torrentData)
-
-                    else:
-                        self.logInfo("No torrent status data available for torrentid: "+torrentid)
-
-                if summary_notorrent > 0:
-
-                    output = u""
+                torrent_status_list = []
+                sortentries = []
+                getSortKey = self.sortspec.getSortKey
 
-                    if self.options.showsummary == True:
+                # the daemon's torrents are kept in order from one poll to the next rather than sorted each time
+                ordering = None
+                if self.store != None and self.options.hidetorrentdetail == False:
+                    if self.ordering == None:
+                        self.ordering = TorrentOrder(getSortKey, self.isListed)
+                    ordering = self.ordering
 
-                        # sort out summary data for output
-                        summary_notorrent = str(summary_notorrent)
-                        summary_totalprogress = str(round((float(summary_totaldone) / float(summary_totalsize)) *100,2))+"%"
-                        summary_totaldone = fsize(summary_totaldone)
-                        summary_totalsize = fsize(summary_totalsize)
-                        summary_totaldownloadrate = fspeed(summary_totaldownloadrate)
-                        summary_totaluploadrate = fspeed(summary_totaluploadrate)
-                        summary_totaleta = ftime(highesteta)
-                        summary_currentpeers = str(summary_currentpeers)
-                        summary_currentseeds = str(summary_currentseeds)
-                        summary_totalpeers = str(summary_totalpeers)
-                        summary_totalseeds = str(summary_totalseeds)
-                        summary_totalratio = "?.???"
-
-                        output = self.getSummaryTemplateOutput(summarytemplate, summary_notorrent, summary_totalprogress, summary_totaldone, summary_totalsize, summary_totaldownloadrate, summary_totaluploadrate, summary_totaleta, summary_currentpeers, summary_currentseeds, summary_totalpeers, summary_totalseeds, summary_totalratio)
+                localStates = self.localStates
 
-                    if self.options.hidetorrentdetail == False:
+                if self.options.hidetorrentdetail == True and self.options.activeonly == False and localStates == None:
+                    # a summary on its own only totals the raw values, nothing is needed from each torrent
+                    torrent_status_list = [torrent_status for torrent_status in self.torrents_status.values() if torrent_status != None]
+
+                else:
 
-                        outputCount = 0
+                    # checked once rather than formatting a log line for each torrent without status
+                    logMissing = self.log.isEnabledFor(Log.INFO)
 
-                        # sort list, eta based
-                        self.logInfo("Sorting torrent list using: %s"%self.options.sortby)
-                        torrentDataList.sort(reverse = True)
+                    # with a single core [host] is the --server option
+                    hostname = None
+                    if self.hosts == None and "host" in self.torrenttemplate.fields:
+                        hostname = self.options.server
 
-                        # output torrent data using the template
-                        for torrentData in torrentDataList:
+                    for torrentid in self.torrents_status:
+                        torrent_status = self.torrents_status[torrentid]
+
+                        if torrent_status != None:
+
+                            if hostname != None:
+                                torrent_status["host"] = hostname
+
+                            # only needed when the status came from a snapshot shared with calls wanting other states
+                            if localStates != None and torrent_status.get("state") not in localStates:
+                                continue
 
-                            # keep a tally of torrent output, if past the limit then exit
-                            if self.options.limit <> 0:
-                                outputCount = outputCount + 1
-                                if outputCount > self.options.limit:
-                                    break
+                            if self.options.activeonly == True:
 
-                            output = output + self.getTorrentTemplateOutput(torrenttemplate, torrentData.name, torrentData.state, torrentData.totaldone, torrentData.totalsize, torrentData.progress, torrentData.nofiles, torrentData.downloadtext, torrentData.uploadtext, torrentData.etatext, torrentData.currentpeers, torrentData.currentseeds, torrentData.totalpeers, torrentData.totalseeds, torrentData.ratio)+"\n"
+                                # check for activity
+                                if torrent_status.get("num_peers", 0) <= 0 and torrent_status.get("num_seeds", 0) <= 0:
+                                    continue
 
-                    print output.encode("utf-8")
+                            torrent_status_list.append(torrent_status)
+
+                            # only the sort key is needed until we know which torrents are output
+                            if self.options.hidetorrentdetail == False and ordering == None:
+                                sortentries.append((getSortKey(torrent_status), torrentid))
+
+                        elif logMissing == True:
+                            self.logInfo("No torrent status data available for torrentid: "+torrentid)
+
+                self.profiler.stop("process")
+
+                if len(torrent_status_list) > 0:
+
+                    if self.options.showsummary == True:
+                        self.profiler.start("summary")
+                        summaryData = SummaryData(torrent_status_list, self.keys)
+                        if self.history != None and self.projection.usesSummaryHistory() == True:
+                            self.history.annotateSummary(summaryData, localStates or self.states)
+                        if records != None:
+                            records.start(summaryData.getRecord())
+                        else:
+                            write(self.getSummaryTemplateOutput(self.summarytemplate, summaryData))
+                        self.profiler.stop("summary")
+
+                    if self.options.hidetorrentdetail == False:
+
+                        self.logInfo("Sorting torrent list using: %s"%self.sortspec)
+                        self.profiler.start("sort")
+                        if ordering != None:
+                            # only the torrents that changed or went since the last poll are sorted again
+                            ordering.update(self.store)
+                            selectedTorrentIds = ordering.getTorrentIds(self.torrents_status, self.options.limit)
+                        elif self.options.limit != 0:
+                            # only the top torrents are needed, no need to sort them all
+                            sortentries = heapq.nsmallest(max(self.options.limit, 0), sortentries, key=itemgetter(0))
+                            selectedTorrentIds = [torrentid for (sortkey, torrentid) in sortentries]
+                        else:
+                            sortentries.sort(key=itemgetter(0))
+                            selectedTorrentIds = [torrentid for (sortkey, torrentid) in sortentries]
+                        self.profiler.stop("sort")
+
+                        if self.renderCache != None:
+                            self.renderCache.reserve(len(selectedTorrentIds))
+
+                        # output torrent data using the template
+                        self.profiler.start("render")
+                        getTorrentOutput = self.getTorrentOutput
+                        torrents_status = self.torrents_status
+                        if self.history != None and self.projection.usesTorrentHistory() == True:
+                            # only the torrents being output need their averages worked out
+                            annotate = self.history.annotate
+                            for torrentid in selectedTorrentIds:
+                                annotate(torrentid, torrents_status[torrentid])
+                        if records != None:
+                            records.start()
+                            getTorrentRecord = self.getTorrentRecord
+                            for torrentid in selectedTorrentIds:
+                                records.add(getTorrentRecord(torrentid, torrents_status[torrentid]))
+                        elif self.options.workers > 1:
+                            for output in self.renderTorrents(selectedTorrentIds):
+                                write(output + "\n")
+                        else:
+                            for torrentid in selectedTorrentIds:
+                                write(getTorrentOutput(torrentid, torrents_status[torrentid]) + "\n")
+                        self.profiler.stop("render")
+
+                    if records != None:
+                        records.finish()
+
+                    return True
+
+                elif records != None:
+                    self.finishEmptyRecords(records)
+                    return True
 
                 else:
-                    print u"No torrent info to display"
+                    write("No torrent info to display")
+                    return True
 
             else:
                 self.logInfo("No torrents found")
+                if records != None:
+                    self.finishEmptyRecords(records)
+                    return True
 
-        except Exception,e:
-            self.logError("writeOutput:Unexpected error:" + e.__str__())
+        except Exception as e:
+            self.logError("renderOutput:Unexpected error:" + e.__str__())
 
-    def logInfo(self, text):
-        if self.options.verbose == True:
-            print >> sys.stdout, "INFO: " + text
+        return False
 
-        if self.options.infologfile != None:
-            datetimestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            fileoutput = open(self.options.infologfile, "ab")
-            fileoutput.write(datetimestamp+" INFO: "+text+"\n")
-            fileoutput.close()
+    def isListed(self, torrent_status):
+
+        # the same checks renderOutput makes of each torrent as it goes through them
+        if self.localStates != None and torrent_status.get("state") not in self.localStates:
+            return False
+
+        if self.options.activeonly == True and torrent_status.get("num_peers", 0) <= 0 and torrent_status.get("num_seeds", 0) <= 0:
+            return False
+
+        return True
+
+    def finishEmptyRecords(self, records):
+        # with no torrents to output the json document is still complete, jsonl and msgpack have no torrent records
+        if self.options.showsummary == True:
+            records.start(SummaryData([], self.keys).getRecord())
+        records.finish()
+
+    def logProfile(self):
+        writeProfile(self.options, self.profiler)
+        self.profiler.reset()
+
+    def logInfo(self, text):
+        self.log.info(text)
 
     def logError(self, text):
-        print >> sys.stderr, "ERROR: " + text
+        self.log.error(text)
+
+def writeFile(path, data, mode=0o666):
 
-        if self.options.errorlogfile != None:
-            datetimestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            fileoutput = open(self.options.errorlogfile, "ab")
-            fileoutput.write(datetimestamp+" ERROR: "+text+"\n")
+    # write to a temporary file and rename it over the file so readers never see a partial file,
+    # the temporary file is removed again if either step fails
+    temppath = "%s.%d.tmp"%(path, os.getpid())
+    try:
+        # a temporary file left in the way is replaced rather than written through, so the mode,
+        # narrowed by the umask, is always this one
+        try:
+            os.unlink(temppath)
+        except OSError:
+            pass
+        fileoutput = os.fdopen(os.open(temppath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode), "wb")
+        try:
+            fileoutput.write(data)
+        finally:
             fileoutput.close()
+        os.rename(temppath, path)
+    except Exception:
+        try:
+            os.unlink(temppath)
+        except OSError:
+            pass
+        raise
+
+def getUserPath(path):
+
+    # a bare filename is kept in the user's own runtime directory, or ~/.cache/conkydeluge,
+    # rather than wherever conky happens to run from
+    path = os.path.expanduser(path)
+    if os.path.dirname(path) != "":
+        return path
+
+    directory = os.environ.get("XDG_RUNTIME_DIR")
+    if not directory:
+        directory = os.path.join(os.path.expanduser("~"), ".cache", "conkydeluge")
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+    return os.path.join(directory, path)
+
+def isOwnFile(fileinput):
+    return os.fstat(fileinput.fileno()).st_uid == os.getuid()
+
+def createOutputFactory(daemon):
+
+    from twisted.internet.protocol import Factory, Protocol
+
+    class OutputProtocol(Protocol):
+
+        def connectionMade(self):
+            # send the latest rendered output and hang up, no request is expected
+            self.transport.write(self.factory.daemon.output)
+            self.transport.loseConnection()
+
+    factory = Factory()
+    factory.protocol = OutputProtocol
+    factory.daemon = daemon
+    return factory
+
+def createMetricsFactory(daemon):
+
+    from twisted.internet.protocol import Factory, Protocol
+
+    class MetricsProtocol(Protocol):
+
+        # the most of a request read before giving up on it
+        MAXREQUEST = 8192
+
+        def connectionMade(self):
+            self.request = b""
+
+        def dataReceived(self, data):
+
+            # only the request line matters, the answer is sent once the headers are in
+            if self.request == None:
+                return
+            self.request = self.request + data
+            if b"\r\n\r\n" not in self.request and b"\n\n" not in self.request:
+                if len(self.request) > self.MAXREQUEST:
+                    self.request = None
+                    self.transport.loseConnection()
+                return
+
+            fields = self.request.split(b"\n", 1)[0].split()
+            self.request = None
+
+            if len(fields) >= 2 and fields[0] in (b"GET", b"HEAD") and fields[1].split(b"?")[0] in (b"/", b"/metrics"):
+                # the text of the last poll, no request is made to the deluge core
+                status = b"200 OK"
+                contenttype = Metrics.CONTENTTYPE
+                body = self.factory.daemon.metrics.text
+            else:
+                status = b"404 Not Found"
+                contenttype = b"text/plain; charset=utf-8"
+                body = b"Not found, metrics are served at /metrics\n"
+
+            headers = b"HTTP/1.0 " + status + b"\r\nContent-Type: " + contenttype + (b"\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"%len(body))
+            if len(fields) > 0 and fields[0] == b"HEAD":
+                body = b""
+
+            self.transport.write(headers + body)
+            self.transport.loseConnection()
+
+    factory = Factory()
+    factory.protocol = MetricsProtocol
+    factory.daemon = daemon
+    return factory
+
+class DelugeDaemon(DelugeInfo):
+
+    # deluge core events naming a torrent whose status has to be requested again
+    EVENTS = ["TorrentAddedEvent", "TorrentRemovedEvent", "TorrentStateChangedEvent", "TorrentFinishedEvent"]
+
+    # status keys that only change along with one of the events, so aren't refreshed, a rename
+    # or a change of file priorities sends none of them so name and total_wanted are refreshed
+    EVENT_KEYS = set(["state", "num_files"])
+
+    def __init__(self, options, rpcclient=None):
+        DelugeInfo.__init__(self, options, rpcclient)
+        # polling for diffs is already cheaper than building a summary from the session
+        self.sessionOnly = False
+        self.output = b""
+        self.connecting = False
+        self.requesting = False
+        # only set once logged in, a connection left half open by a timeout is never used
+        self.loggedin = False
+        self.store = TorrentStore(self.keys)
+        self.renderCache = RenderCache(self.projection.getTorrentTemplateKeys())
+        for section in self.sections:
+            section.renderCache = RenderCache(section.projection.getTorrentTemplateKeys())
+        self.diff = False
+
+        # torrents the deluge core has sent events for since they were last requested
+        self.events = self.options.events == True and self.hosts == None
+        if self.options.events == True and self.hosts != None:
+            self.logInfo("--events is not used with --host, each core is queried in full")
+        self.dirty = set()
+        self.requestedTorrentIds = []
+        self.refreshed = 0
+
+        self.metrics = None
+        if self.options.metricsport != None:
+            self.metrics = Metrics()
+
+    def run(self):
+
+        try:
+
+            from twisted.internet.task import LoopingCall
+            self.loadClient()
+
+            self.log.startFlushing()
+
+            factory = createOutputFactory(self)
+            # wantPID cleans up a stale socket left behind by a previous daemon
+            reactor.listenUNIX(os.path.expanduser(self.options.socket), factory, mode=0o600, wantPID=True)
+            self.logInfo("Serving output on %s"%self.options.socket)
+
+            if self.metrics != None:
+                reactor.listenTCP(self.options.metricsport, createMetricsFactory(self), interface=self.options.metricsaddress)
+                self.logInfo("Serving metrics on http://%s:%d/metrics"%(self.options.metricsaddress, self.options.metricsport))
+
+            self.poller = LoopingCall(self.poll)
+            self.poller.start(self.options.interval, now=True)
+
+            reactor.run()
+
+        except Exception as e:
+            self.logError("DelugeDaemon Run:Unexpected error:" + e.__str__())
+
+    def poll(self):
+
+        # skip this cycle while the previous connect or request is still outstanding
+        if self.connecting == True or self.requesting == True:
+            return
+
+        self.reloadTemplates()
+
+        if self.hosts != None:
+            # each core is queried in full, the merged status replaces the last one
+            self.requesting = self.requestHosts()
+            if self.requesting == False:
+                self.setOfflineOutput()
+        elif self.loggedin == True and self.client.connected():
+            self.requesting = True
+            self.requestTorrentsStatus()
+        elif self.isBackingOff(self.address):
+            self.setOfflineOutput()
+        else:
+            self.connecting = True
+            self.connect()
+
+    def on_connect_success(self,result):
+        self.connecting = False
+        self.loggedin = True
+        self.requesting = True
+        self.resync()
+        if self.events == True:
+            self.subscribe()
+        return DelugeInfo.on_connect_success(self, result)
+
+    def subscribe(self):
+
+        # event handlers belong to the connection, so they are registered again after each connect
+        try:
+            for event in self.EVENTS:
+                self.client.register_event_handler(event, self.on_torrent_event)
+            self.logInfo("Listening for events: %s"%", ".join(self.EVENTS))
+        except Exception as e:
+            self.logError("Event registration failed, polling for diffs instead! : " + e.__str__())
+            self.events = False
+
+    def on_torrent_event(self, torrentid, *args):
+        self.dirty.add(torrentid)
+
+    def on_connect_fail(self,result):
+        self.profiler.stop("connect")
+        self.connecting = False
+        self.loggedin = False
+        self.logError("Connection failed! : %s" % result.getErrorMessage())
+        self.recordResult(self.address, False)
+        self.setOfflineOutput()
+        self.resync()
+        self.logProfile()
+
+    def reloadTemplates(self):
+
+        # pick up template edits without a restart, those of each --section too, keeping the
+        # current templates of any output whose templates can't be loaded
+        for output in [self] + self.sections:
+            try:
+                output.loadTemplates()
+            except SystemExit:
+                continue
+
+            output.projection = FieldProjection(output.options, output.torrenttemplate, output.summarytemplate, output.sortspec)
+            output.renderCache.setKeys(output.projection.getTorrentTemplateKeys())
+            if output != self:
+                output.keys = output.projection.getKeys()
+
+        keys = self.getRequest()[0]
+        if keys != self.keys:
+            self.logInfo("Template placeholders changed, resyncing")
+            self.keys = keys
+            self.store = TorrentStore(self.keys)
+            self.resync()
+
+    def resync(self):
+        # diffs are tracked per session by the daemon, so a new connection starts from scratch,
+        # the render cache checks each torrent's values itself so it is kept
+        self.store.reset()
+        self.ordering = None
+        self.dirty = set()
+        self.refreshed = 0
+
+    def requestTorrentsStatus(self):
+
+        if self.events == True and self.store.synced == True:
+            self.store.clearChanges()
+            return self.requestEventChanges()
+
+        self.diff = self.store.synced
+        if self.diff == False:
+            self.logInfo("Requesting full status keys: %s"%", ".join(self.keys))
+        self.profiler.start("fetch")
+        d = withDeadline(self.client.core.get_torrents_status(self.getFilter(), self.keys, self.diff), self.options.timeout, "Torrent status request", self.client)
+        d.addCallback(self.on_get_torrents_status)
+        d.addErrback(self.on_get_torrents_status_fail)
+        return d
+
+    def on_get_torrents_status(self,torrents_status):
+
+        self.profiler.stop("fetch")
+        self.measurePayload(torrents_status)
+
+        if self.store.apply(torrents_status, self.diff) == False:
+            self.logInfo("Torrent status diff could not be applied, resyncing")
+            self.resync()
+            return self.requestTorrentsStatus()
+
+        # a full status is as good as a refresh
+        if self.diff == False:
+            self.refreshed = clock()
+
+        self.requesting = False
+        self.recordResult(self.address, True)
+        self.updateOutput()
+
+    def requestEventChanges(self):
+
+        # the torrents sent events for first, then the values without events once they are due
+        if len(self.dirty) > 0:
+            return self.requestDirty()
+        if clock() - self.refreshed >= self.options.refreshinterval:
+            return self.requestRefresh()
+
+        # nothing has happened, so there's nothing to ask for, but the rate history still takes
+        # its sample for this poll from the rates as last refreshed
+        if self.usesHistory() == True:
+            return self.finishEventChanges()
+        self.requesting = False
+        return None
+
+    def requestDirty(self):
+
+        self.requestedTorrentIds = sorted(self.dirty)
+        self.dirty = set()
+        self.logInfo("Requesting status of %d torrent(s) sent events for"%len(self.requestedTorrentIds))
+
+        # torrents that have left the states wanted are missing from the reply, like removed ones
+        filter_dict = self.getFilter()
+        filter_dict["id"] = self.requestedTorrentIds
+
+        self.profiler.start("fetch")
+        d = withDeadline(self.client.core.get_torrents_status(filter_dict, self.keys), self.options.timeout, "Torrent status request", self.client)
+        d.addCallback(self.on_get_dirty_status)
+        d.addErrback(self.on_get_torrents_status_fail)
+        return d
+
+    def on_get_dirty_status(self, torrents_status):
+
+        self.profiler.stop("fetch")
+        self.measurePayload(torrents_status)
+        self.store.update(torrents_status, self.requestedTorrentIds)
+
+        if clock() - self.refreshed >= self.options.refreshinterval:
+            return self.requestRefresh()
+        self.finishEventChanges()
+
+    def requestRefresh(self):
+
+        # only the values deluge sends no events for, as a diff against the last refresh
+        keys = [key for key in self.keys if key not in self.EVENT_KEYS]
+        if len(keys) == 0:
+            self.refreshed = clock()
+            return self.finishEventChanges()
+
+        self.logInfo("Refreshing status keys: %s"%", ".join(keys))
+        self.profiler.start("refresh")
+        d = withDeadline(self.client.core.get_torrents_status(self.getFilter(), keys, True), self.options.timeout, "Torrent status request", self.client)
+        d.addCallback(self.on_get_refresh_status)
+        d.addErrback(self.on_get_torrents_status_fail)
+        return d
+
+    def on_get_refresh_status(self, torrents_status):
+
+        self.profiler.stop("refresh")
+        self.measurePayload(torrents_status)
+
+        self.refreshed = clock()
+
+        # a torrent we have no event for is asked for in full on the next poll
+        unknown = self.store.applyPartial(torrents_status)
+        self.dirty.update(unknown)
+        self.finishEventChanges()
+
+    def measurePayload(self, torrents_status):
+
+        # working out the size means encoding the reply again, so it's only done when reported
+        if self.options.profile == False and self.metrics == None:
+            return
+
+        payloadbytes = getPayloadSize(torrents_status)
+        if self.options.profile == True:
+            self.profiler.set("payloadbytes", payloadbytes)
+        if self.metrics != None:
+            self.metrics.observePayload(payloadbytes)
+
+    def recordResult(self, address, success):
+        DelugeInfo.recordResult(self, address, success)
+        if success == False and self.metrics != None:
+            self.metrics.failures = self.metrics.failures + 1
+
+    def finishEventChanges(self):
+        self.requesting = False
+        self.recordResult(self.address, True)
+        self.updateOutput()
+
+    def on_get_hosts_status(self, results):
+
+        self.requesting = False
+        if self.metrics != None:
+            for (success, (host, torrents_status, error)) in results:
+                if torrents_status != None:
+                    self.metrics.observePayload(getPayloadSize(torrents_status))
+        (answered, torrents_status) = self.mergeHostsStatus(results)
+        self.store.apply(torrents_status, False)
+        self.updateOutput()
+        if answered == False:
+            self.setOfflineOutput()
+
+    def setOfflineOutput(self):
+        if self.metrics != None:
+            self.metrics.update({}, False, False)
+        output = self.getOfflineOutput()
+        if output != None:
+            self.output = output.encode("utf-8") + b"\n"
+        else:
+            self.output = b""
+        if len(self.sections) > 0:
+            self.writeSections(output or "")
+
+    def updateOutput(self):
+
+        self.torrents_status = self.store.torrents_status
+        self.logInfo("%d torrent(s) changed, %d removed"%(len(self.store.changed), len(self.store.removed)))
+
+        # a rate sample is taken on every poll, kept in memory for as long as the daemon runs
+        if self.usesHistory() == True:
+            if self.history == None:
+                self.history = RateHistory(self.options.history)
+                if self.options.historyfile != None:
+                    self.history.load(self.options.historyfile)
+            self.history.record(self.torrents_status)
+            if self.options.historyfile != None:
+                self.history.save(self.options.historyfile)
+
+        # records are output even for no torrents, so the reader always gets a whole document
+        output = None
+        if len(self.torrents_status) > 0 or self.projection.usesRecords() == True:
+            output = self.getEncodedOutput()
+
+        if output != None:
+            self.output = output
+        else:
+            self.output = b""
+
+        if len(self.sections) > 0:
+            self.writeSections()
+
+        if self.metrics != None:
+            self.metrics.observeFetch(self.profiler.timings)
+            self.metrics.update(self.torrents_status, self.hosts != None, True)
+
+        # one profile line for each poll
+        self.logProfile()
+
+    def on_get_torrents_status_fail(self,result):
+        self.requesting = False
+        self.loggedin = False
+        self.logError("Torrent status request failed! : %s" % result.getErrorMessage())
+        self.recordResult(self.address, False)
+        self.client.disconnect()
+        self.setOfflineOutput()
+        self.resync()
+        self.logProfile()
+
+def writeProfile(options, profiler):
+    if options.profile == True:
+        getLog(options).profile(profiler.getText())
+
+def readSocketOutput(path):
+
+    # returns the output served by a running --daemon, or None if there isn't one
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(2)
+        sock.connect(os.path.expanduser(path))
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        sock.close()
+        return b"".join(chunks)
+    except socket.error:
+        return None
 
 def main():
     gettext.install('conkyDeluge')    
@@ -547,30 +3814,113 @@ def main():
     parser = CommandLineParser()
     (options, args) = parser.parse_args()
 
+    if options.profiledump != None:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.runcall(execute, options)
+        profile.dump_stats(os.path.expanduser(options.profiledump))
+    else:
+        execute(options)
+
+def execute(options):
+
     if options.version == True:
 
-        print >> sys.stdout,"conkyDeluge v.2.14.1"
+        print("conkyDeluge v." + VERSION, file=sys.stdout)
 
     else:
 
         if options.verbose == True:
-            print >> sys.stdout, "*** INITIAL OPTIONS:"
-            print >> sys.stdout, "    server:",options.server
-            print >> sys.stdout, "    port:",options.port
-            print >> sys.stdout, "    username:",options.username
-            print >> sys.stdout, "    password:",options.password
-            print >> sys.stdout, "    showsummary:",options.showsummary
-            print >> sys.stdout, "    torrenttemplate:",options.torrenttemplate
-            print >> sys.stdout, "    summarytemplate:",options.summarytemplate
-            print >> sys.stdout, "    activeonly:",options.activeonly
-            print >> sys.stdout, "    limit:",options.limit
-            print >> sys.stdout, "    sortby:",options.sortby
-            print >> sys.stdout, "    errorlogfile:",options.errorlogfile
-            print >> sys.stdout, "    infologfile:",options.infologfile
-
-        delugeInfo = DelugeInfo(options)
-        if len(delugeInfo.torrents_status) > 0:
-            delugeInfo.writeOutput()
+            print("*** INITIAL OPTIONS:", file=sys.stdout)
+            print("    server:",options.server, file=sys.stdout)
+            print("    port:",options.port, file=sys.stdout)
+            print("    username:",options.username, file=sys.stdout)
+            print("    password:",options.password, file=sys.stdout)
+            print("    hosts:",options.hosts, file=sys.stdout)
+            print("    connecttimeout:",options.connecttimeout, file=sys.stdout)
+            print("    timeout:",options.timeout, file=sys.stdout)
+            print("    backoff:",options.backoff, file=sys.stdout)
+            print("    maxbackoff:",options.maxbackoff, file=sys.stdout)
+            print("    offlinetext:",options.offlinetext, file=sys.stdout)
+            print("    rpc:",options.rpc, file=sys.stdout)
+            print("    rpcprotocol:",options.rpcprotocol, file=sys.stdout)
+            print("    showsummary:",options.showsummary, file=sys.stdout)
+            print("    torrenttemplate:",options.torrenttemplate, file=sys.stdout)
+            print("    summarytemplate:",options.summarytemplate, file=sys.stdout)
+            print("    activeonly:",options.activeonly, file=sys.stdout)
+            print("    states:",options.states, file=sys.stdout)
+            print("    limit:",options.limit, file=sys.stdout)
+            print("    sortby:",options.sortby, file=sys.stdout)
+            print("    workers:",options.workers, file=sys.stdout)
+            print("    workerthreshold:",options.workerthreshold, file=sys.stdout)
+            print("    format:",options.format, file=sys.stdout)
+            print("    errorlogfile:",options.errorlogfile, file=sys.stdout)
+            print("    infologfile:",options.infologfile, file=sys.stdout)
+            print("    logmaxsize:",options.logmaxsize, file=sys.stdout)
+            print("    daemon:",options.daemon, file=sys.stdout)
+            print("    events:",options.events, file=sys.stdout)
+            print("    refreshinterval:",options.refreshinterval, file=sys.stdout)
+            print("    interval:",options.interval, file=sys.stdout)
+            print("    history:",options.history, file=sys.stdout)
+            print("    historyfile:",options.historyfile, file=sys.stdout)
+            print("    socket:",options.socket, file=sys.stdout)
+            print("    metricsport:",options.metricsport, file=sys.stdout)
+            print("    metricsaddress:",options.metricsaddress, file=sys.stdout)
+            print("    sections:",options.sections, file=sys.stdout)
+            print("    sectiondir:",options.sectiondir, file=sys.stdout)
+            print("    profile:",options.profile, file=sys.stdout)
+            print("    profiledump:",options.profiledump, file=sys.stdout)
+
+        if options.daemon == True:
+
+            if options.socket == None:
+                print("ERROR: --daemon requires a --socket filepath", file=sys.stderr)
+                sys.exit(2)
+
+            if options.sections != None and options.sectiondir == None:
+                print("ERROR: --section requires a --sectiondir", file=sys.stderr)
+                sys.exit(2)
+
+            delugeDaemon = DelugeDaemon(options)
+            delugeDaemon.run()
+
+        else:
+
+            if options.metricsport != None:
+                print("ERROR: --metricsport requires --daemon", file=sys.stderr)
+                sys.exit(2)
+
+            # use the output of a running daemon if there is one
+            if options.socket != None:
+                profiler = Profiler()
+                profiler.add("import", IMPORTTIME)
+                profiler.start("socket")
+                output = readSocketOutput(options.socket)
+                if output != None:
+                    sys.stdout.buffer.write(output)
+                    profiler.stop("socket")
+                    profiler.add("total", clock() - IMPORTSTART)
+                    writeProfile(options, profiler)
+                    return
+
+            if options.sections != None and options.sectiondir == None:
+                print("ERROR: --section requires a --sectiondir", file=sys.stderr)
+                sys.exit(2)
+
+            delugeInfo = DelugeInfo(options)
+            delugeInfo.run()
+            if len(delugeInfo.sections) > 0:
+                # the sections are written to their files rather than stdout
+                if delugeInfo.fetched == False and len(delugeInfo.torrents_status) == 0 and delugeInfo.getOfflineOutput() != None:
+                    delugeInfo.writeSections(delugeInfo.getOfflineOutput())
+                else:
+                    delugeInfo.writeSections()
+            elif len(delugeInfo.torrents_status) > 0 or delugeInfo.sessionSummary != None or delugeInfo.hasRecordsOutput() == True:
+                delugeInfo.writeOutput()
+            elif delugeInfo.fetched == False and delugeInfo.getOfflineOutput() != None:
+                print(delugeInfo.getOfflineOutput())
+            delugeInfo.profiler.add("total", clock() - IMPORTSTART)
+            delugeInfo.logProfile()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,613 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+###############################################################################
+# conkyDelugeBench.py measures how conkyDeluge.py scales with the number of
+# torrents, using a fake deluge core serving synthetic torrent status so no
+# real daemon is needed.
+#
+# Created: 16/10/2026
+#
+# Each torrent count is run in its own process so the peak memory reported is
+# that of a single conkyDeluge run. Cold start is measured as the time from
+# starting python to the first byte of output, for --version and for output
+# served from a --cachefile snapshot. Results can be saved as JSON and compared
+# against a previous run to spot regressions between releases.
+#
+# Example use:
+#    python conkyDelugeBench.py --sizes=10,1000,50000 --output=bench-2.15.json
+#    python conkyDelugeBench.py --args="--showsummary --limit=5" --compare=bench-2.14.json
+#    python conkyDelugeBench.py --rpc=asyncio --latency=0.005 --sizes=1000,10000
+
+from optparse import OptionParser
+import hashlib
+import json
+import marshal
+import os
+import random
+import resource
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import zlib
+
+timer = timeit.default_timer
+
+STAGES = ["import", "connect", "auth", "fetch", "decode", "process", "sort", "render", "cached"]
+
+CONKYDELUGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conkyDeluge.py")
+
+class CommandLineParser:
+
+    parser = None
+
+    def __init__(self):
+
+        self.parser = OptionParser()
+        self.parser.add_option("--sizes", dest="sizes", type="string", default="10,100,1000,10000,50000", metavar="LIST", help="[default: %default] Comma separated list of torrent counts to benchmark.")
+        self.parser.add_option("--args", dest="args", type="string", default="", metavar="ARGS", help="Options passed to conkyDeluge for each run, e.g. \"--showsummary --limit=5\".")
+        self.parser.add_option("--repeat", dest="repeat", type="int", default=5, metavar="NUMBER", help="[default: %default] How many times the processing stages are repeated, the best time is reported.")
+        self.parser.add_option("--latency", dest="latency", type="float", default=0.0, metavar="SECONDS", help="[default: %default] Simulated network latency of the fake deluge core for each call.")
+        self.parser.add_option("--rpc", dest="rpc", type="choice", choices=["fake", "asyncio", "deluge"], default="fake", metavar="CLIENT", help="[default: %default] Either fake, a stand-in for deluge's twisted client calling the fake core in process, asyncio, conkyDeluge's built-in client talking to a fake core over TLS on localhost, or deluge, deluge's own client talking to that fake core.")
+        self.parser.add_option("--rpcprotocol", dest="rpcprotocol", type="int", default=2, metavar="NUMBER", help="[default: %default] The deluge rpc protocol the fake core speaks with --rpc=asyncio or deluge, 2 for deluge 2 or 1 for deluge 1.3.")
+        self.parser.add_option("--seed", dest="seed", type="int", default=1, metavar="NUMBER", help="[default: %default] Random seed for the synthetic torrents, so runs are comparable.")
+        self.parser.add_option("--output", dest="output", type="string", metavar="FILE", help="If a filepath is set, the results are written there as JSON.")
+        self.parser.add_option("--compare", dest="compare", type="string", metavar="FILE", help="If a filepath is set, the results are compared with those previously saved there.")
+        self.parser.add_option("--worker", dest="worker", type="int", metavar="NUMBER", help="Internal, run a single benchmark of the given torrent count and print the result as JSON.")
+        self.parser.add_option("--snapshot", dest="snapshot", type="string", metavar="FILE", help="Internal, where the worker saves a --cachefile snapshot of the torrent status for the cold start benchmark.")
+
+    def parse_args(self):
+        (options, args) = self.parser.parse_args()
+        return (options, args)
+
+class SyntheticTorrents:
+
+    STATES = ["Downloading", "Seeding", "Seeding", "Seeding", "Paused", "Paused", "Queued", "Checking", "Error"]
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+
+    def generate(self, count):
+
+        # a status dict per torrent holding every key conkyDeluge may ask for, with a seedbox
+        # like mix of mostly idle seeding and paused torrents
+        torrents_status = {}
+
+        for index in range(count):
+            rnd = self.random
+            torrentid = hashlib.sha1(str(index).encode("ascii")).hexdigest()
+            state = rnd.choice(self.STATES)
+            active = state in ("Downloading", "Seeding") and rnd.random() < 0.3
+            wanted = rnd.randint(1024*1024, 50*1024*1024*1024)
+
+            if state == "Seeding":
+                done = wanted
+            else:
+                done = rnd.randint(0, wanted)
+
+            if state == "Downloading" and active:
+                downloadrate = float(rnd.randint(1024, 10*1024*1024))
+                eta = int((wanted - done) / downloadrate)
+            else:
+                downloadrate = 0.0
+                eta = (state == "Downloading") and -1 or 0
+
+            uploaded = rnd.randint(0, wanted * 3)
+
+            torrents_status[torrentid] = {
+                "name": "Synthetic torrent %d - Ünïcödé" % index,
+                "state": state,
+                "total_done": done,
+                "total_size": wanted,
+                "total_wanted": wanted,
+                "total_uploaded": uploaded,
+                "progress": done * 100.0 / wanted,
+                "num_files": rnd.randint(1, 200),
+                "eta": eta,
+                "download_payload_rate": downloadrate,
+                "upload_payload_rate": active and float(rnd.randint(0, 2*1024*1024)) or 0.0,
+                "num_peers": active and rnd.randint(1, 50) or 0,
+                "num_seeds": active and rnd.randint(0, 50) or 0,
+                "total_peers": rnd.randint(0, 500),
+                "total_seeds": rnd.randint(0, 500),
+                "ratio": done > 0 and float(uploaded) / done or -1.0,
+                "queue": (state in ("Downloading", "Queued")) and rnd.randint(0, 100) or -1
+            }
+
+        return torrents_status
+
+class FakeCore:
+
+    def __init__(self, torrents_status):
+        self.torrents_status = torrents_status
+
+    def get_torrents_status(self, filter_dict, keys, diff=False):
+
+        torrents_status = {}
+        for torrentid, torrent_status in self.torrents_status.items():
+            if filter_dict and "state" in filter_dict and torrent_status["state"] not in filter_dict["state"]:
+                continue
+            if keys:
+                torrents_status[torrentid] = dict([(key, torrent_status[key]) for key in keys if key in torrent_status])
+            else:
+                torrents_status[torrentid] = dict(torrent_status)
+
+        return torrents_status
+
+    def get_session_status(self, keys):
+        totals = {
+            "payload_download_rate": sum([torrent_status["download_payload_rate"] for torrent_status in self.torrents_status.values()]),
+            "payload_upload_rate": sum([torrent_status["upload_payload_rate"] for torrent_status in self.torrents_status.values()])
+        }
+        return dict([(key, totals.get(key, 0)) for key in keys])
+
+    def get_filter_tree(self, show_zero_hits=True, hide_cat=None):
+        statecounts = {"All": len(self.torrents_status)}
+        for torrent_status in self.torrents_status.values():
+            statecounts[torrent_status["state"]] = statecounts.get(torrent_status["state"], 0) + 1
+        return {"state": list(statecounts.items())}
+
+class FakeClientCore:
+
+    # the fake core as deluge's client sees it, each reply arriving after the simulated latency
+    def __init__(self, fakeclient, core):
+        self.fakeclient = fakeclient
+        self.core = core
+
+    def get_torrents_status(self, filter_dict, keys, diff=False):
+
+        torrents_status = self.core.get_torrents_status(filter_dict, keys, diff)
+
+        # the reply is serialised as the daemon would, so the cost of decoding it is measured
+        payload = zlib.compress(self.fakeclient.encode(torrents_status))
+        self.fakeclient.payloadbytes = len(payload)
+
+        start = timer()
+        torrents_status = self.fakeclient.decode(zlib.decompress(payload))
+        self.fakeclient.decodetime = timer() - start
+
+        return self.fakeclient.reply(torrents_status)
+
+    def get_session_status(self, keys):
+        return self.fakeclient.reply(self.core.get_session_status(keys))
+
+    def get_filter_tree(self, show_zero_hits=True, hide_cat=None):
+        return self.fakeclient.reply(self.core.get_filter_tree(show_zero_hits, hide_cat))
+
+class FakeClient:
+
+    def __init__(self, torrents_status, latency):
+        from twisted.internet import defer, reactor
+        self.defer = defer
+        self.reactor = reactor
+        self.latency = latency
+        self.core = FakeClientCore(self, FakeCore(torrents_status))
+        self.isconnected = False
+        self.connectedat = None
+        self.payloadbytes = 0
+        self.decodetime = 0.0
+
+        # use the same serialisation as the deluge rpc protocol when it's available
+        try:
+            from deluge import rencode
+        except ImportError:
+            try:
+                import rencode
+            except ImportError:
+                rencode = None
+
+        if rencode != None:
+            self.encoding = "rencode"
+            self.encode = rencode.dumps
+            self.decode = rencode.loads
+        else:
+            self.encoding = "marshal"
+            self.encode = marshal.dumps
+            self.decode = marshal.loads
+
+    def reply(self, result):
+        d = self.defer.Deferred()
+        self.reactor.callLater(self.latency, d.callback, result)
+        return d
+
+    def connect(self, host="127.0.0.1", port=58846, username="", password=""):
+        # as with deluge's client, connecting and logging in are a round trip each
+        d = self.reply(None)
+        d.addCallback(self.login)
+        return d
+
+    def login(self, result):
+        self.connectedat = timer()
+        self.isconnected = True
+        return self.reply(10)
+
+    def connected(self):
+        return self.isconnected
+
+    def disconnect(self):
+        self.isconnected = False
+        return self.defer.succeed(None)
+
+class FakeDeluged:
+
+    # a local deluge core on its own thread, speaking the rpc protocol over TLS for conkyDeluge's
+    # built-in client, so the cost of the network round trip and decoding is measured as well
+    def __init__(self, torrents_status, latency, protocol):
+        import conkyDeluge
+        self.conkyDeluge = conkyDeluge
+        self.core = FakeCore(torrents_status)
+        self.latency = latency
+        self.protocol = protocol
+        self.rencode = conkyDeluge.importRencode()
+        self.payload = b""
+        self.port = None
+        # when the last connection's TLS handshake was done, the start of logging in
+        self.connectedat = None
+
+    def start(self):
+
+        import asyncio
+        import ssl
+        import threading
+
+        # a throwaway self signed certificate, as deluge makes for itself
+        certdir = tempfile.mkdtemp(prefix="conkydelugebench")
+        certfile = os.path.join(certdir, "daemon.cert")
+        keyfile = os.path.join(certdir, "daemon.pkey")
+        subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost", "-keyout", keyfile, "-out", certfile], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        for path in (certfile, keyfile):
+            os.remove(path)
+        os.rmdir(certdir)
+
+        loop = asyncio.new_event_loop()
+        listening = threading.Event()
+
+        def serve():
+            server = loop.run_until_complete(asyncio.start_server(self.serve, "127.0.0.1", 0, ssl=context))
+            self.port = server.sockets[0].getsockname()[1]
+            listening.set()
+            loop.run_forever()
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        listening.wait()
+
+        return self.port
+
+    async def serve(self, reader, writer):
+
+        import asyncio
+
+        HEADER = self.conkyDeluge.DelugeRPCClient.HEADER
+        unused = b""
+        self.connectedat = timer()
+
+        try:
+            while True:
+                if self.protocol == 1:
+                    # a deluge 1.3 message is a bare zlib stream
+                    decompressor = zlib.decompressobj()
+                    parts = []
+                    data = unused
+                    while True:
+                        if len(data) > 0:
+                            parts.append(decompressor.decompress(data))
+                        if decompressor.eof:
+                            unused = decompressor.unused_data
+                            break
+                        data = await reader.read(65536)
+                        if len(data) == 0:
+                            return
+                    message = b"".join(parts)
+                else:
+                    (version, length) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                    message = zlib.decompress(await reader.readexactly(length))
+
+                for (requestid, method, args, kwargs) in self.rencode.loads(message, decode_utf8=True):
+                    if self.latency > 0:
+                        await asyncio.sleep(self.latency)
+                    body = zlib.compress(self.rencode.dumps(self.dispatch(requestid, method, args, kwargs)))
+                    if method == "core.get_torrents_status":
+                        self.payload = body
+                    if self.protocol == 1:
+                        writer.write(body)
+                    else:
+                        writer.write(HEADER.pack(1, len(body)) + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def dispatch(self, requestid, method, args, kwargs):
+
+        methods = {
+            "daemon.info": self.info,
+            "daemon.login": self.login,
+            "daemon.set_event_interest": self.setEventInterest,
+            "core.get_torrents_status": self.core.get_torrents_status,
+            "core.get_session_status": self.core.get_session_status,
+            "core.get_filter_tree": self.core.get_filter_tree
+        }
+
+        # errors are sent as deluge 2 sends them, or as one item as deluge 1.3 does
+        try:
+            if method not in methods:
+                raise AttributeError("No such method: %s" % method)
+            return (self.conkyDeluge.DelugeRPCClient.RPC_RESPONSE, requestid, methods[method](*args, **kwargs))
+        except Exception as e:
+            if self.protocol == 1:
+                return (self.conkyDeluge.DelugeRPCClient.RPC_ERROR, requestid, (e.__class__.__name__, str(e), ""))
+            return (self.conkyDeluge.DelugeRPCClient.RPC_ERROR, requestid, e.__class__.__name__, e.args, {}, "")
+
+    def info(self):
+        # deluge's own client asks for the version before logging in
+        return self.protocol == 1 and "1.3.15" or "2.1.1"
+
+    def login(self, username, password, client_version=None):
+        # as with deluge 2, a login without a client version is refused
+        if self.protocol != 1 and client_version == None:
+            raise ValueError("Incompatible client, no client_version given")
+        return 10
+
+    def setEventInterest(self, events):
+        # no events are ever sent, the torrents don't change
+        return True
+
+    def getDecodeTime(self):
+        start = timer()
+        self.rencode.loads(zlib.decompress(self.payload), decode_utf8=True)
+        return timer() - start
+
+def runWorker(options):
+
+    import conkyDeluge
+    from conkyDeluge import DelugeInfo
+
+    class BenchDelugeInfo(DelugeInfo):
+
+        # fakecore is the fake client or deluged, which notes when the connection was made,
+        # logging in takes the rest of the time until deluge's client reports it connected
+        fakecore = None
+
+        def connect(self):
+            self.loadClient()
+            self.timings = {}
+            self.stagestart = timer()
+            return DelugeInfo.connect(self)
+
+        def on_connect_success(self, result):
+            self.timings["connect"] = self.fakecore.connectedat - self.stagestart
+            self.timings["auth"] = timer() - self.fakecore.connectedat
+            self.stagestart = timer()
+            return DelugeInfo.on_connect_success(self, result)
+
+        def on_get_torrents_status(self, torrents_status):
+            self.timings["fetch"] = timer() - self.stagestart
+            return DelugeInfo.on_get_torrents_status(self, torrents_status)
+
+        def on_get_session_summary(self, results):
+            self.timings["fetch"] = timer() - self.stagestart
+            return DelugeInfo.on_get_session_summary(self, results)
+
+    count = options.worker
+    torrents_status = SyntheticTorrents(options.seed).generate(count)
+    parser = conkyDeluge.CommandLineParser()
+
+    if options.rpc == "asyncio":
+
+        fakedeluged = FakeDeluged(torrents_status, options.latency, options.rpcprotocol)
+        port = fakedeluged.start()
+
+        (deluge_options, args) = parser.parser.parse_args(shlex.split(options.args) + ["--rpc=asyncio", "--rpcprotocol=%d" % options.rpcprotocol, "--server=127.0.0.1", "--port=%d" % port])
+
+        delugeInfo = DelugeInfo(deluge_options)
+        delugeInfo.run()
+
+        # decoding happens as the reply is read, so it's timed again on its own
+        result = {
+            "torrents": count,
+            "encoding": fakedeluged.rencode.__class__.__name__ == "Rencode" and "rencode (pure python)" or "rencode",
+            "payloadbytes": len(fakedeluged.payload),
+            "connect": delugeInfo.profiler.timings["connect"],
+            "auth": delugeInfo.profiler.timings["auth"],
+            "fetch": delugeInfo.profiler.timings["fetch"],
+            "decode": fakedeluged.payload and fakedeluged.getDecodeTime() or 0.0
+        }
+
+    elif options.rpc == "deluge":
+
+        fakedeluged = FakeDeluged(torrents_status, options.latency, options.rpcprotocol)
+        port = fakedeluged.start()
+
+        (deluge_options, args) = parser.parser.parse_args(shlex.split(options.args) + ["--rpc=deluge", "--server=127.0.0.1", "--port=%d" % port])
+
+        delugeInfo = BenchDelugeInfo(deluge_options)
+        delugeInfo.fakecore = fakedeluged
+        delugeInfo.run()
+
+        result = {
+            "torrents": count,
+            "encoding": fakedeluged.rencode.__class__.__name__ == "Rencode" and "rencode (pure python)" or "rencode",
+            "payloadbytes": len(fakedeluged.payload),
+            "connect": delugeInfo.timings["connect"],
+            "auth": delugeInfo.timings["auth"],
+            "fetch": delugeInfo.timings["fetch"],
+            "decode": fakedeluged.payload and fakedeluged.getDecodeTime() or 0.0
+        }
+
+    else:
+
+        fakeclient = FakeClient(torrents_status, options.latency)
+        (deluge_options, args) = parser.parser.parse_args(shlex.split(options.args))
+
+        delugeInfo = BenchDelugeInfo(deluge_options, fakeclient)
+        delugeInfo.fakecore = fakeclient
+        delugeInfo.run()
+
+        result = {
+            "torrents": count,
+            "encoding": fakeclient.encoding,
+            "payloadbytes": fakeclient.payloadbytes,
+            "connect": delugeInfo.timings["connect"],
+            "auth": delugeInfo.timings["auth"],
+            "fetch": delugeInfo.timings["fetch"],
+            "decode": fakeclient.decodetime
+        }
+
+    # the processing stages, each timed on its own
+    # nothing but the session summary may have been fetched
+    torrents_status = dict(delugeInfo.torrents_status)
+    getSortKey = delugeInfo.sortspec.getSortKey
+    limit = deluge_options.limit
+
+    def sort():
+        sortentries = [(getSortKey(torrent_status), torrentid) for torrentid, torrent_status in torrents_status.items()]
+        if limit != 0:
+            sortentries = conkyDeluge.heapq.nsmallest(max(limit, 0), sortentries, key=conkyDeluge.itemgetter(0))
+        else:
+            sortentries.sort(key=conkyDeluge.itemgetter(0))
+        return sortentries
+
+    selected = [torrents_status[torrentid] for (sortkey, torrentid) in sort()]
+    render = delugeInfo.torrenttemplate.render
+
+    stages = {
+        "process": delugeInfo.getOutput,
+        "sort": sort,
+        "render": lambda: [render(torrent_status) for torrent_status in selected]
+    }
+
+    for stage in stages:
+        result[stage] = min(timeit.repeat(stages[stage], number=1, repeat=options.repeat))
+
+    # ru_maxrss is in KiB on linux
+    result["peakmemory"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    if options.snapshot != None:
+        conkyDeluge.SnapshotCache(options.snapshot, 0).save(delugeInfo.keys, delugeInfo.states, torrents_status)
+
+    print(json.dumps(result))
+
+def timeColdStart(command, repeat):
+
+    # the best time from starting python to the first byte of output
+    timings = []
+
+    for index in range(repeat):
+        start = timer()
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        process.stdout.read(1)
+        timings.append(timer() - start)
+        process.communicate()
+
+    return min(timings)
+
+def timeImport(rpc, repeat):
+
+    # the best time to import conkyDeluge in a fresh python, and twisted and deluge's client too
+    # when they are used, as a real run imports them before connecting
+    code = "import sys, timeit; sys.path.insert(0, %r); start = timeit.default_timer(); import conkyDeluge; %s; print(timeit.default_timer() - start)" % (os.path.dirname(CONKYDELUGE), rpc and "conkyDeluge.importRPC()" or "pass")
+
+    timings = []
+    for index in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c", code])
+        timings.append(float(output.strip().splitlines()[-1]))
+
+    return min(timings)
+
+def runBenchmark(options):
+
+    results = []
+    snapshot = os.path.join(tempfile.mkdtemp(prefix="conkydelugebench"), "snapshot")
+
+    startup = timeColdStart([sys.executable, CONKYDELUGE, "--version"], options.repeat)
+    print("Cold start to --version output: %.2fms" % (startup*1000))
+
+    # deluge's client is used unless conkyDeluge's built-in one is, the fake client standing in for it
+    imported = timeImport(options.rpc != "asyncio", options.repeat)
+    print("Import of conkyDeluge%s: %.2fms" % (options.rpc != "asyncio" and ", twisted and deluge's client" or "", imported*1000))
+    print()
+
+    print("%10s %10s %10s %10s %10s %10s %10s %10s %10s %12s %10s" % ("torrents", "connect", "auth", "fetch", "decode", "process", "sort", "render", "cached", "payload", "peak mem"))
+
+    for size in [int(size) for size in options.sizes.split(",") if size.strip() != ""]:
+
+        command = [sys.executable, os.path.abspath(__file__), "--worker=%d" % size, "--args=%s" % options.args, "--repeat=%d" % options.repeat, "--latency=%f" % options.latency, "--seed=%d" % options.seed, "--rpc=%s" % options.rpc, "--rpcprotocol=%d" % options.rpcprotocol, "--snapshot=%s" % snapshot]
+        worker = subprocess.Popen(command, stdout=subprocess.PIPE)
+        output = worker.communicate()[0]
+
+        if worker.returncode != 0:
+            print("ERROR: benchmark of %d torrents failed" % size, file=sys.stderr)
+            continue
+
+        # the last line holds the result, anything before it is conkyDeluge output
+        result = json.loads(output.strip().splitlines()[-1])
+        result["startup"] = startup
+        result["import"] = imported
+
+        # a fresh conkyDeluge serving the output from the snapshot the worker left behind
+        result["cached"] = timeColdStart([sys.executable, CONKYDELUGE] + shlex.split(options.args) + ["--cachefile=%s" % snapshot, "--cachettl=86400"], options.repeat)
+        results.append(result)
+
+        print("%10d %9.2fms %9.2fms %9.2fms %9.2fms %9.2fms %9.2fms %9.2fms %9.2fms %10.1fKiB %8.1fMiB" % (result["torrents"], result["connect"]*1000, result["auth"]*1000, result["fetch"]*1000, result["decode"]*1000, result["process"]*1000, result["sort"]*1000, result["render"]*1000, result["cached"]*1000, result["payloadbytes"]/1024.0, result["peakmemory"]/1048576.0))
+
+    for path in (snapshot, snapshot + ".lock"):
+        if os.path.exists(path):
+            os.remove(path)
+    os.rmdir(os.path.dirname(snapshot))
+
+    return results
+
+def compareResults(results, path):
+
+    fileinput = open(os.path.expanduser(path))
+    previous = json.load(fileinput)
+    fileinput.close()
+
+    previousresults = dict([(result["torrents"], result) for result in previous["results"]])
+
+    print()
+    print("Compared with %s (%s):" % (path, previous.get("created", "unknown")))
+    print("%10s" % "torrents" + "".join([" %10s" % stage for stage in STAGES + ["startup", "peakmemory"]]))
+
+    for result in results:
+        if result["torrents"] not in previousresults:
+            continue
+        line = "%10d" % result["torrents"]
+        for stage in STAGES + ["startup", "peakmemory"]:
+            before = previousresults[result["torrents"]].get(stage)
+            if before:
+                line = line + " %+9.1f%%" % ((result[stage] - before) / float(before) * 100)
+            else:
+                line = line + " %10s" % "-"
+        print(line)
+
+def main():
+
+    parser = CommandLineParser()
+    (options, args) = parser.parse_args()
+
+    if options.worker != None:
+        runWorker(options)
+        return
+
+    results = runBenchmark(options)
+
+    if options.output != None:
+        fileoutput = open(os.path.expanduser(options.output), "w")
+        json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version.split()[0], "args": options.args, "latency": options.latency, "rpc": options.rpc, "seed": options.seed, "results": results}, fileoutput, indent=1, sort_keys=True)
+        fileoutput.close()
+
+    if options.compare != None:
+        compareResults(results, options.compare)
+
+if __name__ == '__main__':
+    main()
+    sys.exit()
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 #
 # Copyright (C) 2008 Mark Buck (Kaivalagi)
 #
@@ -17,11 +17,11 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 
-from distutils.core import setup
+from setuptools     import setup
 from fnmatch        import fnmatch
 import os
 
-# remove MANIFEST. distutils doesn't properly update it when the contents of directories change.
+# remove any MANIFEST left by distutils, MANIFEST.in lists the contents
 if os.path.exists('MANIFEST'): os.remove('MANIFEST')
 
 def listfiles(*dirs):
@@ -39,7 +39,11 @@ setup(
 		author_email     = 'm_buck@hotmail.com',
 		url              = 'None',
 		platforms        = 'linux',
+		python_requires  = '>=3.5',
 		license          = 'GPLv3',
+		# the script is installed as data, not as an importable module
+		packages         = [],
+		py_modules       = [],
 		scripts          = ['conkyDeluge'],
 		data_files       = [
 			('/usr/share/conkydeluge/', [ 'conkyDeluge.py' ] ),
@@ -0,0 +1,715 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+###############################################################################
+# test_conkyDeluge.py checks conkyDeluge.py against synthetic torrent status,
+# no deluge core is needed.
+#
+# Example use:
+#    python3 -m unittest test_conkyDeluge
+
+import asyncio
+import fcntl
+import json
+import multiprocessing
+import os
+from random import Random
+import shutil
+import tempfile
+import time
+import unittest
+import zlib
+
+import conkyDeluge
+try:
+    from twisted.internet import defer, task
+except ImportError:
+    task = None
+
+from conkyDeluge import Backoff, CommandLineParser, DelugeDaemon, DelugeInfo, DelugeRPCClient, FileLock, RateHistory, Rencode, SnapshotCache, SortSpec, Template, TorrentData, TorrentOrder, TorrentStore, getTorrentGetter
+
+def createTorrentStatus(name, state, downloadrate):
+    return {
+        "name": name,
+        "state": state,
+        "total_done": 1024,
+        "total_wanted": 2048,
+        "progress": 50.0,
+        "download_payload_rate": downloadrate,
+        "upload_payload_rate": 0.0,
+        "eta": 60
+    }
+
+class RemovalTest(unittest.TestCase):
+
+    def createDelugeInfo(self, args):
+        (options, args) = CommandLineParser().parser.parse_args(args)
+        delugeInfo = DelugeInfo(options)
+        delugeInfo.store = TorrentStore(delugeInfo.keys)
+        return delugeInfo
+
+    def poll(self, delugeInfo, torrents_status, diff):
+        self.assertTrue(delugeInfo.store.apply(torrents_status, diff))
+        delugeInfo.torrents_status = delugeInfo.store.torrents_status
+        return delugeInfo.getOutput()
+
+    def testPollWithOnlyARemoval(self):
+
+        # a poll where the only change is a listed torrent going must not reuse the last selection
+        delugeInfo = self.createDelugeInfo(["--limit=2", "--sortby=download"])
+        output = self.poll(delugeInfo, {
+            "a": createTorrentStatus("Torrent A", "Downloading", 300.0),
+            "b": createTorrentStatus("Torrent B", "Downloading", 200.0),
+            "c": createTorrentStatus("Torrent C", "Downloading", 100.0)
+        }, False)
+        self.assertIn("Torrent A", output)
+        self.assertIn("Torrent B", output)
+        self.assertNotIn("Torrent C", output)
+
+        # a diff holds every torrent still there, those unchanged with no values
+        output = self.poll(delugeInfo, {"b": {}, "c": {}}, True)
+        self.assertEqual(delugeInfo.store.changed, set())
+        self.assertEqual(delugeInfo.store.removed, set(["a"]))
+        self.assertNotEqual(output, None)
+        self.assertNotIn("Torrent A", output)
+        self.assertIn("Torrent B", output)
+        self.assertIn("Torrent C", output)
+
+    def testStaleSelection(self):
+
+        # a selection naming a torrent that has gone shows the rest rather than failing
+        delugeInfo = self.createDelugeInfo(["--limit=2", "--sortby=download"])
+        self.poll(delugeInfo, {
+            "a": createTorrentStatus("Torrent A", "Downloading", 300.0),
+            "b": createTorrentStatus("Torrent B", "Downloading", 200.0)
+        }, False)
+
+        delugeInfo.store.clearChanges()
+        del delugeInfo.store.torrents_status["a"]
+        output = delugeInfo.getOutput()
+        self.assertNotEqual(output, None)
+        self.assertNotIn("Torrent A", output)
+        self.assertIn("Torrent B", output)
+
+    def testEventRemoval(self):
+
+        # as --events sees it, the torrent named by a TorrentRemovedEvent is missing from the reply
+        delugeInfo = self.createDelugeInfo(["--limit=1", "--sortby=download"])
+        self.poll(delugeInfo, {
+            "a": createTorrentStatus("Torrent A", "Downloading", 300.0),
+            "b": createTorrentStatus("Torrent B", "Downloading", 200.0)
+        }, False)
+
+        delugeInfo.store.clearChanges()
+        delugeInfo.store.update({}, ["a"])
+        output = delugeInfo.getOutput()
+        self.assertNotEqual(output, None)
+        self.assertNotIn("Torrent A", output)
+        self.assertIn("Torrent B", output)
+
+class WriteFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testReplacesFile(self):
+        path = os.path.join(self.directory, "output")
+        conkyDeluge.writeFile(path, b"first")
+        conkyDeluge.writeFile(path, b"second")
+        with open(path, "rb") as fileinput:
+            self.assertEqual(fileinput.read(), b"second")
+        self.assertEqual(os.listdir(self.directory), ["output"])
+
+    def testFailedRenameLeavesNoTemporaryFile(self):
+        # renaming a file over a directory fails once the file is written
+        path = os.path.join(self.directory, "output")
+        os.mkdir(path)
+        self.assertRaises(OSError, conkyDeluge.writeFile, path, b"data")
+        self.assertEqual(os.listdir(self.directory), ["output"])
+
+class TorrentTemplateTest(unittest.TestCase):
+
+    def render(self, text, torrent_status):
+        return Template(text, TorrentData.FIELDS, getTorrentGetter).render(torrent_status)
+
+    def testFields(self):
+        torrent_status = createTorrentStatus("A", "Downloading", 1536.0)
+        torrent_status.update({"num_peers": 3, "ratio": 0.5, "download_graph": None})
+        self.assertEqual(self.render("[name] [state] [totaldone]/[totalsize] [progress] [downloadrate] [uploadrate] [eta] [currentpeers] [ratio] [dlgraph]|[other]\n", torrent_status),
+            "A Downloading 1.0 KiB/2.0 KiB 50.0% 1.5 KiB/s 0.0 KiB/s 1m 0s 3 0.500 |[other]\n")
+
+    def testMissingValues(self):
+        # a status missing a value or holding None shows it as unknown, as with the rest of the fields
+        torrent_status = createTorrentStatus("A", "Downloading", 0.0)
+        del torrent_status["total_done"]
+        torrent_status["eta"] = None
+        self.assertEqual(self.render("[name] [totaldone] [progress] [eta] [nofiles] [ulgraph]|\n", torrent_status), "A ??.? KiB 50.0% Unknown ? |\n")
+
+    def testProgress(self):
+        for (progress, text) in ((0.0, "0.0%"), (33.333, "33.33%"), (33.7, "33.7%"), (99.994, "99.99%"), (99.999, "100.0%"), (100.0, "100.0%")):
+            self.assertEqual(conkyDeluge.fprogress(progress), str(round(progress,2)) + "%")
+            self.assertEqual(conkyDeluge.fprogress(progress), text)
+
+class TemplateReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeTemplate(self, path, text, mtime):
+        with open(path, "w") as fileoutput:
+            fileoutput.write(text)
+        os.utime(path, (mtime, mtime))
+
+    def testSectionTemplateReload(self):
+        path = os.path.join(self.directory, "section.template")
+        self.writeTemplate(path, "[name]\n", 1)
+        (options, args) = CommandLineParser().parser.parse_args(["--daemon", "--sectiondir", self.directory, "--section", "top:--torrenttemplate=" + path])
+        daemon = DelugeDaemon(options)
+        self.assertNotIn("ratio", daemon.sections[0].keys)
+        self.assertNotIn("ratio", daemon.keys)
+
+        self.writeTemplate(path, "[name] [ratio]\n", 2)
+        daemon.reloadTemplates()
+        self.assertIn("ratio", daemon.sections[0].keys)
+        self.assertIn("ratio", daemon.keys)
+
+class EmptyRecordsTest(unittest.TestCase):
+
+    def render(self, args, torrents_status):
+        (options, args) = CommandLineParser().parser.parse_args(args)
+        delugeInfo = DelugeInfo(options)
+        delugeInfo.torrents_status = torrents_status
+        delugeInfo.fetched = True
+        self.assertTrue(delugeInfo.hasRecordsOutput())
+        return delugeInfo.getEncodedOutput()
+
+    def testNoTorrents(self):
+        self.assertEqual(json.loads(self.render(["--format=json", "--state=Allocating"], {}).decode("utf-8")), {"summary": None, "torrents": []})
+        self.assertEqual(self.render(["--format=jsonl", "--state=Allocating"], {}), b"")
+
+    def testNoTorrentsWithSummary(self):
+        # a summary of no torrents, whether none were sent or none of them is active
+        for torrents_status in ({}, {"a": createTorrentStatus("Torrent A", "Paused", 0.0)}):
+            document = json.loads(self.render(["--format=json", "--showsummary", "--activeonly"], torrents_status).decode("utf-8"))
+            self.assertEqual(document["summary"]["torrents"], 0)
+            self.assertEqual(document["torrents"], [])
+
+    def testUnreachableCore(self):
+        (options, args) = CommandLineParser().parser.parse_args(["--format=json"])
+        self.assertFalse(DelugeInfo(options).hasRecordsOutput())
+
+@unittest.skipIf(task == None, "twisted is not installed")
+class DeadlineTest(unittest.TestCase):
+
+    class Client:
+
+        def __init__(self):
+            self.disconnects = 0
+
+        def disconnect(self):
+            self.disconnects = self.disconnects + 1
+
+    def setUp(self):
+        # the deadline's timer runs on a clock advanced by hand
+        self.reactor = conkyDeluge.reactor
+        self.clock = task.Clock()
+        conkyDeluge.reactor = self.clock
+
+    def tearDown(self):
+        conkyDeluge.reactor = self.reactor
+
+    def testTimeout(self):
+        request = defer.Deferred()
+        client = self.Client()
+        failures = []
+        conkyDeluge.withDeadline(request, 5, "Connection", client).addErrback(failures.append)
+
+        self.clock.advance(5)
+        self.assertEqual(len(failures), 1)
+        self.assertTrue(failures[0].check(defer.TimeoutError))
+        self.assertEqual(client.disconnects, 1)
+
+        # the request is cancelled, so a late answer is ignored rather than passed on
+        self.assertTrue(request.called)
+        request.callback("late")
+        self.assertEqual(len(failures), 1)
+
+    def testResult(self):
+        request = defer.Deferred()
+        client = self.Client()
+        results = []
+        conkyDeluge.withDeadline(request, 5, "Connection", client).addCallback(results.append)
+
+        request.callback("answer")
+        self.clock.advance(5)
+        self.assertEqual(results, ["answer"])
+        self.assertEqual(client.disconnects, 0)
+
+class SortSpecTest(unittest.TestCase):
+
+    class Status(dict):
+
+        # counts the values looked up, to check each field is only read once
+        def __init__(self, *args):
+            dict.__init__(self, *args)
+            self.lookups = 0
+
+        def get(self, key, default=None):
+            self.lookups = self.lookups + 1
+            return dict.get(self, key, default)
+
+    def sort(self, spec, torrents_status):
+        sortspec = SortSpec(spec)
+        return sorted(torrents_status, key=lambda torrentid: sortspec.getSortKey(torrents_status[torrentid]))
+
+    def testParse(self):
+        # state comes first unless it is placed elsewhere, each field has its own default direction
+        self.assertEqual(SortSpec("eta").fields, [("state", True), ("eta", False)])
+        self.assertEqual(SortSpec("download-, Ratio+").fields, [("state", True), ("download", True), ("ratio", False)])
+        self.assertEqual(SortSpec("eta,state+").fields, [("eta", False), ("state", False)])
+        self.assertEqual(str(SortSpec("upload")), "state-,upload-")
+
+        sortspec = SortSpec("size,queue,")
+        self.assertEqual(sortspec.unknown, ["size"])
+        self.assertEqual(sortspec.fields, [("state", True), ("queue", False)])
+
+    def testStateFirst(self):
+        torrents_status = {
+            "paused": createTorrentStatus("Paused", "Paused", 0.0),
+            "seeding": createTorrentStatus("Seeding", "Seeding", 0.0),
+            "downloading": createTorrentStatus("Downloading", "Downloading", 0.0),
+            "queued": createTorrentStatus("Queued", "Queued", 0.0)
+        }
+        self.assertEqual(self.sort("download", torrents_status), ["downloading", "seeding", "queued", "paused"])
+
+    def testETA(self):
+        # a finished torrent comes first and one with an unknown eta last, as before
+        torrents_status = {}
+        for (torrentid, eta) in (("unknown", -1), ("later", 600), ("done", 0), ("soon", 60)):
+            torrents_status[torrentid] = createTorrentStatus(torrentid, "Downloading", 0.0)
+            torrents_status[torrentid]["eta"] = eta
+        self.assertEqual(self.sort("eta", torrents_status), ["done", "soon", "later", "unknown"])
+        self.assertEqual(self.sort("eta-", torrents_status), ["unknown", "later", "soon", "done"])
+
+    def testSeveralFields(self):
+        torrents_status = {
+            "a": createTorrentStatus("A", "Downloading", 0.0),
+            "b": createTorrentStatus("B", "Downloading", 100.0),
+            "c": createTorrentStatus("C", "Downloading", 0.0),
+            "d": createTorrentStatus("D", "Downloading", 100.0)
+        }
+        torrents_status["a"]["ratio"] = 2.0
+        torrents_status["c"]["ratio"] = 0.0
+        torrents_status["b"]["ratio"] = 0.5
+        torrents_status["d"]["ratio"] = 1.0
+        self.assertEqual(self.sort("download,ratio", torrents_status), ["d", "b", "a", "c"])
+        self.assertEqual(self.sort("download+,ratio+", torrents_status), ["c", "a", "b", "d"])
+
+    def testEachFieldReadOnce(self):
+        # a zero rate sorted highest first is still only read once
+        torrent_status = self.Status(createTorrentStatus("A", "Downloading", 0.0))
+        sortkey = SortSpec("download,upload").getSortKey(torrent_status)
+        self.assertEqual(sortkey, (-4, 0, 0))
+        self.assertEqual(torrent_status.lookups, 3)
+
+class TorrentOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sortspec = SortSpec("download")
+        self.sortkeys = 0
+        self.store = TorrentStore(["name", "state", "download_payload_rate"])
+        torrents_status = {}
+        for index in range(40):
+            torrents_status["t%02d" % index] = createTorrentStatus("T%02d" % index, "Downloading", float(index))
+        self.store.apply(torrents_status, False)
+        self.ordering = TorrentOrder(self.getSortKey, self.isListed)
+        self.ordering.update(self.store)
+
+    def getSortKey(self, torrent_status):
+        self.sortkeys = self.sortkeys + 1
+        return self.sortspec.getSortKey(torrent_status)
+
+    def isListed(self, torrent_status):
+        return torrent_status.get("state") != "Paused"
+
+    def getExpected(self, limit=0):
+        torrentids = [torrentid for torrentid in self.store.torrents_status if self.isListed(self.store.torrents_status[torrentid])]
+        torrentids.sort(key=lambda torrentid: self.sortspec.getSortKey(self.store.torrents_status[torrentid]))
+        return torrentids[:limit or len(torrentids)]
+
+    def poll(self, diff, removed=[]):
+        # a diff holds every torrent still there, those unchanged with no values
+        torrents_status = dict([(torrentid, {}) for torrentid in self.store.torrents_status if torrentid not in removed])
+        torrents_status.update(diff)
+        self.assertTrue(self.store.apply(torrents_status, True))
+        self.sortkeys = 0
+        self.ordering.update(self.store)
+
+    def testOnlyChangesSorted(self):
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 0), self.getExpected())
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 5), ["t39", "t38", "t37", "t36", "t35"])
+
+        self.poll({"t00": {"download_payload_rate": 1000.0}, "t39": {"download_payload_rate": 0.5}, "t20": {"state": "Seeding"}})
+        self.assertEqual(self.sortkeys, 3)
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 0), self.getExpected())
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 3), ["t00", "t38", "t37"])
+
+        # torrents with the same sort key keep the store's order, whichever moved last
+        self.poll({"t30": {"download_payload_rate": 10.0}, "t05": {"download_payload_rate": 10.0}})
+        self.assertEqual(self.sortkeys, 2)
+        torrentids = self.ordering.getTorrentIds(self.store.torrents_status, 0)
+        self.assertEqual(torrentids, self.getExpected())
+        self.assertEqual(torrentids[torrentids.index("t11"):torrentids.index("t09")], ["t11", "t05", "t10", "t30"])
+
+        # nothing changed, nothing is sorted
+        self.poll({})
+        self.assertEqual(self.sortkeys, 0)
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 0), self.getExpected())
+
+    def testRandomPolls(self):
+        random = Random(1)
+        states = ["Downloading", "Seeding", "Paused"]
+        for poll in range(200):
+            torrentids = list(self.store.torrents_status)
+            diff = {}
+            for torrentid in random.sample(torrentids, random.randint(0, 6)):
+                diff[torrentid] = {"download_payload_rate": float(random.randint(0, 5)), "state": random.choice(states)}
+            if random.random() < 0.3:
+                torrentid = "n%03d" % poll
+                diff[torrentid] = createTorrentStatus(torrentid, random.choice(states), float(random.randint(0, 5)))
+            removed = random.sample(torrentids, random.random() < 0.3 and 1 or 0)
+            self.poll(diff, removed)
+            self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 0), self.getExpected())
+            self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 7), self.getExpected(7))
+
+    def testRemovedAndUnlisted(self):
+        self.poll({"t37": {"state": "Paused"}, "t40": createTorrentStatus("T40", "Downloading", 37.5)}, ["t38"])
+        self.assertEqual(self.store.removed, set(["t38"]))
+        self.assertEqual(self.sortkeys, 1)
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 4), ["t39", "t40", "t36", "t35"])
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 0), self.getExpected())
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, -1), [])
+
+        # listed again once it's no longer paused
+        self.poll({"t37": {"state": "Downloading"}})
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 0), self.getExpected())
+
+    def testRebuild(self):
+        # a set of changes that was never sorted in leaves the order to be worked out again
+        self.store.apply({"t01": createTorrentStatus("T01", "Downloading", 500.0)}, False)
+        self.poll({"t02": createTorrentStatus("T02", "Downloading", 5.0)})
+        self.assertEqual(self.sortkeys, 2)
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 0), ["t01", "t02"])
+
+        # as is a change to most of the torrents
+        self.poll(dict([(torrentid, {"download_payload_rate": 1.0}) for torrentid in self.store.torrents_status]))
+        self.assertEqual(self.ordering.getTorrentIds(self.store.torrents_status, 0), ["t01", "t02"])
+
+def tryLock(path):
+    # exits with 0 if the lock could be taken without waiting
+    fileinput = open(path, "a")
+    try:
+        fcntl.flock(fileinput.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os._exit(1)
+    os._exit(0)
+
+class SnapshotCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "snapshot")
+        self.torrents_status = {"a": createTorrentStatus("Torrent A", "Downloading", 1024.0)}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testSaveAndLoad(self):
+        cache = SnapshotCache(self.path, 5)
+        self.assertEqual(cache.load(["name"], None), None)
+
+        cache.save(["name", "state"], ["Downloading", "Seeding"], self.torrents_status)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(cache.load(["name"], ["Seeding"]), (["Downloading", "Seeding"], self.torrents_status))
+
+        # a snapshot without every key or state wanted is no use
+        self.assertEqual(cache.load(["name", "ratio"], ["Seeding"]), None)
+        self.assertEqual(cache.load(["name"], ["Paused"]), None)
+        self.assertEqual(cache.load(["name"], None), None)
+
+    def testExpiry(self):
+        cache = SnapshotCache(self.path, 5)
+        cache.save(["name"], None, self.torrents_status)
+        self.assertEqual(cache.load(["name"], ["Seeding"]), (None, self.torrents_status))
+
+        # an expired snapshot still tells a refresh which keys other calls want, for a while
+        expired = time.time() - 10
+        os.utime(self.path, (expired, expired))
+        self.assertEqual(cache.load(["name"], None), None)
+        self.assertEqual(cache.getShared(), (["name"], None))
+
+        expired = time.time() - 5 * (SnapshotCache.KEYS_KEPT_FOR_TTLS + 1)
+        os.utime(self.path, (expired, expired))
+        self.assertEqual(cache.getShared(), None)
+
+    def testCorrupt(self):
+        with open(self.path, "wb") as fileoutput:
+            fileoutput.write(SnapshotCache.MAGIC + b"\xff")
+        self.assertEqual(SnapshotCache(self.path, 5).load(["name"], None), None)
+
+    def testUserDirectory(self):
+        environ = os.environ.get("XDG_RUNTIME_DIR")
+        os.environ["XDG_RUNTIME_DIR"] = self.directory
+        try:
+            self.assertEqual(SnapshotCache("conkydeluge.cache", 5).path, os.path.join(self.directory, "conkydeluge.cache"))
+            self.assertEqual(SnapshotCache("~/conkydeluge.cache", 5).path, os.path.expanduser("~/conkydeluge.cache"))
+        finally:
+            if environ == None:
+                del os.environ["XDG_RUNTIME_DIR"]
+            else:
+                os.environ["XDG_RUNTIME_DIR"] = environ
+
+    def testLock(self):
+        cache = SnapshotCache(self.path, 5)
+        cache.lock()
+        try:
+            self.assertEqual(os.stat(self.path + ".lock").st_mode & 0o777, 0o600)
+            process = multiprocessing.Process(target=tryLock, args=(self.path + ".lock",))
+            process.start()
+            process.join()
+            self.assertEqual(process.exitcode, 1)
+        finally:
+            cache.unlock()
+
+        process = multiprocessing.Process(target=tryLock, args=(self.path + ".lock",))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+    @unittest.skipUnless(os.getuid() == 0, "files can only be given to another user as root")
+    def testOtherUsersFiles(self):
+        cache = SnapshotCache(self.path, 5)
+        cache.save(["name"], None, self.torrents_status)
+        os.chown(self.path, 65534, 65534)
+        self.assertEqual(cache.load(["name"], None), None)
+
+        with open(self.path + ".lock", "w"):
+            pass
+        os.chown(self.path + ".lock", 65534, 65534)
+        self.assertRaises(IOError, cache.lock)
+
+class BackoffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = os.environ.get("XDG_RUNTIME_DIR")
+        os.environ["XDG_RUNTIME_DIR"] = self.directory
+
+    def tearDown(self):
+        if self.environ == None:
+            del os.environ["XDG_RUNTIME_DIR"]
+        else:
+            os.environ["XDG_RUNTIME_DIR"] = self.environ
+        shutil.rmtree(self.directory)
+
+    def testSharedBetweenCalls(self):
+        backoff = Backoff("127.0.0.1:58846", 10, 15)
+        self.assertEqual(backoff.getWait(), 0)
+        self.assertEqual(backoff.failed(), 10)
+        self.assertEqual(backoff.failed(), 15)
+        self.assertEqual(os.listdir(self.directory), ["conkydeluge-127.0.0.1_58846.backoff"])
+        self.assertEqual(os.stat(backoff.path).st_mode & 0o777, 0o600)
+
+        # the next exec call picks up the failures so far
+        backoff = Backoff("127.0.0.1:58846", 10, 15)
+        self.assertEqual(backoff.failures, 2)
+        self.assertTrue(backoff.getWait() > 14)
+
+        backoff.succeeded()
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(Backoff("127.0.0.1:58846", 10, 15).failures, 0)
+
+    @unittest.skipUnless(os.getuid() == 0, "files can only be given to another user as root")
+    def testOtherUsersFile(self):
+        Backoff("127.0.0.1:58846", 10, 15).failed()
+        os.chown(os.path.join(self.directory, "conkydeluge-127.0.0.1_58846.backoff"), 65534, 65534)
+        self.assertEqual(Backoff("127.0.0.1:58846", 10, 15).failures, 0)
+
+def sampleHistory(path, count):
+    # one exec call after another, each fetching the status and adding its sample to the history file
+    (options, args) = CommandLineParser().parser.parse_args(["--historyfile=" + path, "--history=1000"])
+    for index in range(count):
+        delugeInfo = DelugeInfo(options)
+        delugeInfo.torrents_status = {"a": createTorrentStatus("Torrent A", "Downloading", 1024.0)}
+        delugeInfo.fetched = True
+        delugeInfo.updateHistory()
+
+class RateHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testWraparound(self):
+        history = RateHistory(3)
+        for downloadrate in (1.0, 2.0, 3.0, 4.0, 5.0):
+            history.record({"a": createTorrentStatus("Torrent A", "Downloading", downloadrate)})
+
+        # only the latest samples are kept, oldest first
+        self.assertEqual(history.getSamples(history.torrents["a"], 0), [3.0, 4.0, 5.0])
+        self.assertEqual(history.getSamples(history.states["Downloading"], 0), [3.0, 4.0, 5.0])
+
+        # a torrent first seen after the ring wrapped has only its own samples
+        history.record({"a": createTorrentStatus("Torrent A", "Downloading", 6.0), "b": createTorrentStatus("Torrent B", "Seeding", 7.0)})
+        self.assertEqual(history.getSamples(history.torrents["a"], 0), [4.0, 5.0, 6.0])
+        self.assertEqual(history.getSamples(history.torrents["b"], 0), [7.0])
+
+        path = os.path.join(self.directory, "history")
+        history.save(path)
+        loaded = RateHistory(3)
+        self.assertTrue(loaded.load(path))
+        self.assertEqual(loaded.getSamples(loaded.torrents["a"], 0), [4.0, 5.0, 6.0])
+        self.assertFalse(RateHistory(4).load(path))
+
+    def testConcurrentCalls(self):
+        # samples taken at the same time are all kept rather than one call's save replacing another's
+        path = os.path.join(self.directory, "history")
+        processes = [multiprocessing.Process(target=sampleHistory, args=(path, 10)) for index in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        history = RateHistory(1000)
+        self.assertTrue(history.load(path))
+        self.assertEqual(history.count, 40)
+
+class RencodeTest(unittest.TestCase):
+
+    # encodings checked against the rencode package, at each boundary between typecodes
+    CASES = [
+        (0, b"\x00"),
+        (43, b"+"),
+        (44, b">,"),
+        (-1, b"F"),
+        (-32, b"e"),
+        (-33, b">\xdf"),
+        (127, b">\x7f"),
+        (128, b"?\x00\x80"),
+        (-128, b">\x80"),
+        (-129, b"?\xff\x7f"),
+        (32767, b"?\x7f\xff"),
+        (32768, b"@\x00\x00\x80\x00"),
+        (-32769, b"@\xff\xff\x7f\xff"),
+        (2 ** 31 - 1, b"@\x7f\xff\xff\xff"),
+        (2 ** 31, b"A\x00\x00\x00\x00\x80\x00\x00\x00"),
+        (-2 ** 31 - 1, b"A\xff\xff\xff\xff\x7f\xff\xff\xff"),
+        (2 ** 63 - 1, b"A\x7f\xff\xff\xff\xff\xff\xff\xff"),
+        (2 ** 63, b"=9223372036854775808\x7f"),
+        (-2 ** 63 - 1, b"=-9223372036854775809\x7f"),
+        ("", b"\x80"),
+        ("a" * 63, b"\xbf" + b"a" * 63),
+        ("a" * 64, b"64:" + b"a" * 64),
+        ("\u00dcn\u00efc\u00f6d\u00e9", b"\x8b\xc3\x9cn\xc3\xafc\xc3\xb6d\xc3\xa9"),
+        ((), b"\xc0"),
+        ((0,) * 63, b"\xff" + b"\x00" * 63),
+        ((0,) * 64, b";" + b"\x00" * 64 + b"\x7f"),
+        ({}, b"f"),
+        (dict([(key, 0) for key in range(24)]), b"~" + b"".join([bytes((key, 0)) for key in range(24)])),
+        (dict([(key, 0) for key in range(25)]), b"<" + b"".join([bytes((key, 0)) for key in range(25)]) + b"\x7f"),
+        (None, b"E"),
+        (True, b"C"),
+        (False, b"D"),
+        (0.5, b"B?\x00\x00\x00")
+    ]
+
+    def testEncode(self):
+        for (value, encoded) in self.CASES:
+            self.assertEqual(Rencode().dumps(value), encoded, repr(value))
+
+    def testDecode(self):
+        for (value, encoded) in self.CASES:
+            self.assertEqual(Rencode().loads(encoded, decode_utf8=True), value, repr(value))
+
+    def testNestedRoundTrip(self):
+        value = ((1, "core.get_torrents_status", ({"state": "Seeding"}, ["name", "ratio"], False), {}),)
+        decoded = Rencode().loads(Rencode().dumps(value), decode_utf8=True)
+        self.assertEqual(decoded, ((1, "core.get_torrents_status", ({"state": "Seeding"}, ("name", "ratio"), False), {}),))
+
+    def testTrailingData(self):
+        self.assertRaises(ValueError, Rencode().loads, b"\x00\x00")
+
+class RPCFramingTest(unittest.TestCase):
+
+    class Writer:
+
+        def __init__(self):
+            self.data = b""
+
+        def write(self, data):
+            self.data = self.data + data
+
+    def createClient(self, protocol):
+        client = DelugeRPCClient("127.0.0.1", 58846, "", "", protocol)
+        client.rencode = Rencode()
+        return client
+
+    def receiveAll(self, client, data, count):
+
+        async def receive():
+            client.reader = asyncio.StreamReader()
+            client.reader.feed_data(data)
+            client.reader.feed_eof()
+            return [await client.receive() for index in range(count)]
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(receive())
+        finally:
+            loop.close()
+
+    def testProtocol2Header(self):
+        client = self.createClient(2)
+        client.writer = self.Writer()
+        client.send(((1, "daemon.info", (), {}),))
+
+        body = zlib.compress(Rencode().dumps(((1, "daemon.info", (), {}),)))
+        self.assertEqual(client.writer.data, b"\x01" + len(body).to_bytes(4, "big") + body)
+
+        responses = [(DelugeRPCClient.RPC_RESPONSE, 1, "2.1.1"), (DelugeRPCClient.RPC_RESPONSE, 2, {"a": 10})]
+        data = b""
+        for response in responses:
+            body = zlib.compress(Rencode().dumps(response))
+            data = data + DelugeRPCClient.HEADER.pack(DelugeRPCClient.PROTOCOL_VERSION, len(body)) + body
+        self.assertEqual(self.receiveAll(client, data, 2), responses)
+
+    def testProtocol2UnknownVersion(self):
+        body = zlib.compress(Rencode().dumps((DelugeRPCClient.RPC_RESPONSE, 1, None)))
+        data = DelugeRPCClient.HEADER.pack(2, len(body)) + body
+        self.assertRaises(conkyDeluge.DelugeRPCError, self.receiveAll, self.createClient(2), data, 1)
+
+    def testProtocol1Streams(self):
+        client = self.createClient(1)
+        client.writer = self.Writer()
+        client.send(((1, "daemon.login", ("", ""), {}),))
+        self.assertEqual(client.writer.data, zlib.compress(Rencode().dumps(((1, "daemon.login", ("", ""), {}),))))
+
+        # deluge 1.3 messages follow each other with nothing between them
+        responses = [(DelugeRPCClient.RPC_RESPONSE, 1, 10), (DelugeRPCClient.RPC_ERROR, 2, ("BadLoginError", "Password does not match", ""))]
+        data = b"".join([zlib.compress(Rencode().dumps(response)) for response in responses])
+        self.assertEqual(self.receiveAll(client, data, 2), responses)
+        self.assertEqual(client.getErrorText(responses[1]), "BadLoginError: Password does not match")
+
+    def testProtocol2ErrorText(self):
+        message = (DelugeRPCClient.RPC_ERROR, 2, "BadLoginError", ("Password does not match",), {}, "")
+        self.assertEqual(self.createClient(2).getErrorText(message), "BadLoginError: Password does not match")
+
+if __name__ == '__main__':
+    unittest.main()